@@ -3,6 +3,8 @@ from datasette import hookimpl
 from .internal_migrations import internal_migrations
 from sqlite_utils import Database
 from urllib.parse import urlencode
+import json
+import logging
 import os
 
 from . import hookspecs
@@ -10,10 +12,14 @@ from . import hookspecs
 from datasette.plugins import pm
 from datasette_vite import vite_entry
 
-from .notifier import Notifier, Message, ConfigElement
+from .notifier import Notifier, Message, ConfigElement, SendContext, RateLimited
 from .alert_type import AlertType
 from .destinations import send_to_destination, DestinationNotFound, NotifierNotFound
+from .http_client import close_http_client
 from .internal_db import InternalDB, NewAlertRouteParameters, NewSubscription
+from .registry import get_alert_type_registry, get_notifier_registry
+from .settings import get_settings
+from .trigger_db import upgrade_legacy_queue
 
 _ = (InternalDB, NewAlertRouteParameters, NewSubscription)
 
@@ -27,6 +33,8 @@ __all__ = [
     Notifier,
     Message,
     ConfigElement,
+    SendContext,
+    RateLimited,
     AlertType,
     send_to_destination,
     DestinationNotFound,
@@ -35,6 +43,8 @@ __all__ = [
 
 pm.add_hookspecs(hookspecs)
 
+logger = logging.getLogger("datasette_alerts")
+
 
 def _frequency_to_interval(frequency: str) -> dict:
     """Convert SQLite date offset to cron interval seconds.
@@ -48,18 +58,58 @@ def _frequency_to_interval(frequency: str) -> dict:
     return {"interval": value * multipliers.get(unit, 60)}
 
 
+def _cursor_scan_task_name(
+    database_name: str, table_name: str, timestamp_column: str
+) -> str:
+    return f"alerts:cursor-scan:{database_name}/{table_name}/{timestamp_column}"
+
+
+async def _sync_cursor_scan_task(
+    datasette, database_name: str, table_name: str, timestamp_column: str
+):
+    """Register, update or remove the shared scan task for one cursor alert group.
+
+    Cursor alerts watching the same table and timestamp column share a single
+    task, scheduled at the shortest frequency in the group.
+    """
+    scheduler = datasette._cron_scheduler
+    internal_db = InternalDB(datasette.get_internal_database())
+    alerts = await internal_db.get_cursor_alerts_in_group(
+        database_name, table_name, timestamp_column
+    )
+    name = _cursor_scan_task_name(database_name, table_name, timestamp_column)
+    if not alerts:
+        await scheduler.remove_task(name)
+        return
+    interval = min(_frequency_to_interval(a.frequency)["interval"] for a in alerts)
+    # add_task and update_task both reschedule the next run, so leave an
+    # unchanged task alone: adding an alert to a busy group (or restarting)
+    # must not keep pushing the group's next scan back.
+    task = await scheduler.internal_db.get_task(name)
+    if task is None:
+        await scheduler.add_task(
+            name=name,
+            handler="alerts:cursor-scan",
+            schedule={"interval": interval},
+            config={
+                "database_name": database_name,
+                "table_name": table_name,
+                "timestamp_column": timestamp_column,
+            },
+            overlap="skip",
+        )
+    elif json.loads(task.schedule_config).get("seconds") != interval:
+        await scheduler.update_task(name, schedule={"interval": interval})
+
+
 async def _register_cron_task_for_alert(datasette, alert):
     scheduler = datasette._cron_scheduler
     alert_id = alert.id
     alert_type = alert.alert_type
 
     if alert_type == "cursor":
-        await scheduler.add_task(
-            name=f"alerts:cursor:{alert_id}",
-            handler="alerts:cursor-check",
-            schedule=_frequency_to_interval(alert.frequency),
-            config={"alert_id": alert_id},
-            overlap="skip",
+        await _sync_cursor_scan_task(
+            datasette, alert.database_name, alert.table_name, alert.timestamp_column
         )
     elif alert_type == "trigger":
         pass  # handled by global trigger-drain task
@@ -79,11 +129,39 @@ async def _sync_alerts_to_cron(datasette):
     scheduler = datasette._cron_scheduler
     internal_db = InternalDB(datasette.get_internal_database())
     alerts = await internal_db.get_all_alerts()
+    cursor_groups = set()
     for alert in alerts:
+        if alert.alert_type == "cursor":
+            # Per-alert cursor tasks predate the shared group scan
+            await scheduler.remove_task(f"alerts:cursor:{alert.id}")
+            cursor_groups.add(
+                (alert.database_name, alert.table_name, alert.timestamp_column)
+            )
+            continue
         await _register_cron_task_for_alert(datasette, alert)
+    for database_name, table_name, timestamp_column in cursor_groups:
+        await _sync_cursor_scan_task(
+            datasette, database_name, table_name, timestamp_column
+        )
+    # Delivery workers drain the outbox that every alert check writes to
+    await scheduler.add_task(
+        name="alerts:deliver",
+        handler="alerts:deliver",
+        schedule={"interval": 1},
+        config={},
+        overlap="skip",
+    )
+    await scheduler.add_task(
+        name="alerts:maintenance",
+        handler="alerts:maintenance",
+        schedule={"interval": 60},
+        config={},
+        overlap="skip",
+    )
     # Also ensure the global trigger drain task exists if there are trigger alerts
     trigger_alerts = [a for a in alerts if a.alert_type == "trigger"]
     if trigger_alerts:
+        await _upgrade_legacy_trigger_queues(datasette)
         await scheduler.add_task(
             name="alerts:trigger-drain",
             handler="alerts:trigger-drain",
@@ -93,44 +171,87 @@ async def _sync_alerts_to_cron(datasette):
         )
 
 
+async def _upgrade_legacy_trigger_queues(datasette):
+    """Move trigger alerts from per-alert queue tables to the shared one."""
+    internal_db = InternalDB(datasette.get_internal_database())
+    for alert in await internal_db.get_trigger_alerts():
+        db = datasette.databases.get(alert.database_name)
+        if db is None:
+            continue
+        try:
+            await upgrade_legacy_queue(
+                db,
+                alert.alert_id,
+                alert.table_name,
+                alert.id_columns,
+                alert.filter_params,
+            )
+        except Exception as e:
+            logger.warning(
+                "Could not upgrade queue table for alert %s: %r", alert.alert_id, e
+            )
+
+
 async def trigger_alert_check(datasette, alert_id):
     """Trigger an immediate check for an alert, outside its normal schedule."""
     scheduler = datasette._cron_scheduler
-    # Try all possible task name patterns
-    for prefix in ["alerts:cursor:", "alerts:custom:"]:
-        task_name = f"{prefix}{alert_id}"
-        try:
-            await scheduler.trigger_task(task_name)
-            return
-        except Exception:
-            continue
-    raise ValueError(f"No cron task found for alert {alert_id}")
+    internal_db = InternalDB(datasette.get_internal_database())
+    alert = await internal_db.get_alert_for_check(alert_id)
+    if alert is not None and alert.alert_type == "cursor":
+        # Make the alert due, then run its group's shared scan
+        await internal_db.reset_last_check(alert_id)
+        await scheduler.trigger_task(
+            _cursor_scan_task_name(
+                alert.database_name, alert.table_name, alert.timestamp_column
+            )
+        )
+        return
+    try:
+        await scheduler.trigger_task(f"alerts:custom:{alert_id}")
+    except Exception:
+        raise ValueError(f"No cron task found for alert {alert_id}")
 
 
 @hookimpl
 async def startup(datasette):
+    # Fail at startup rather than on the first scheduled check
+    get_settings(datasette)
+
     def migrate(connection):
         db = Database(connection)
         internal_migrations.apply(db)
 
     await datasette.get_internal_database().execute_write_fn(migrate)
 
+    # Build the notifier and alert type registries up front
+    await get_notifier_registry(datasette)
+    get_alert_type_registry(datasette)
+
     # Sync all existing alerts to cron tasks
     await _sync_alerts_to_cron(datasette)
 
 
+@hookimpl
+async def shutdown(datasette):
+    await close_http_client(datasette)
+
+
 @hookimpl
 def cron_register_handlers(datasette):
     from .handlers import (
-        cursor_alert_handler,
+        cursor_scan_handler,
+        delivery_handler,
+        maintenance_handler,
         trigger_queue_handler,
         custom_alert_handler,
     )
 
     return {
-        "cursor-check": cursor_alert_handler,
+        "cursor-scan": cursor_scan_handler,
         "trigger-drain": trigger_queue_handler,
         "custom-check": custom_alert_handler,
+        "deliver": delivery_handler,
+        "maintenance": maintenance_handler,
     }
 
 
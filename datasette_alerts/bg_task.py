@@ -2,6 +2,8 @@
 
 The bg_task loop has been replaced by cron handlers in handlers.py.
 This module re-exports helpers that external code may still import.
+_send_for_subscription sends immediately, bypassing the outbox; it is
+legacy compatibility code, not part of the delivery pipeline.
 """
 
 from .handlers import (  # noqa: F401
@@ -0,0 +1,264 @@
+"""Keyset scans and index management for cursor alerts.
+
+Cursor alerts poll the user's table ordered by (timestamp_column, key
+columns). These helpers build that query, check whether SQLite can answer
+it from an index, and optionally create one.
+"""
+
+import json
+import sqlite3
+
+from datasette.database import Database
+
+
+def _has_rowid(conn, table_name: str) -> bool:
+    try:
+        conn.execute(f"SELECT rowid FROM [{table_name}] LIMIT 0")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+async def cursor_key_columns(
+    db: Database, table_name: str, id_columns: list[str]
+) -> list[str]:
+    """The keyset tie-breaker columns for a cursor alert.
+
+    Composite keys fall back to rowid so the cursor stays a single value,
+    except on WITHOUT ROWID tables, which are keyed on the full primary key.
+    """
+    if len(id_columns) == 1:
+        return list(id_columns)
+    if id_columns and not await db.execute_fn(
+        lambda conn: _has_rowid(conn, table_name)
+    ):
+        return list(id_columns)
+    return ["rowid"]
+
+
+def cursor_item_id_sql(id_columns: list[str]) -> str:
+    """SQL for the id logged and sent for each new row.
+
+    Composite keys are reported as a json_array() of their columns.
+    """
+    if len(id_columns) == 1:
+        return f"[{id_columns[0]}]"
+    if not id_columns:
+        return "rowid"
+    return "json_array(" + ", ".join(f"[{c}]" for c in id_columns) + ")"
+
+
+def _columns_sql(columns: list[str]) -> str:
+    return ", ".join(f"[{c}]" for c in columns)
+
+
+def _cursor_id_sql(key_columns: list[str]) -> str:
+    """SQL for the cursor id stored with each log: the key column's value,
+    or a json_array() of the values for a multi-column key."""
+    if len(key_columns) == 1:
+        return f"[{key_columns[0]}]"
+    return f"json_array({_columns_sql(key_columns)})"
+
+
+def _key_params(name: str, key_columns: list[str]) -> list[str]:
+    if len(key_columns) == 1:
+        return [f"{name}_id"]
+    return [f"{name}_id_{i}" for i in range(len(key_columns))]
+
+
+def _bind_cursor_id(params: dict, name: str, key_columns: list[str], cursor_id):
+    values = [cursor_id] if len(key_columns) == 1 else json.loads(cursor_id)
+    params.update(zip(_key_params(name, key_columns), values))
+
+
+def _after_sql(
+    ts_column: str,
+    key_columns: list[str],
+    name: str,
+    has_cursor_id: bool,
+    op: str = ">",
+) -> str:
+    """Test for rows after the cursor bound as :name and its key params.
+
+    Comparing against the columns themselves keeps their affinity and
+    collation, so the test matches the scan's ORDER BY.
+    """
+    if has_cursor_id:
+        bound = ", ".join(f":{p}" for p in _key_params(name, key_columns))
+        return (
+            f"([{ts_column}], {_columns_sql(key_columns)}) {op} (:{name}, {bound})"
+        )
+    # First scan after alert creation: every row at the initial cursor
+    # timestamp has already been seen.
+    return f"[{ts_column}] {op} :{name}"
+
+
+def _cursor_page_sql(
+    table_name: str,
+    ts_column: str,
+    key_columns: list[str],
+    where: str,
+    item_id_sql: str | None = None,
+    flags: list[str] | None = None,
+) -> str:
+    cursor_id_sql = _cursor_id_sql(key_columns)
+    flag_sql = "".join(f", ({flag})" for flag in flags or [])
+    return f"""
+      SELECT {cursor_id_sql}, [{ts_column}], {item_id_sql or cursor_id_sql}{flag_sql}
+      FROM [{table_name}]
+      WHERE {where}
+      ORDER BY [{ts_column}], {_columns_sql(key_columns)}
+      LIMIT :limit
+    """
+
+
+async def scan_cursor_pages(
+    db: Database,
+    table_name: str,
+    ts_column: str,
+    key_columns: list[str],
+    item_id_sql: str,
+    positions: list[tuple],
+    page_size: int,
+):
+    """Yield pages of rows after the earliest of the given (cursor, cursor_id) positions.
+
+    Each row is (cursor id, timestamp, item id), where the cursor id is the
+    key column's value, or a JSON array of the key columns' values. With
+    more than one position, each row also carries one 0/1 flag per
+    position, set when the row comes after that position.
+
+    Rows are ordered by (ts_column, *key_columns) and fetched page_size at
+    a time, advancing a compound keyset cursor after each page so rows that
+    share a timestamp are never skipped.
+    """
+    params = {"limit": page_size}
+    after = []
+    for i, (cursor, cursor_id) in enumerate(positions):
+        params[f"p{i}"] = cursor
+        if cursor_id is not None:
+            _bind_cursor_id(params, f"p{i}", key_columns, cursor_id)
+        after.append(
+            _after_sql(ts_column, key_columns, f"p{i}", cursor_id is not None)
+        )
+
+    order_sql = f"[{ts_column}], {_columns_sql(key_columns)}"
+    if len(after) == 1:
+        where = after[0]
+        flags = []
+    else:
+        # Start at the first row after any position. Each probe is an index
+        # seek, and ordering the probed values in SQL keeps their collation.
+        probes = " UNION ALL ".join(
+            f"""SELECT * FROM (
+              SELECT {order_sql} FROM [{table_name}]
+              WHERE {test} ORDER BY {order_sql} LIMIT 1
+            )"""
+            for test in after
+        )
+        order_by = ", ".join(str(i + 1) for i in range(len(key_columns) + 1))
+        result = await db.execute(
+            f"SELECT * FROM ({probes}) ORDER BY {order_by} LIMIT 1", params
+        )
+        if not result.rows:
+            return
+        start = result.rows[0]
+        params["start"] = start[0]
+        params.update(zip(_key_params("start", key_columns), start[1:]))
+        where = _after_sql(ts_column, key_columns, "start", True, op=">=")
+        flags = after
+
+    while True:
+        result = await db.execute(
+            _cursor_page_sql(
+                table_name, ts_column, key_columns, where, item_id_sql, flags
+            ),
+            params,
+        )
+        rows = result.rows
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        params["last"] = rows[-1][1]
+        _bind_cursor_id(params, "last", key_columns, rows[-1][0])
+        where = _after_sql(ts_column, key_columns, "last", True)
+
+
+async def cursor_query_plan(
+    db: Database, table_name: str, ts_column: str, key_columns: list[str]
+) -> list[str]:
+    """EXPLAIN QUERY PLAN details for the steady-state cursor page query."""
+
+    def read(conn):
+        # EXPLAIN never reads a table, so on its own it neither reloads a
+        # schema changed by another connection nor invalidates a cached
+        # statement. Reading sqlite_master does the former; keying the SQL
+        # text on the schema version avoids the latter.
+        conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        params = {"cursor": "", "limit": 1}
+        _bind_cursor_id(
+            params,
+            "cursor",
+            key_columns,
+            0 if len(key_columns) == 1 else json.dumps([0] * len(key_columns)),
+        )
+        rows = conn.execute(
+            f"EXPLAIN QUERY PLAN -- schema {schema_version}\n"
+            + _cursor_page_sql(
+                table_name,
+                ts_column,
+                key_columns,
+                _after_sql(ts_column, key_columns, "cursor", True),
+            ),
+            params,
+        ).fetchall()
+        return [row[3] for row in rows]
+
+    return await db.execute_fn(read)
+
+
+async def cursor_index_warnings(
+    db: Database, table_name: str, ts_column: str, key_columns: list[str]
+) -> list[str]:
+    """Warnings for a cursor query that SQLite would answer with a full table scan."""
+    try:
+        plan = await cursor_query_plan(db, table_name, ts_column, key_columns)
+    except Exception as e:
+        return [f"Could not check the query plan for {table_name}: {e}"]
+    if any(detail.startswith("SCAN") for detail in plan):
+        columns = ", ".join([ts_column, *key_columns])
+        return [
+            f"Polling {table_name} by {ts_column} scans the whole table on every "
+            f"check. Add an index on ({columns}) to avoid this."
+        ]
+    return []
+
+
+def _cursor_index_name(
+    table_name: str, ts_column: str, key_columns: list[str]
+) -> str:
+    return f"_datasette_alerts_cursor_{table_name}_{ts_column}_{'_'.join(key_columns)}"
+
+
+async def create_cursor_index(
+    db: Database, table_name: str, ts_column: str, key_columns: list[str]
+):
+    """Create a covering index for the cursor query in the user's database."""
+    # rowid is implicitly part of every index on a rowid table
+    if key_columns == ["rowid"]:
+        columns = [ts_column]
+    else:
+        columns = [ts_column, *key_columns]
+    index_name = _cursor_index_name(table_name, ts_column, key_columns)
+    column_sql = _columns_sql(columns)
+
+    def write(conn):
+        with conn:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS [{index_name}] ON [{table_name}]({column_sql})"
+            )
+
+    await db.execute_write_fn(write)
@@ -1,9 +1,8 @@
 """Public API for sending messages through configured destinations."""
 
 from .internal_db import InternalDB
-from .notifier import Message, Notifier
-from datasette.utils import await_me_maybe
-from datasette.plugins import pm
+from .notifier import Message, Notifier, SendContext, call_send
+from .registry import get_notifier_registry
 from typing import List
 
 
@@ -16,16 +15,8 @@ class NotifierNotFound(Exception):
 
 
 async def get_notifiers(datasette) -> List[Notifier]:
-    """Collect all registered notifiers from plugins."""
-    notifiers = []
-    for result in pm.hook.datasette_alerts_register_notifiers(datasette=datasette):
-        result = await await_me_maybe(result)
-        notifiers.extend(result)
-    return notifiers
-
-
-def _find_notifier(notifiers: List[Notifier], slug: str) -> Notifier | None:
-    return next((n for n in notifiers if n.slug == slug), None)
+    """All registered notifiers, from the cached registry."""
+    return list((await get_notifier_registry(datasette)).values())
 
 
 async def send_to_destination(datasette, destination_id: str, message: Message) -> None:
@@ -46,9 +37,8 @@ async def send_to_destination(datasette, destination_id: str, message: Message)
     if dest is None:
         raise DestinationNotFound(f"Destination {destination_id!r} not found")
 
-    notifiers = await get_notifiers(datasette)
-    notifier = _find_notifier(notifiers, dest.notifier)
+    notifier = (await get_notifier_registry(datasette)).get(dest.notifier)
     if notifier is None:
         raise NotifierNotFound(f"Notifier {dest.notifier!r} not found")
 
-    await notifier.send(dest.config, message)
+    await call_send(notifier, dest.config, message, SendContext(datasette))
@@ -0,0 +1,233 @@
+"""Concurrent delivery of messages to notifiers.
+
+One Dispatcher is shared by every alert on a Datasette instance. It bounds
+the number of sends in flight overall and per destination, paces each
+destination to its rate limit, and abandons sends that take longer than the
+configured timeout.
+"""
+
+import asyncio
+import logging
+import time
+
+from .notifier import (
+    Message,
+    Notifier,
+    RateLimited,
+    SendContext,
+    call_send,
+    call_send_many,
+)
+from .settings import get_settings
+
+logger = logging.getLogger("datasette_alerts.dispatch")
+
+# Pause for a destination that raised RateLimited without a retry_after
+DEFAULT_RETRY_AFTER = 60.0
+# Times a chunk is retried in place after RateLimited before it is deferred
+RATE_LIMITED_RETRIES = 2
+
+
+class TokenBucket:
+    """Paces the sends to one destination.
+
+    Holds up to burst tokens, refilled at rate tokens per second, and each
+    send takes one. With no rate it never runs dry, but can still be paused
+    by a destination that raises RateLimited.
+    """
+
+    def __init__(self, rate: float | None = None, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def configure(self, rate: float | None, burst: int):
+        if (rate, burst) != (self.rate, self.burst):
+            self._refill()
+            # An unlimited bucket counts as full
+            self.tokens = burst if self.rate is None else min(self.tokens, burst)
+            self.rate = rate
+            self.burst = burst
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until the next token may be used."""
+        self._refill()
+        wait = self.paused_until - self.updated
+        if self.rate and self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return max(wait, 0.0)
+
+    def take(self):
+        """Take a token. Tokens may go negative: later callers wait longer."""
+        if self.rate:
+            self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class Dispatcher:
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_concurrent_per_destination: int,
+        timeout: float,
+        context: SendContext | None = None,
+        max_rate_limit_wait: float = 10.0,
+    ):
+        self.max_concurrent_per_destination = max_concurrent_per_destination
+        self.timeout = timeout
+        self.context = context
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self._global = asyncio.Semaphore(max_concurrent)
+        self._per_destination: dict[str, asyncio.Semaphore] = {}
+        self._buckets: dict[str, TokenBucket] = {}
+
+    def _destination_semaphore(self, destination_key: str) -> asyncio.Semaphore:
+        semaphore = self._per_destination.get(destination_key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrent_per_destination)
+            self._per_destination[destination_key] = semaphore
+        return semaphore
+
+    def _bucket(self, destination_key: str) -> TokenBucket:
+        bucket = self._buckets.get(destination_key)
+        if bucket is None:
+            bucket = TokenBucket()
+            self._buckets[destination_key] = bucket
+        return bucket
+
+    def set_rate_limit(
+        self, destination_key: str, per_minute: float | None, burst: int = 1
+    ):
+        """Limit sends to a destination to per_minute, in bursts of up to burst.
+
+        None removes the limit.
+        """
+        rate = per_minute / 60 if per_minute else None
+        self._bucket(destination_key).configure(rate, burst)
+
+    async def _wait_for_token(self, destination_key: str, max_wait: float | None):
+        """Wait for the destination's rate limit to allow a send.
+
+        Raises RateLimited, without waiting, if that would take longer than
+        max_wait.
+        """
+        bucket = self._bucket(destination_key)
+        wait = bucket.delay()
+        if max_wait is not None and wait > max_wait:
+            raise RateLimited(retry_after=wait)
+        bucket.take()
+        if wait:
+            await asyncio.sleep(wait)
+
+    async def _call(self, destination_key: str, send):
+        try:
+            async with self._destination_semaphore(destination_key), self._global:
+                await asyncio.wait_for(send(), self.timeout)
+        except RateLimited as e:
+            retry_after = e.retry_after
+            if retry_after is None:
+                retry_after = DEFAULT_RETRY_AFTER
+            self._bucket(destination_key).pause(retry_after)
+            raise
+
+    async def send(
+        self, destination_key: str, notifier: Notifier, config: dict, message: Message
+    ):
+        """Send one message, waiting for its rate limit and a free slot first.
+
+        Raises asyncio.TimeoutError if the notifier takes too long, and
+        RateLimited if the notifier does.
+
+        Only the legacy _send_for_subscription path sends this way; outbox
+        delivery uses send_many, which also batches and retries.
+        """
+        await self._wait_for_token(destination_key, None)
+        await self._call(
+            destination_key,
+            lambda: call_send(notifier, config, message, self.context),
+        )
+
+    async def send_many(
+        self,
+        destination_key: str,
+        notifier: Notifier,
+        config: dict,
+        messages: list[Message],
+    ) -> list[BaseException | None]:
+        """Send messages in order, in chunks of the notifier's max_batch_size.
+
+        Each chunk is one send_many() call with its own timeout, and takes one
+        token from the destination's rate limit. A chunk waits up to
+        max_rate_limit_wait for a token, and is retried in place when the
+        notifier raises RateLimited with a short enough retry_after.
+
+        Returns the outcome for each message: the exception that failed its
+        chunk, or None. RateLimited means the message was held back and
+        should be sent again after its retry_after.
+        """
+        size = max(1, notifier.max_batch_size)
+        outcomes: list[BaseException | None] = []
+        for start in range(0, len(messages), size):
+            chunk = messages[start : start + size]
+            error = None
+            for _ in range(1 + RATE_LIMITED_RETRIES):
+                try:
+                    await self._wait_for_token(
+                        destination_key, self.max_rate_limit_wait
+                    )
+                except RateLimited as e:
+                    error = e
+                    break
+                try:
+                    await self._call(
+                        destination_key,
+                        lambda: call_send_many(notifier, config, chunk, self.context),
+                    )
+                except RateLimited as e:
+                    error = e
+                    continue
+                except Exception as e:
+                    error = e
+                else:
+                    error = None
+                break
+            if isinstance(error, RateLimited):
+                # Report how long is left, so the message is retried when
+                # the destination is ready for it
+                error.retry_after = self._bucket(destination_key).delay()
+            outcomes.extend([error] * len(chunk))
+        return outcomes
+
+
+def get_dispatcher(datasette) -> Dispatcher:
+    """The Dispatcher for this Datasette instance, created on first use."""
+    dispatcher = getattr(datasette, "_alerts_dispatcher", None)
+    if dispatcher is None:
+        settings = get_settings(datasette)
+        dispatcher = Dispatcher(
+            settings.max_concurrent_sends,
+            settings.max_concurrent_sends_per_destination,
+            settings.send_timeout,
+            SendContext(datasette),
+            settings.max_rate_limit_wait,
+        )
+        datasette._alerts_dispatcher = dispatcher
+    return dispatcher
+
+
+async def fan_out(coroutines) -> list[BaseException | None]:
+    """Run coroutines concurrently, returning the exception (or None) for each."""
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    return [r if isinstance(r, BaseException) else None for r in results]
@@ -4,31 +4,48 @@ These replace the old bg_task loop. Each handler is registered with
 datasette-cron and called on schedule.
 """
 
+import asyncio
+import itertools
 import json
 import logging
+import time
 import uuid
+from collections import ChainMap
 
 from datasette.database import Database
 
-from .destinations import get_notifiers
-from .internal_db import InternalDB
-from .notifier import Message
-from .template import resolve_template
-from .trigger_db import claim_queue_items, complete_queue_items, fail_queue_item
+from .cursor_db import cursor_item_id_sql, cursor_key_columns, scan_cursor_pages
+from .dispatch import fan_out, get_dispatcher
+from .internal_db import InternalDB, NewOutboxMessage
+from .notifier import Message, RateLimited
+from .registry import get_alert_type_registry, get_notifier_registry
+from .settings import get_settings
+from .template import compile_template, resolve_template, template_variables
+from .trigger_db import (
+    claim_queue_items,
+    complete_queue_items,
+    database_change_marker,
+    fail_queue_items,
+    next_queue_retry_at,
+    purge_queue_items,
+    queue_bursts,
+    read_queue_items,
+    truncate_queue_items,
+)
 
 logger = logging.getLogger("datasette_alerts.handlers")
 
 
 def _get_alert_types(datasette):
-    """Collect all registered custom alert types from plugins."""
-    from datasette.plugins import pm
+    """All registered custom alert types by slug, from the cached registry."""
+    return get_alert_type_registry(datasette)
 
-    alert_types = {}
-    for result in pm.hook.datasette_alerts_register_alert_types(datasette=datasette):
-        if result:
-            for at in result:
-                alert_types[at.slug] = at
-    return alert_types
+
+_DEFAULT_TEXT = {
+    "insert": "{count} new rows in {table_name}",
+    "update": "{count} rows changed in {table_name}",
+    "delete": "{count} rows deleted from {table_name}",
+}
 
 
 def _build_messages(
@@ -37,6 +54,7 @@ def _build_messages(
     row_data: list[dict] | None,
     table_name: str,
     database_name: str,
+    change_type: str = "insert",
 ) -> list[Message]:
     """Build Message objects from subscription meta, handling aggregate/template logic.
 
@@ -56,19 +74,45 @@ def _build_messages(
             )
             return [Message(text)]
         else:
-            messages = []
-            for row in row_data:
-                variables = {k: str(v) for k, v in row.items()}
-                variables["table_name"] = table_name
-                variables["database_name"] = database_name
-                text = resolve_template(
-                    template_json,
-                    variables,
-                )
-                messages.append(Message(text))
-            return messages
+            # Compiled once per batch; each row only converts the values the
+            # template uses
+            template = compile_template(template_json)
+            names = {"table_name": table_name, "database_name": database_name}
+            return [Message(template.render(ChainMap(names, row))) for row in row_data]
     else:
-        return [Message(f"{len(new_ids)} new rows in {table_name}")]
+        return [
+            Message(
+                _DEFAULT_TEXT[change_type].format(
+                    count=len(new_ids), table_name=table_name
+                )
+            )
+        ]
+
+
+def _template_columns(meta: dict) -> set[str] | None:
+    """Row columns a subscription's per-row template refers to.
+
+    None if the subscription does not render rows one at a time.
+    """
+    template_json = meta.get("message_template")
+    if meta.get("aggregate", True) or not isinstance(template_json, dict):
+        return None
+    columns = set()
+    for name in template_variables(template_json):
+        if name in ("table_name", "database_name", "changed_columns"):
+            continue
+        # old.{column} and new.{column} come from the same captured column
+        prefix, _, column = name.partition(".")
+        columns.add(column if prefix in ("old", "new") and column else name)
+    return columns
+
+
+def trigger_payload_columns(metas: list[dict]) -> list[str]:
+    """Columns a trigger should capture to render every subscription's messages."""
+    columns: set[str] = set()
+    for meta in metas:
+        columns |= _template_columns(meta) or set()
+    return sorted(columns)
 
 
 def _notifier_config(meta: dict) -> dict:
@@ -80,18 +124,104 @@ def _notifier_config(meta: dict) -> dict:
     return {k: v for k, v in meta.items() if k not in ("aggregate", "message_template")}
 
 
+# Ids bound per lookup query, so a large batch never becomes one huge
+# json_each() argument
+_ROW_DATA_CHUNK_SIZE = 500
+
+
+async def _iter_row_data(
+    db: Database,
+    table_name: str,
+    id_columns: list[str],
+    ids: list,
+    chunk_size: int = _ROW_DATA_CHUNK_SIZE,
+):
+    """Yield full row data for the given ids from the target database.
+
+    Composite keys are given as JSON arrays of their values, as reported by
+    cursor and trigger alerts. Rows are looked up chunk_size ids at a time
+    and yielded in the order of ids.
+    """
+    if len(id_columns) == 1:
+        match = f"t.[{id_columns[0]}] = j.value"
+    else:
+        match = " AND ".join(
+            f"t.[{column}] = json_extract(j.value, '$[{i}]')"
+            for i, column in enumerate(id_columns)
+        )
+    sql = f"""
+        SELECT t.* FROM json_each(?) j
+        JOIN [{table_name}] t ON {match}
+        ORDER BY j.key
+    """
+    for start in range(0, len(ids), chunk_size):
+        result = await db.execute(sql, [json.dumps(ids[start : start + chunk_size])])
+        columns = [desc[0] for desc in result.description]
+        for row in result.rows:
+            yield dict(zip(columns, row))
+
+
 async def _fetch_row_data(
-    db: Database, table_name: str, id_column: str, ids: list
+    db: Database, table_name: str, id_columns: str | list[str], ids: list
 ) -> list[dict]:
-    """Fetch full row data for given IDs from the target database."""
-    if not ids:
-        return []
-    result = await db.execute(
-        f"SELECT * FROM [{table_name}] WHERE [{id_column}] IN (SELECT value FROM json_each(?))",
-        [json.dumps(ids)],
-    )
-    columns = [desc[0] for desc in result.description]
-    return [dict(zip(columns, row)) for row in result.rows]
+    """Fetch full row data for given IDs from the target database.
+
+    Rows are collected into a list, as every subscription of a firing shares
+    them; the lookup itself still runs in bounded chunks. A single id column
+    may be given as a string, as in older callers.
+    """
+    if isinstance(id_columns, str):
+        id_columns = [id_columns]
+    return [row async for row in _iter_row_data(db, table_name, id_columns, ids)]
+
+
+class _RowDataCache:
+    """Row data for one alert firing, shared by all of its subscriptions.
+
+    The rows are fetched the first time a non-aggregate subscription asks for
+    them, and at most once. Payloads captured by a trigger are used instead
+    when they hold every column a subscription's template needs.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        table_name: str,
+        id_columns: list[str],
+        ids,
+        payloads: list[dict] | None = None,
+    ):
+        self.db = db
+        self.table_name = table_name
+        self.id_columns = id_columns
+        self.ids = ids
+        self.payloads = payloads
+        self._lock = asyncio.Lock()
+        self._fetched = False
+        self._rows: list[dict] | None = None
+
+    async def get(self) -> list[dict] | None:
+        """The rows for this firing, or None if they could not be fetched."""
+        async with self._lock:
+            if not self._fetched:
+                self._fetched = True
+                try:
+                    self._rows = await _fetch_row_data(
+                        self.db, self.table_name, self.id_columns, self.ids
+                    )
+                except Exception as e:
+                    logger.warning("Failed to fetch row data: %s", e)
+        return self._rows
+
+    async def for_subscription(self, subscription) -> list[dict] | None:
+        """Row data for a subscription: None for aggregate subscriptions."""
+        if subscription.meta.get("aggregate", True) or not self.id_columns:
+            return None
+        if self.payloads is not None:
+            columns = _template_columns(subscription.meta) or set()
+            if all(columns <= payload.keys() for payload in self.payloads):
+                return self.payloads
+        return await self.get()
 
 
 async def _send_for_subscription(
@@ -102,11 +232,13 @@ async def _send_for_subscription(
     table_name: str,
     database_name: str,
 ):
-    """Build messages and send them through the subscription's notifier."""
-    notifier = next(
-        (n for n in await get_notifiers(datasette) if n.slug == subscription.notifier),
-        None,
-    )
+    """Build messages and send them through the subscription's notifier.
+
+    Legacy: kept only for the bg_task shim. Alerts are delivered through the
+    outbox (_render_for_subscriptions and delivery_handler), so changes to
+    delivery belong there, not here.
+    """
+    notifier = (await get_notifier_registry(datasette)).get(subscription.notifier)
     if notifier is None:
         logger.warning("Notifier not found: %s", subscription.notifier)
         return
@@ -120,130 +252,574 @@ async def _send_for_subscription(
         subscription.meta, new_ids, row_data, table_name, database_name
     )
 
+    # Messages to one subscription go out in order
+    dispatcher = get_dispatcher(datasette)
+    destination_key = subscription.destination_id or notifier.slug
     for message in messages:
-        await notifier.send(config, message)
+        await dispatcher.send(destination_key, notifier, config, message)
 
 
-async def cursor_alert_handler(datasette, config):
-    """Cron handler for cursor-based alerts.
+def _outbox_messages(
+    alert_id: str, subscription, messages: list[Message]
+) -> list[NewOutboxMessage]:
+    """Outbox rows for messages to one subscription."""
+    # Use destination config if available, otherwise fall back to legacy meta
+    if subscription.destination_id:
+        config = subscription.destination_config
+    else:
+        config = _notifier_config(subscription.meta)
+    return [
+        NewOutboxMessage(
+            alert_id=alert_id,
+            notifier=subscription.notifier,
+            destination_key=subscription.destination_id or subscription.notifier,
+            config=config,
+            text=message.text,
+            subject=message.subject,
+        )
+        for message in messages
+    ]
 
-    config: {"alert_id": "..."}
-    Replaces the old job_tick() + start_ready_jobs() pattern.
-    """
-    alert_id = config["alert_id"]
-    internal_db = InternalDB(datasette.get_internal_database())
 
-    # Fetch alert details
-    alert = await internal_db.get_alert_for_check(alert_id)
-    if alert is None:
-        return
+async def _render_for_subscriptions(
+    datasette,
+    alert_id: str,
+    subscriptions,
+    new_ids: list[str],
+    row_data: _RowDataCache,
+    table_name: str,
+    database_name: str,
+    change_type: str = "insert",
+) -> list[NewOutboxMessage]:
+    """Build every subscription's messages for one firing, ready to enqueue."""
+    notifiers = await get_notifier_registry(datasette)
+    outbox = []
+    for subscription in subscriptions:
+        if subscription.notifier not in notifiers:
+            logger.warning("Notifier not found: %s", subscription.notifier)
+            continue
+        messages = _build_messages(
+            subscription.meta,
+            new_ids,
+            await row_data.for_subscription(subscription),
+            table_name,
+            database_name,
+            change_type,
+        )
+        outbox.extend(_outbox_messages(alert_id, subscription, messages))
+    return outbox
 
-    db: Database = datasette.databases.get(alert.database_name)
-    if db is None:
-        logger.warning("Database %s not found", alert.database_name)
-        return
 
-    cursor = alert.cursor
-    result = await db.execute(
-        f"""
-          SELECT
-            {alert.id_columns[0]},
-            {alert.timestamp_column}
-          FROM {alert.table_name}
-          WHERE {alert.timestamp_column} > ?
-        """,
-        [cursor],
+async def _deliver_cursor_rows(
+    datasette, internal_db: InternalDB, db: Database, alert, rows, subscriptions
+):
+    """Log one page of new rows for a cursor alert and queue its messages."""
+    new_ids = [row[2] for row in rows]
+    cursor_id, cursor = rows[-1][0], rows[-1][1]
+    logger.debug(
+        "cursor check: alert=%s new_ids=%d cursor=%s/%s",
+        alert.id,
+        len(new_ids),
+        cursor,
+        cursor_id,
     )
-    new_ids = [row[0] for row in result]
-    cursor = max([row[1] for row in result], default=cursor)
-    logger.debug("cursor check: alert=%s new_ids=%s cursor=%s", alert_id, new_ids, cursor)
-    await internal_db.add_log(alert_id, new_ids, cursor)
+    str_ids = [str(id) for id in new_ids]
+    outbox = await _render_for_subscriptions(
+        datasette,
+        alert.id,
+        subscriptions,
+        str_ids,
+        _RowDataCache(db, alert.table_name, alert.id_columns, str_ids),
+        alert.table_name,
+        alert.database_name,
+    )
+    await internal_db.add_log(alert.id, new_ids, cursor, cursor_id, outbox)
 
-    if len(new_ids) > 0:
-        new_ids = [str(id) for id in new_ids]
-        subscriptions = await internal_db.alert_subscriptions(alert_id)
 
-        for subscription in subscriptions:
-            # Fetch row data if non-aggregate mode
-            row_data = None
-            aggregate = subscription.meta.get("aggregate", True)
-            if not aggregate and alert.id_columns:
-                try:
-                    row_data = await _fetch_row_data(
-                        db, alert.table_name, alert.id_columns[0], new_ids
-                    )
-                except Exception as e:
-                    logger.warning("Failed to fetch row data: %s", e)
+async def _scan_cursor_group(datasette, internal_db: InternalDB, db: Database, alerts):
+    """Scan a table once for cursor alerts that share a table and timestamp column.
 
-            await _send_for_subscription(
-                datasette,
-                subscription,
-                new_ids,
-                row_data,
-                alert.table_name,
-                alert.database_name,
+    The scan starts at the earliest cursor in the group. Alerts sharing a
+    cursor get each page as-is; otherwise SQLite flags which rows come after
+    each alert's cursor, so values are compared with the column's own
+    affinity and collation.
+    """
+    page_size = get_settings(datasette).cursor_page_size
+    # Fetched when the first alert fires; quiet scans never need it
+    snapshot = None
+
+    # The keyset tie-breaker and reported ids have to be the same for the
+    # whole pass
+    by_id_columns: dict[tuple, list] = {}
+    for alert in alerts:
+        by_id_columns.setdefault(tuple(alert.id_columns), []).append(alert)
+
+    for id_columns, group in by_id_columns.items():
+        # Alerts that were checked together share a cursor, so there are
+        # usually far fewer positions than alerts
+        positions: list[tuple] = []
+        position_index: dict[tuple, int] = {}
+        alert_position: dict[str, int] = {}
+        for alert in group:
+            key = (
+                type(alert.cursor),
+                alert.cursor,
+                type(alert.cursor_id),
+                alert.cursor_id,
             )
+            if key not in position_index:
+                position_index[key] = len(positions)
+                positions.append((alert.cursor, alert.cursor_id))
+            alert_position[alert.id] = position_index[key]
+
+        first = group[0]
+        key_columns = await cursor_key_columns(
+            db, first.table_name, list(id_columns)
+        )
+        async for rows in scan_cursor_pages(
+            db,
+            first.table_name,
+            first.timestamp_column,
+            key_columns,
+            cursor_item_id_sql(list(id_columns)),
+            positions,
+            page_size,
+        ):
+            for alert in group:
+                if len(positions) == 1:
+                    new_rows = rows
+                else:
+                    flag = 3 + alert_position[alert.id]
+                    new_rows = [row for row in rows if row[flag]]
+                if not new_rows:
+                    continue
+                if snapshot is None:
+                    snapshot = await internal_db.config_snapshot()
+                await _deliver_cursor_rows(
+                    datasette,
+                    internal_db,
+                    db,
+                    alert,
+                    new_rows,
+                    snapshot.subscriptions.get(alert.id, []),
+                )
+        # Alerts with no new rows keep their cursor; their last_check_at
+        # was already stamped by the caller
+
+
+async def cursor_scan_handler(datasette, config):
+    """Cron handler for the shared scan over one table's cursor alerts.
+
+    config: {"database_name": "...", "table_name": "...", "timestamp_column": "..."}
+    Runs at the shortest frequency in the group and checks only the alerts
+    whose own frequency has elapsed.
+    """
+    internal_db = InternalDB(datasette.get_internal_database())
+    alerts = await internal_db.get_cursor_alerts_in_group(
+        config["database_name"],
+        config["table_name"],
+        config["timestamp_column"],
+        due_only=True,
+    )
+    if not alerts:
+        return
+
+    db: Database = datasette.databases.get(config["database_name"])
+    if db is None:
+        logger.warning("Database %s not found", config["database_name"])
+        return
+
+    # Stamp the check time before scanning, so a long scan does not push the
+    # alert's next due time past the following tick
+    await internal_db.update_last_checks([alert.id for alert in alerts])
+    await _scan_cursor_group(datasette, internal_db, db, alerts)
 
 
 async def trigger_queue_handler(datasette, config):
     """Cron handler for trigger-based alerts (global drain).
 
     config: {} (runs for all trigger alerts)
-    Replaces the trigger processing loop from bg_task.
+    Claims batches from each watched database's shared queue table until it
+    is empty or trigger_drain_budget runs out, and logs and queues messages
+    for each alert that had new rows. The batch size adapts to how long
+    batches take. Debounced alerts' rows stay queued until their burst goes
+    quiet. Databases that have not been written to since their last drain,
+    and have no retries coming due, are skipped without touching the queue.
     """
+    settings = get_settings(datasette)
+    deadline = time.monotonic() + settings.trigger_drain_budget
     internal_db = InternalDB(datasette.get_internal_database())
-    trigger_alerts = await internal_db.get_trigger_alerts()
+    snapshot = await internal_db.config_snapshot()
 
-    for alert in trigger_alerts:
-        db: Database = datasette.databases.get(alert.database_name)
+    by_database: dict[str, dict] = {}
+    for alert in snapshot.trigger_alerts:
+        by_database.setdefault(alert.database_name, {})[alert.alert_id] = alert
+
+    for database_name, alerts in by_database.items():
+        db: Database = datasette.databases.get(database_name)
         if db is None:
             continue
 
+        state = _trigger_drain_state(datasette, database_name)
+        try:
+            marker = await database_change_marker(db)
+        except Exception as e:
+            logger.warning("trigger change check failed for %s: %r", database_name, e)
+            marker = None
+        if marker is not None:
+            conn_id, version = marker[0], marker[1:]
+            retry_at = state["retry_at"]
+            if state["seen"].get(conn_id) == version and (
+                retry_at is None or time.time() < retry_at
+            ):
+                continue
+            # Recorded before claiming, so a commit racing the drain is
+            # picked up next time
+            state["seen"][conn_id] = version
+
         worker_id = str(uuid.uuid4())
+        debounced = [a.alert_id for a in alerts.values() if a.debounce_seconds]
+        append = [a.alert_id for a in alerts.values() if a.queue_mode == "append"]
+        drained = 0
+        backlog = False
+        failed = False
+        started = time.monotonic()
         try:
-            items = await claim_queue_items(db, alert.alert_id, worker_id)
-        except Exception:
+            ready, debounce_until = await _debounced_ready(db, alerts, debounced)
+            if ready:
+                # A burst is claimed whole, for one notification
+                items = await claim_queue_items(
+                    db, worker_id, limit=None, alert_ids=ready
+                )
+                await _process_claimed(
+                    datasette, internal_db, db, alerts, snapshot, items, worker_id
+                )
+                drained += len(items)
+            # Then batches, until the queue is empty or the time is up
+            while True:
+                batch_size = state["batch_size"] or settings.trigger_batch_size
+                batch_started = time.monotonic()
+                items = await claim_queue_items(
+                    db,
+                    worker_id,
+                    limit=batch_size,
+                    exclude_alert_ids=debounced,
+                )
+                await _process_claimed(
+                    datasette, internal_db, db, alerts, snapshot, items, worker_id
+                )
+                drained += len(items)
+                backlog = len(items) == batch_size
+                if backlog:
+                    state["batch_size"] = _next_batch_size(
+                        batch_size, time.monotonic() - batch_started, settings
+                    )
+                if not backlog or time.monotonic() >= deadline:
+                    break
+            for alert_id in append:
+                count, more, ok = await _drain_append_alert(
+                    datasette,
+                    internal_db,
+                    db,
+                    alerts[alert_id],
+                    snapshot,
+                    state,
+                    settings,
+                    deadline,
+                )
+                drained += count
+                backlog = backlog or more
+                failed = failed or not ok
+        except Exception as e:
+            logger.warning("trigger drain failed for %s: %r", database_name, e)
+            state["seen"].clear()
             continue
+
+        state["last_drain"] = {
+            "at": time.time(),
+            "items": drained,
+            "seconds": round(time.monotonic() - started, 3),
+            "backlog": backlog,
+        }
+        if backlog:
+            logger.info(
+                "trigger drain for %s used its time budget with rows still queued",
+                database_name,
+            )
+        retry_at = await next_queue_retry_at(db)
+        if debounce_until is not None:
+            retry_at = min(retry_at or debounce_until, debounce_until)
+        if failed:
+            # Append-mode rows have no lease to expire, so retry them later
+            retry_at = min(
+                retry_at or float("inf"), time.time() + settings.delivery_backoff
+            )
+        if backlog:
+            # Carry on next run, whether or not the database changes
+            retry_at = time.time()
+        state["retry_at"] = retry_at
+
+
+async def _drain_append_alert(
+    datasette,
+    internal_db: InternalDB,
+    db: Database,
+    alert,
+    snapshot,
+    state: dict,
+    settings,
+    deadline: float,
+) -> tuple[int, bool, bool]:
+    """Process an append-mode alert's queue rows after its offset, in batches.
+
+    Each batch is one read of the queue and one write to the internal
+    database, which saves the new offset with the log and messages.
+    Returns (rows processed, whether rows were left, whether all succeeded).
+    """
+    offsets = state["offsets"]
+    if alert.alert_id not in offsets:
+        offsets.update(await internal_db.queue_offsets([alert.alert_id]))
+    drained = 0
+    while True:
+        batch_size = state["batch_size"] or settings.trigger_batch_size
+        batch_started = time.monotonic()
+        items = await read_queue_items(
+            db, alert.alert_id, offsets[alert.alert_id], batch_size
+        )
         if not items:
-            continue
+            return drained, False, True
+        ok = await _process_trigger_items(
+            datasette,
+            internal_db,
+            db,
+            alert,
+            snapshot.subscriptions.get(alert.alert_id, []),
+            items,
+            None,
+            queue_offset=items[-1]["id"],
+        )
+        if not ok:
+            return drained, False, False
+        offsets[alert.alert_id] = items[-1]["id"]
+        drained += len(items)
+        if len(items) < batch_size:
+            return drained, False, True
+        state["batch_size"] = _next_batch_size(
+            batch_size, time.monotonic() - batch_started, settings
+        )
+        if time.monotonic() >= deadline:
+            return drained, True, True
 
-        new_ids = [item["item_id"] for item in items]
-        item_db_ids = [item["id"] for item in items]
-        logger.debug("trigger %s: %d items", alert.alert_id, len(new_ids))
 
-        await internal_db.add_log(alert.alert_id, new_ids, "")
+def _next_batch_size(batch_size: int, seconds: float, settings) -> int:
+    """Grow the batch while full batches are quick, shrink it when slow.
 
-        subscriptions = await internal_db.alert_subscriptions(alert.alert_id)
-        for subscription in subscriptions:
-            try:
-                # Fetch row data if non-aggregate mode
-                row_data = None
-                aggregate = subscription.meta.get("aggregate", True)
-                if not aggregate and alert.id_columns:
-                    try:
-                        row_data = await _fetch_row_data(
-                            db, alert.table_name, alert.id_columns[0], new_ids
-                        )
-                    except Exception as e2:
-                        logger.warning("Failed to fetch row data: %s", e2)
+    Aims for each batch to take about a tenth of the drain's time budget.
+    """
+    target = settings.trigger_drain_budget / 10
+    if seconds < target / 2:
+        return min(batch_size * 2, settings.trigger_max_batch_size)
+    if seconds > target:
+        return max(batch_size // 2, 1)
+    return batch_size
 
-                await _send_for_subscription(
-                    datasette,
-                    subscription,
-                    new_ids,
-                    row_data,
-                    alert.table_name,
-                    alert.database_name,
-                )
-            except Exception as e:
-                logger.error("trigger notifier error: %s", e)
-                for item_db_id in item_db_ids:
-                    await fail_queue_item(
-                        db, alert.alert_id, item_db_id, worker_id, str(e)
-                    )
-                break
+
+async def _process_claimed(
+    datasette, internal_db, db, alerts: dict, snapshot, items, worker_id: str
+):
+    """Log and queue messages for claimed queue items, alert by alert."""
+    by_alert: dict[str, list] = {}
+    for item in items:
+        by_alert.setdefault(item["alert_id"], []).append(item)
+
+    for alert_id, alert_items in by_alert.items():
+        alert = alerts.get(alert_id)
+        if alert is None:
+            # Rows queued for an alert that has since been deleted
+            await complete_queue_items(
+                db, [item["id"] for item in alert_items], worker_id
+            )
+            continue
+        await _process_trigger_items(
+            datasette,
+            internal_db,
+            db,
+            alert,
+            snapshot.subscriptions.get(alert_id, []),
+            alert_items,
+            worker_id,
+        )
+
+
+async def _debounced_ready(
+    db: Database, alerts: dict, debounced: list[str]
+) -> tuple[list[str], float | None]:
+    """Debounced alerts whose queued burst is ready to send, and when the
+    next waiting burst will be.
+
+    A burst is ready once no row has arrived for debounce_seconds, or once
+    its oldest row has waited debounce_max seconds.
+    """
+    if not debounced:
+        return [], None
+    now = time.time()
+    ready = []
+    wait_until = None
+    for alert_id, (oldest, newest) in (await queue_bursts(db, debounced)).items():
+        alert = alerts[alert_id]
+        ready_at = newest + alert.debounce_seconds
+        if alert.debounce_max:
+            ready_at = min(ready_at, oldest + alert.debounce_max)
+        if now >= ready_at:
+            ready.append(alert_id)
         else:
-            await complete_queue_items(db, alert.alert_id, item_db_ids, worker_id)
+            wait_until = min(wait_until or ready_at, ready_at)
+    return ready, wait_until
+
+
+def _trigger_drain_state(datasette, database_name: str) -> dict:
+    """Drain state for a database: change markers seen per read connection,
+    the next retry time, the adaptive batch size, the last drain's stats and
+    append-mode alerts' offsets."""
+    states = getattr(datasette, "_alerts_trigger_drain_state", None)
+    if states is None:
+        states = datasette._alerts_trigger_drain_state = {}
+    return states.setdefault(
+        database_name,
+        {
+            "seen": {},
+            "retry_at": None,
+            "batch_size": None,
+            "last_drain": None,
+            "offsets": {},
+        },
+    )
+
+
+def _with_changes(payload: dict, changes: dict | None) -> dict:
+    """Template variables for one queued row: its payload, plus old.{column}
+    and new.{column} for each payload column when an UPDATE was captured."""
+    if changes is None:
+        return payload
+    row = dict(payload)
+    for column, value in payload.items():
+        old, new = changes.get(column, (value, value))
+        row[f"old.{column}"] = old
+        row[f"new.{column}"] = new
+    row["changed_columns"] = ", ".join(changes)
+    return row
+
+
+async def _process_trigger_items(
+    datasette,
+    internal_db: InternalDB,
+    db: Database,
+    alert,
+    subscriptions,
+    items,
+    worker_id: str | None,
+    queue_offset: int | None = None,
+) -> bool:
+    """Log and queue messages for one alert's queue items. Returns whether
+    that succeeded.
+
+    Leased items are marked completed or failed. For an append-mode alert,
+    queue_offset is saved with the log instead and the queue is untouched.
+    """
+    new_ids = [item["item_id"] for item in items]
+    item_db_ids = [item["id"] for item in items]
+    payloads = [
+        _with_changes(item["payload"], item["changes"])
+        if item["payload"] is not None
+        else None
+        for item in items
+    ]
+    if any(payload is None for payload in payloads):
+        payloads = None
+    logger.debug("trigger %s: %d items", alert.alert_id, len(new_ids))
+
+    try:
+        outbox = await _render_for_subscriptions(
+            datasette,
+            alert.alert_id,
+            subscriptions,
+            new_ids,
+            _RowDataCache(
+                db, alert.table_name, alert.id_columns, new_ids, payloads
+            ),
+            alert.table_name,
+            alert.database_name,
+            alert.change_type,
+        )
+        await internal_db.add_log(
+            alert.alert_id, new_ids, "", outbox=outbox, queue_offset=queue_offset
+        )
+    except Exception as e:
+        logger.error("trigger enqueue error: %r", e)
+        if queue_offset is None:
+            await fail_queue_items(db, item_db_ids, worker_id, repr(e))
+        return False
+    # The messages are queued durably, so the rows are done
+    if queue_offset is None:
+        await complete_queue_items(db, item_db_ids, worker_id)
+    return True
+
+
+async def maintenance_handler(datasette, config):
+    """Cron handler that deletes old alert logs and trigger queue rows,
+    including the rows append-mode alerts have processed.
+
+    config: {} (runs for the internal database and every database with
+    trigger alerts)
+    """
+    settings = get_settings(datasette)
+    internal_db = InternalDB(datasette.get_internal_database())
+    try:
+        deleted = await internal_db.purge_logs(
+            settings.log_retention, settings.maintenance_batch_size
+        )
+    except Exception as e:
+        logger.warning("log purge failed: %r", e)
+    else:
+        if deleted:
+            logger.debug("purged %d alert logs", deleted)
+
+    now = time.time()
+    completed_before = int(now - settings.queue_completed_retention * 60)
+    failed_before = int(now - settings.queue_failed_retention * 86400)
+    snapshot = await internal_db.config_snapshot()
+    database_names = {a.database_name for a in snapshot.trigger_alerts}
+    for database_name in sorted(database_names):
+        db: Database = datasette.databases.get(database_name)
+        if db is None:
+            continue
+        try:
+            deleted = await purge_queue_items(
+                db, completed_before, failed_before, settings.maintenance_batch_size
+            )
+        except Exception as e:
+            logger.warning("queue purge failed for %s: %r", database_name, e)
+            continue
+        if deleted:
+            logger.debug("purged %d queue rows from %s", deleted, database_name)
+        append = [
+            a.alert_id
+            for a in snapshot.trigger_alerts
+            if a.database_name == database_name and a.queue_mode == "append"
+        ]
+        if not append:
+            continue
+        try:
+            deleted = await truncate_queue_items(
+                db,
+                await internal_db.queue_offsets(append),
+                settings.maintenance_batch_size,
+            )
+        except Exception as e:
+            logger.warning("queue truncation failed for %s: %r", database_name, e)
+            continue
+        if deleted:
+            logger.debug("truncated %d queue rows from %s", deleted, database_name)
 
 
 async def custom_alert_handler(datasette, config):
@@ -307,50 +883,131 @@ async def custom_alert_handler(datasette, config):
     )
 
     if messages:
-        subscriptions = await internal_db.alert_subscriptions(alert_id)
-        notifiers = await get_notifiers(datasette)
+        snapshot = await internal_db.config_snapshot()
+        subscriptions = snapshot.subscriptions.get(alert_id, [])
+        notifiers = await get_notifier_registry(datasette)
 
         logger.debug(
-            "Sending %d messages to %d subscriptions (notifiers available: %s)",
+            "Queueing %d messages for %d subscriptions (notifiers available: %s)",
             len(messages),
             len(subscriptions),
-            [n.slug for n in notifiers],
+            list(notifiers),
         )
 
+        outbox = []
         for subscription in subscriptions:
-            notifier = next(
-                (n for n in notifiers if n.slug == subscription.notifier),
-                None,
-            )
-            if notifier is None:
+            if subscription.notifier not in notifiers:
                 logger.error(
                     "Notifier not found: %s (available: %s)",
                     subscription.notifier,
-                    [n.slug for n in notifiers],
+                    list(notifiers),
                 )
                 continue
+            outbox.extend(_outbox_messages(alert_id, subscription, messages))
 
-            if subscription.destination_id:
-                notifier_config = subscription.destination_config
-            else:
-                notifier_config = _notifier_config(subscription.meta)
-
-            logger.debug(
-                "Sending via %s to destination %s",
-                subscription.notifier,
-                subscription.destination_id,
-            )
-
-            for message in messages:
-                try:
-                    await notifier.send(notifier_config, message)
-                    logger.info("Sent: %s", message.text[:80])
-                except Exception as e:
-                    logger.error("Custom alert send failed: %s", e, exc_info=True)
-
-        # Log the alert check
+        # Log the alert check and queue its messages
         await internal_db.add_log(
             alert_id,
             [f"custom:{i}" for i in range(len(messages))],
             "",
+            outbox=outbox,
+        )
+
+
+async def delivery_handler(datasette, config):
+    """Cron handler that drains the delivery outbox.
+
+    config: {}
+    Queues the digests whose window has ended, then runs delivery_workers
+    workers. Each leases a batch of due messages, sends them and records the
+    outcome, until no messages are due.
+    """
+    settings = get_settings(datasette)
+    internal_db = InternalDB(datasette.get_internal_database())
+    await internal_db.flush_digests()
+    errors = await fan_out(
+        _delivery_worker(datasette, internal_db, settings)
+        for _ in range(settings.delivery_workers)
+    )
+    for error in errors:
+        if error is not None:
+            logger.error("delivery worker error: %r", error)
+
+
+async def _delivery_worker(datasette, internal_db: InternalDB, settings):
+    worker_id = str(uuid.uuid4())
+    notifiers = await get_notifier_registry(datasette)
+    dispatcher = get_dispatcher(datasette)
+
+    while True:
+        items = await internal_db.claim_outbox_items(
+            worker_id, settings.delivery_batch_size, settings.delivery_lease
+        )
+        if not items:
+            return
+
+        failures: dict[int, str] = {}
+        deferred: dict[int, float] = {}
+
+        async def send_in_order(destination_items):
+            # Consecutive messages for the same notifier and config are
+            # handed to send_many() together
+            runs = itertools.groupby(
+                destination_items,
+                key=lambda item: (item.notifier, json.dumps(item.config, sort_keys=True)),
+            )
+            for (slug, _), run in runs:
+                run = list(run)
+                notifier = notifiers.get(slug)
+                if notifier is None:
+                    for item in run:
+                        failures[item.id] = f"Notifier not found: {slug}"
+                    continue
+                outcomes = await dispatcher.send_many(
+                    run[0].destination_key,
+                    notifier,
+                    run[0].config,
+                    [
+                        Message(item.message_text, subject=item.message_subject)
+                        for item in run
+                    ],
+                )
+                for item, error in zip(run, outcomes):
+                    if isinstance(error, RateLimited):
+                        deferred[item.id] = error.retry_after or 0
+                    elif error is not None:
+                        logger.warning(
+                            "delivery failed: outbox=%s attempt=%d: %r",
+                            item.id,
+                            item.attempts + 1,
+                            error,
+                        )
+                        failures[item.id] = repr(error)
+
+        # Destinations are sent to concurrently, each one's messages in order
+        by_destination: dict[str, list] = {}
+        for item in items:
+            by_destination.setdefault(item.destination_key, []).append(item)
+        rate_limits = (await internal_db.config_snapshot()).rate_limits
+        for destination_key in by_destination:
+            limit = rate_limits.get(destination_key)
+            if limit is None:
+                dispatcher.set_rate_limit(destination_key, None)
+            else:
+                dispatcher.set_rate_limit(
+                    destination_key, limit.rate_limit, limit.rate_burst
+                )
+        await fan_out(send_in_order(group) for group in by_destination.values())
+
+        await internal_db.finish_outbox_items(
+            worker_id,
+            [
+                item.id
+                for item in items
+                if item.id not in failures and item.id not in deferred
+            ],
+            failures,
+            settings.delivery_max_attempts,
+            settings.delivery_backoff,
+            deferred,
         )
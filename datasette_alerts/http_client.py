@@ -0,0 +1,35 @@
+"""The shared HTTP client handed to notifiers through SendContext."""
+
+from .settings import get_settings
+
+
+def get_http_client(datasette):
+    """The httpx.AsyncClient for this Datasette instance, created on first use.
+
+    Connections are pooled and kept alive between sends, capped at the
+    max_concurrent_sends setting, and use HTTP/2 where the server offers it.
+    The client is closed when Datasette shuts down.
+    """
+    client = getattr(datasette, "_alerts_http_client", None)
+    if client is None:
+        import httpx
+
+        settings = get_settings(datasette)
+        client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=settings.max_concurrent_sends,
+                max_keepalive_connections=settings.max_concurrent_sends,
+            ),
+            timeout=settings.send_timeout,
+        )
+        datasette._alerts_http_client = client
+    return client
+
+
+async def close_http_client(datasette):
+    """Close the instance's client, if one was created."""
+    client = getattr(datasette, "_alerts_http_client", None)
+    if client is not None:
+        datasette._alerts_http_client = None
+        await client.aclose()
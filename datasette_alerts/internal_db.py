@@ -1,9 +1,10 @@
 # from sqlite_utils import Database
 from datasette.database import Database
-from typing import List, Union
-from pydantic import BaseModel
+from typing import Dict, List, Literal, Union
+from pydantic import BaseModel, Field
 from ulid import ULID
 import json
+import math
 
 from .models import (
     AlertRecord,
@@ -12,6 +13,7 @@ from .models import (
     SubscriptionDetail,
     AlertLogEntry,
     AlertCleanupInfo,
+    OutboxItem,
 )
 
 
@@ -19,6 +21,114 @@ def ulid_new():
     return str(ULID()).lower()
 
 
+# Default for update arguments that should be left as they are
+_UNCHANGED = object()
+
+
+def _bump_config_version(conn):
+    # Call inside the transaction of any change to alerts, subscriptions or
+    # destinations
+    conn.execute(
+        "UPDATE datasette_alerts_config_version SET version = version + 1"
+    )
+
+
+def _config_version(conn) -> int:
+    return conn.execute(
+        "SELECT version FROM datasette_alerts_config_version"
+    ).fetchone()[0]
+
+
+def _insert_outbox(conn, messages: List["NewOutboxMessage"]):
+    """Queue messages for delivery.
+
+    Messages to a destination with a digest_window wait in the digest
+    buffer instead, until the window that the first of them opened ends.
+    """
+    if not messages:
+        return
+    digest_windows = dict(
+        conn.execute(
+            """
+              SELECT id, digest_window FROM datasette_alerts_destinations
+              WHERE digest_window IS NOT NULL
+            """
+        ).fetchall()
+    )
+    _enqueue_outbox(
+        conn, [m for m in messages if m.destination_key not in digest_windows]
+    )
+    conn.executemany(
+        """
+          INSERT INTO datasette_alerts_digest_items(
+            alert_id, notifier, destination_key, config, message_text,
+            message_subject, send_after
+          )
+          VALUES (
+            :alert_id, :notifier, :destination_key, json(:config), :text, :subject,
+            coalesce(
+              (
+                SELECT min(send_after) FROM datasette_alerts_digest_items
+                WHERE destination_key = :destination_key
+              ),
+              datetime('now', '+' || :window || ' seconds')
+            )
+          )
+        """,
+        [
+            {
+                "alert_id": m.alert_id,
+                "notifier": m.notifier,
+                "destination_key": m.destination_key,
+                "config": json.dumps(m.config),
+                "text": m.text,
+                "subject": m.subject,
+                "window": digest_windows[m.destination_key],
+            }
+            for m in messages
+            if m.destination_key in digest_windows
+        ],
+    )
+
+
+def _enqueue_outbox(conn, messages: List["NewOutboxMessage"]):
+    conn.executemany(
+        """
+          INSERT INTO datasette_alerts_outbox(
+            alert_id, notifier, destination_key, config, message_text, message_subject
+          )
+          VALUES (?, ?, ?, json(?), ?, ?)
+        """,
+        [
+            (
+                m.alert_id,
+                m.notifier,
+                m.destination_key,
+                json.dumps(m.config),
+                m.text,
+                m.subject,
+            )
+            for m in messages
+        ],
+    )
+
+
+def _digest_text(rows) -> str:
+    """Text of a digest message, from (alert_id, database_name, table_name,
+    alert_type, count) rows."""
+    total = sum(row[4] for row in rows)
+    lines = [f"{total} alert message{'s' if total != 1 else ''}:"]
+    for alert_id, database_name, table_name, alert_type, count in rows:
+        if database_name is None:
+            label = alert_id or "other"
+        elif table_name:
+            label = f"{database_name}/{table_name}"
+        else:
+            label = f"{database_name} ({alert_type})"
+        lines.append(f"- {label}: {count}")
+    return "\n".join(lines)
+
+
 class ReadyJob(BaseModel):
     alert_id: str
     database_name: str
@@ -36,12 +146,27 @@ class Destination(BaseModel):
     config: dict
     created_by: str | None = None
     created_at: str | None = None
+    rate_limit: float | None = None
+    rate_burst: int | None = None
+    digest_window: float | None = None
 
 
 class NewDestination(BaseModel):
     notifier: str
     label: str
     config: dict = {}
+    # Messages per minute, sent in bursts of up to rate_burst (default 1).
+    # None means unlimited.
+    rate_limit: float | None = Field(default=None, gt=0)
+    rate_burst: int | None = Field(default=None, ge=1)
+    # Seconds to collect messages for one combined digest. None sends each
+    # message as it comes.
+    digest_window: float | None = Field(default=None, gt=0)
+
+
+class RateLimit(BaseModel):
+    rate_limit: float  # messages per minute
+    rate_burst: int = 1
 
 
 class NewSubscription(BaseModel):
@@ -59,6 +184,21 @@ class NewAlertRouteParameters(BaseModel):
     frequency: str = ""
     # Trigger-specific
     filter_params: list[list[str]] = []  # [["col__op", "val"], ...]
+    # Store the columns the templates use in the queue, so rows are not
+    # read back from the table when the queue is drained
+    capture_payload: bool = False
+    # Fire on inserted, updated or deleted rows. Update alerts fire only when
+    # one of watch_columns (default: any column) changes.
+    change_type: Literal["insert", "update", "delete"] = "insert"
+    watch_columns: List[str] = []
+    # Hold rows until none have arrived for debounce_seconds, or until the
+    # oldest has waited debounce_max seconds, then notify for them together
+    debounce_seconds: float | None = Field(default=None, gt=0)
+    debounce_max: float | None = Field(default=None, gt=0)
+    # "append": the trigger only inserts queue rows and the drain tracks the
+    # last row it processed, instead of updating each row as it is leased
+    # and completed
+    queue_mode: Literal["lease", "append"] = "lease"
     # Custom alert type config
     custom_config: dict = {}
     # Shared
@@ -70,6 +210,22 @@ class TriggerAlert(BaseModel):
     database_name: str
     table_name: str
     id_columns: List[str] = []
+    filter_params: List[List[str]] = []
+    capture_payload: bool = False
+    change_type: str = "insert"
+    watch_columns: List[str] = []
+    debounce_seconds: float | None = None
+    debounce_max: float | None = None
+    queue_mode: str = "lease"
+
+
+class NewOutboxMessage(BaseModel):
+    alert_id: str | None = None
+    notifier: str
+    destination_key: str  # destination id, or notifier slug for legacy subscriptions
+    config: dict = {}
+    text: str
+    subject: str | None = None
 
 
 class Subscription(BaseModel):
@@ -80,6 +236,100 @@ class Subscription(BaseModel):
     destination_label: str = ""
 
 
+class ConfigSnapshot(BaseModel):
+    version: int
+    trigger_alerts: List[TriggerAlert] = []
+    subscriptions: Dict[str, List[Subscription]] = {}  # by alert id
+    rate_limits: Dict[str, RateLimit] = {}  # by destination id
+
+
+_SUBSCRIPTIONS_SELECT = """
+  SELECT
+    s.notifier,
+    s.meta,
+    s.destination_id,
+    d.config as dest_config,
+    d.notifier as dest_notifier,
+    d.label as dest_label,
+    s.alert_id
+  FROM datasette_alerts_subscriptions s
+  LEFT JOIN datasette_alerts_destinations d ON d.id = s.destination_id
+"""
+
+
+def _subscription(row) -> Subscription:
+    if row[2]:  # has destination_id
+        return Subscription(
+            notifier=row[4],  # dest_notifier
+            meta=json.loads(row[1]) if row[1] else {},
+            destination_id=row[2],
+            destination_config=json.loads(row[3]) if row[3] else {},
+            destination_label=row[5] or "",
+        )
+    # legacy: notifier + meta on subscription itself
+    return Subscription(
+        notifier=row[0],
+        meta=json.loads(row[1]),
+        destination_id=None,
+        destination_config={},
+        destination_label="",
+    )
+
+
+_TRIGGER_ALERTS_SELECT = """
+  SELECT id, database_name, table_name, id_columns, filter_params,
+         capture_payload, change_type, watch_columns, debounce_seconds,
+         debounce_max, queue_mode
+  FROM datasette_alerts_alerts
+  WHERE alert_type = 'trigger'
+"""
+
+
+def _trigger_alert(row) -> TriggerAlert:
+    return TriggerAlert(
+        alert_id=row[0],
+        database_name=row[1],
+        table_name=row[2],
+        id_columns=json.loads(row[3]) if row[3] else [],
+        filter_params=json.loads(row[4]) if row[4] else [],
+        capture_payload=bool(row[5]),
+        change_type=row[6] or "insert",
+        watch_columns=json.loads(row[7]) if row[7] else [],
+        debounce_seconds=row[8],
+        debounce_max=row[9],
+        queue_mode=row[10] or "lease",
+    )
+
+
+_ALERT_FOR_CHECK_SELECT = """
+  SELECT a.id, a.database_name, a.table_name, a.id_columns,
+         a.timestamp_column, a.frequency, a.alert_type,
+         a.custom_config, a.last_check_at,
+         l.cursor, l.cursor_id
+  FROM datasette_alerts_alerts a
+  LEFT JOIN datasette_alerts_alert_logs l ON l.id = (
+    SELECT id FROM datasette_alerts_alert_logs
+    WHERE alert_id = a.id ORDER BY logged_at DESC, rowid DESC LIMIT 1
+  )
+"""
+
+
+def _alert_for_check(row) -> AlertForCheck:
+    return AlertForCheck(
+        id=row[0],
+        database_name=row[1],
+        table_name=row[2],
+        id_columns=json.loads(row[3]) if row[3] else [],
+        timestamp_column=row[4] or "",
+        frequency=row[5] or "",
+        alert_type=row[6] or "cursor",
+        custom_config=row[7] or "{}",
+        last_check_at=row[8],
+        cursor=row[9] or "",
+        cursor_id=row[10],
+    )
+
+
 class InternalDB:
     def __init__(self, internal_db: Database):
         self.db = internal_db
@@ -94,8 +344,11 @@ class InternalDB:
                 dest_id = ulid_new()
                 conn.execute(
                     """
-                    INSERT INTO datasette_alerts_destinations(id, notifier, label, config, created_by)
-                    VALUES (?, ?, ?, json(?), ?)
+                    INSERT INTO datasette_alerts_destinations(
+                      id, notifier, label, config, created_by, rate_limit, rate_burst,
+                      digest_window
+                    )
+                    VALUES (?, ?, ?, json(?), ?, ?, ?, ?)
                     """,
                     [
                         dest_id,
@@ -103,8 +356,12 @@ class InternalDB:
                         params.label,
                         json.dumps(params.config),
                         created_by,
+                        params.rate_limit,
+                        params.rate_burst,
+                        params.digest_window,
                     ],
                 )
+                _bump_config_version(conn)
                 return dest_id
 
         return await self.db.execute_write_fn(write)
@@ -112,7 +369,7 @@ class InternalDB:
     async def list_destinations(self) -> list[Destination]:
         def read(conn):
             rows = conn.execute(
-                "SELECT id, notifier, label, config, created_by, created_at FROM datasette_alerts_destinations ORDER BY created_at DESC"
+                "SELECT id, notifier, label, config, created_by, created_at, rate_limit, rate_burst, digest_window FROM datasette_alerts_destinations ORDER BY created_at DESC"
             ).fetchall()
             return [
                 Destination(
@@ -122,16 +379,19 @@ class InternalDB:
                     config=json.loads(r[3]) if r[3] else {},
                     created_by=r[4],
                     created_at=r[5],
+                    rate_limit=r[6],
+                    rate_burst=r[7],
+                    digest_window=r[8],
                 )
                 for r in rows
             ]
 
-        return await self.db.execute_write_fn(read)
+        return await self.db.execute_fn(read)
 
     async def get_destination(self, destination_id: str) -> Destination | None:
         def read(conn):
             row = conn.execute(
-                "SELECT id, notifier, label, config, created_by, created_at FROM datasette_alerts_destinations WHERE id = ?",
+                "SELECT id, notifier, label, config, created_by, created_at, rate_limit, rate_burst, digest_window FROM datasette_alerts_destinations WHERE id = ?",
                 [destination_id],
             ).fetchone()
             if row is None:
@@ -143,17 +403,46 @@ class InternalDB:
                 config=json.loads(row[3]) if row[3] else {},
                 created_by=row[4],
                 created_at=row[5],
+                rate_limit=row[6],
+                rate_burst=row[7],
+                digest_window=row[8],
             )
 
-        return await self.db.execute_write_fn(read)
+        return await self.db.execute_fn(read)
+
+    async def update_destination(
+        self,
+        destination_id: str,
+        label: str,
+        config: dict,
+        rate_limit: float | None | object = _UNCHANGED,
+        rate_burst: int | None | object = _UNCHANGED,
+        digest_window: float | None | object = _UNCHANGED,
+    ):
+        """Update a destination's label and config.
+
+        The delivery settings are only written when passed; None clears one.
+        """
+        delivery = {
+            "rate_limit": rate_limit,
+            "rate_burst": rate_burst,
+            "digest_window": digest_window,
+        }
+        delivery = {k: v for k, v in delivery.items() if v is not _UNCHANGED}
+        set_sql = "".join(f", {column} = :{column}" for column in delivery)
 
-    async def update_destination(self, destination_id: str, label: str, config: dict):
         def write(conn):
             with conn:
                 conn.execute(
-                    "UPDATE datasette_alerts_destinations SET label = ?, config = json(?) WHERE id = ?",
-                    [label, json.dumps(config), destination_id],
+                    f"UPDATE datasette_alerts_destinations SET label = :label, config = json(:config){set_sql} WHERE id = :id",
+                    {
+                        "label": label,
+                        "config": json.dumps(config),
+                        "id": destination_id,
+                        **delivery,
+                    },
                 )
+                _bump_config_version(conn)
 
         return await self.db.execute_write_fn(write)
 
@@ -164,6 +453,7 @@ class InternalDB:
                     "DELETE FROM datasette_alerts_destinations WHERE id = ?",
                     [destination_id],
                 )
+                _bump_config_version(conn)
 
         return await self.db.execute_write_fn(write)
 
@@ -193,60 +483,392 @@ class InternalDB:
         For legacy subscriptions (no destination_id), falls back to notifier + meta columns.
         """
 
+        def read(conn):
+            results = conn.execute(
+                f"{_SUBSCRIPTIONS_SELECT} WHERE s.alert_id = ?", [alert_id]
+            ).fetchall()
+            return [_subscription(row) for row in results]
+
+        return await self.db.execute_fn(read)
+
+    async def config_snapshot(self) -> ConfigSnapshot:
+        """Trigger alerts, every alert's subscriptions and destination rate
+        limits, cached in memory.
+
+        Each call reads only the config version row while the configuration
+        is unchanged, and reloads the snapshot after any mutation.
+        """
+
+        def read_version(conn):
+            return _config_version(conn)
+
+        cached = getattr(self.db, "_alerts_config_snapshot", None)
+        if cached is not None and cached.version == await self.db.execute_fn(
+            read_version
+        ):
+            return cached
+
+        def read(conn):
+            # Read the version first: a change committed while loading makes
+            # the snapshot newer than its version, never older
+            version = _config_version(conn)
+            subscriptions: Dict[str, List[Subscription]] = {}
+            for row in conn.execute(
+                f"{_SUBSCRIPTIONS_SELECT} ORDER BY s.alert_id, s.rowid"
+            ).fetchall():
+                subscriptions.setdefault(row[6], []).append(_subscription(row))
+            trigger_alerts = [
+                _trigger_alert(row)
+                for row in conn.execute(_TRIGGER_ALERTS_SELECT).fetchall()
+            ]
+            rate_limits = {
+                row[0]: RateLimit(rate_limit=row[1], rate_burst=row[2] or 1)
+                for row in conn.execute(
+                    """
+                      SELECT id, rate_limit, rate_burst
+                      FROM datasette_alerts_destinations
+                      WHERE rate_limit IS NOT NULL
+                    """
+                ).fetchall()
+            }
+            return ConfigSnapshot(
+                version=version,
+                trigger_alerts=trigger_alerts,
+                subscriptions=subscriptions,
+                rate_limits=rate_limits,
+            )
+
+        snapshot = await self.db.execute_fn(read)
+        self.db._alerts_config_snapshot = snapshot
+        return snapshot
+
+    async def add_log(
+        self,
+        alert_id: str,
+        new_ids: List[str],
+        cursor: str,
+        cursor_id=None,
+        outbox: List[NewOutboxMessage] | None = None,
+        queue_offset: int | None = None,
+    ):
+        """Adds a log entry for the alert with the new IDs.
+
+        cursor_id is the id of the last row seen at the cursor timestamp, for
+        cursor alerts that page through rows with a (timestamp, id) keyset.
+
+        outbox messages are queued for delivery in the same transaction, so
+        a cursor never advances past rows whose messages were not saved.
+        queue_offset, the last queue row an append-mode trigger alert has
+        processed, is saved in that transaction too.
+        """
+
         def write(conn):
             with conn:
-                results = conn.execute(
+                conn.execute(
                     """
-                    SELECT
-                      s.notifier,
-                      s.meta,
-                      s.destination_id,
-                      d.config as dest_config,
-                      d.notifier as dest_notifier,
-                      d.label as dest_label
-                    FROM datasette_alerts_subscriptions s
-                    LEFT JOIN datasette_alerts_destinations d ON d.id = s.destination_id
-                    WHERE s.alert_id = ?
+                      INSERT INTO datasette_alerts_alert_logs(id, alert_id, new_ids, cursor, cursor_id)
+                      VALUES (?, ?, json(?), ?, ?)
                     """,
-                    [alert_id],
-                ).fetchall()
-                subs = []
-                for row in results:
-                    if row[2]:  # has destination_id
-                        subs.append(
-                            Subscription(
-                                notifier=row[4],  # dest_notifier
-                                meta=json.loads(row[1]) if row[1] else {},
-                                destination_id=row[2],
-                                destination_config=json.loads(row[3]) if row[3] else {},
-                                destination_label=row[5] or "",
-                            )
+                    (ulid_new(), alert_id, json.dumps(new_ids), cursor, cursor_id),
+                )
+                _insert_outbox(conn, outbox or [])
+                if queue_offset is not None:
+                    conn.execute(
+                        """
+                          INSERT INTO datasette_alerts_queue_offsets(alert_id, last_id)
+                          VALUES (?, ?)
+                          ON CONFLICT(alert_id)
+                            DO UPDATE SET last_id = excluded.last_id
+                        """,
+                        [alert_id, queue_offset],
+                    )
+
+        return await self.db.execute_write_fn(write)
+
+    async def queue_offsets(self, alert_ids: List[str]) -> Dict[str, int]:
+        """Last processed queue row id of each append-mode trigger alert.
+
+        Alerts that have not processed any rows yet have an offset of 0.
+        """
+
+        def read(conn):
+            rows = conn.execute(
+                """
+                  SELECT alert_id, last_id FROM datasette_alerts_queue_offsets
+                  WHERE alert_id IN (SELECT value FROM json_each(?))
+                """,
+                [json.dumps(alert_ids)],
+            ).fetchall()
+            return {alert_id: 0 for alert_id in alert_ids} | dict(rows)
+
+        return await self.db.execute_fn(read)
+
+    async def purge_logs(self, retention_days: float, batch_size: int) -> int:
+        """Delete old alert logs, batch_size rows per write transaction.
+
+        Removes logs older than retention_days, and empty logs left by
+        checks that found nothing. Each alert's latest log holds its cursor
+        and is always kept. Returns the number of rows deleted.
+        """
+
+        def delete_batch(conn):
+            with conn:
+                return conn.execute(
+                    """
+                      DELETE FROM datasette_alerts_alert_logs
+                      WHERE id IN (
+                        SELECT l.id FROM datasette_alerts_alert_logs l
+                        WHERE (
+                          l.logged_at < datetime('now', printf('-%f days', ?))
+                          OR json_array_length(l.new_ids) = 0
                         )
-                    else:  # legacy: notifier + meta on subscription itself
-                        subs.append(
-                            Subscription(
-                                notifier=row[0],
-                                meta=json.loads(row[1]),
-                                destination_id=None,
-                                destination_config={},
-                                destination_label="",
-                            )
+                        AND l.id != (
+                          SELECT id FROM datasette_alerts_alert_logs
+                          WHERE alert_id = l.alert_id
+                          ORDER BY logged_at DESC, rowid DESC LIMIT 1
                         )
-                return subs
+                        LIMIT ?
+                      )
+                    """,
+                    [retention_days, batch_size],
+                ).rowcount
+
+        deleted = 0
+        while True:
+            count = await self.db.execute_write_fn(delete_batch)
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+    async def outbox_depth(self, database_name: str) -> dict[str, int]:
+        """Outbox messages from the database's alerts, counted by status."""
+
+        def read(conn):
+            return dict(
+                conn.execute(
+                    """
+                      SELECT o.status, count(*)
+                      FROM datasette_alerts_outbox o
+                      JOIN datasette_alerts_alerts a ON a.id = o.alert_id
+                      WHERE a.database_name = ?
+                      GROUP BY o.status
+                    """,
+                    [database_name],
+                ).fetchall()
+            )
+
+        return await self.db.execute_fn(read)
+
+    async def flush_digests(self) -> int:
+        """Queue one combined message for each digest window that has ended.
+
+        The message lists how many messages each alert sent to the
+        destination during the window. Returns the number queued.
+        """
+
+        def any_due(conn) -> bool:
+            return (
+                conn.execute(
+                    """
+                      SELECT 1 FROM datasette_alerts_digest_items
+                      WHERE send_after <= datetime('now') LIMIT 1
+                    """
+                ).fetchone()
+                is not None
+            )
+
+        # Checked on every delivery run, so only take the write thread when
+        # a window has ended
+        if not await self.db.execute_fn(any_due):
+            return 0
+
+        def write(conn) -> int:
+            with conn:
+                due = conn.execute(
+                    """
+                      SELECT destination_key, max(id)
+                      FROM datasette_alerts_digest_items
+                      GROUP BY destination_key
+                      HAVING min(send_after) <= datetime('now')
+                    """
+                ).fetchall()
+                for destination_key, max_id in due:
+                    rows = conn.execute(
+                        """
+                          SELECT d.alert_id, a.database_name, a.table_name,
+                            a.alert_type, count(*)
+                          FROM datasette_alerts_digest_items d
+                          LEFT JOIN datasette_alerts_alerts a ON a.id = d.alert_id
+                          WHERE d.destination_key = ? AND d.id <= ?
+                          GROUP BY d.alert_id
+                          ORDER BY min(d.id)
+                        """,
+                        [destination_key, max_id],
+                    ).fetchall()
+                    notifier, config = conn.execute(
+                        """
+                          SELECT notifier, config FROM datasette_alerts_digest_items
+                          WHERE id = ?
+                        """,
+                        [max_id],
+                    ).fetchone()
+                    _enqueue_outbox(
+                        conn,
+                        [
+                            NewOutboxMessage(
+                                notifier=notifier,
+                                destination_key=destination_key,
+                                config=json.loads(config),
+                                text=_digest_text(rows),
+                                subject="Alerts digest",
+                            )
+                        ],
+                    )
+                    conn.execute(
+                        """
+                          DELETE FROM datasette_alerts_digest_items
+                          WHERE destination_key = ? AND id <= ?
+                        """,
+                        [destination_key, max_id],
+                    )
+                return len(due)
+
+        return await self.db.execute_write_fn(write)
+
+    async def claim_outbox_items(
+        self, worker_id: str, limit: int, lease_seconds: float
+    ) -> List[OutboxItem]:
+        """Lease up to limit pending outbox items that are due for delivery.
+
+        Destinations are leased whole: items are only claimed for
+        destinations that no other worker holds an unexpired lease on, so
+        each destination's messages are sent by one worker, in order.
+        Items whose lease has expired (their worker died mid-send) are
+        claimed again.
+        """
+
+        def write(conn):
+            with conn:
+                rows = conn.execute(
+                    """
+                      UPDATE datasette_alerts_outbox
+                      SET lease_owner = :worker_id,
+                        lease_expires_at = datetime('now', :lease)
+                      WHERE id IN (
+                        SELECT id FROM datasette_alerts_outbox o
+                        WHERE status = 'pending'
+                          AND next_attempt_at <= datetime('now')
+                          AND (
+                            lease_expires_at IS NULL
+                            OR lease_expires_at <= datetime('now')
+                          )
+                          AND NOT EXISTS (
+                            SELECT 1 FROM datasette_alerts_outbox held
+                            WHERE held.destination_key = o.destination_key
+                              AND held.lease_expires_at > datetime('now')
+                          )
+                        ORDER BY id
+                        LIMIT :limit
+                      )
+                      RETURNING id, alert_id, notifier, destination_key, config,
+                        message_text, message_subject, attempts
+                    """,
+                    {
+                        "worker_id": worker_id,
+                        "lease": f"+{lease_seconds} seconds",
+                        "limit": limit,
+                    },
+                ).fetchall()
+            return sorted(
+                (
+                    OutboxItem(
+                        id=row[0],
+                        alert_id=row[1],
+                        notifier=row[2],
+                        destination_key=row[3],
+                        config=json.loads(row[4]),
+                        message_text=row[5],
+                        message_subject=row[6],
+                        attempts=row[7],
+                    )
+                    for row in rows
+                ),
+                key=lambda item: item.id,
+            )
 
         return await self.db.execute_write_fn(write)
 
-    async def add_log(self, alert_id: str, new_ids: List[str], cursor: str):
-        """Adds a log entry for the alert with the new IDs."""
+    async def finish_outbox_items(
+        self,
+        worker_id: str,
+        sent_ids: List[int],
+        failures: dict[int, str],
+        max_attempts: int,
+        backoff_seconds: float,
+        deferred: dict[int, float] | None = None,
+    ):
+        """Record the outcome of a leased batch.
+
+        Sent items are deleted. Failed items are retried after an
+        exponential backoff (capped at an hour), and marked 'failed' once
+        they have used max_attempts. Deferred items, held back by a rate
+        limit, are retried after the given number of seconds without using
+        up an attempt.
+        """
 
         def write(conn):
             with conn:
                 conn.execute(
                     """
-                      INSERT INTO datasette_alerts_alert_logs(id, alert_id, new_ids, cursor)
-                      VALUES (?, ?, json(?), ?)
+                      DELETE FROM datasette_alerts_outbox
+                      WHERE id IN (SELECT value FROM json_each(?))
+                        AND lease_owner = ?
+                    """,
+                    [json.dumps(sent_ids), worker_id],
+                )
+                conn.executemany(
+                    """
+                      UPDATE datasette_alerts_outbox
+                      SET attempts = attempts + 1,
+                        last_error = :error,
+                        status = CASE
+                          WHEN attempts + 1 >= :max_attempts THEN 'failed'
+                          ELSE 'pending'
+                        END,
+                        next_attempt_at = datetime(
+                          'now',
+                          '+' || min(:backoff * (1 << attempts), 3600) || ' seconds'
+                        ),
+                        lease_owner = NULL,
+                        lease_expires_at = NULL
+                      WHERE id = :id AND lease_owner = :worker_id
                     """,
-                    (ulid_new(), alert_id, json.dumps(new_ids), cursor),
+                    [
+                        {
+                            "id": id,
+                            "error": error,
+                            "max_attempts": max_attempts,
+                            "backoff": backoff_seconds,
+                            "worker_id": worker_id,
+                        }
+                        for id, error in failures.items()
+                    ],
+                )
+                conn.executemany(
+                    """
+                      UPDATE datasette_alerts_outbox
+                      SET next_attempt_at = datetime(
+                          'now', '+' || :delay || ' seconds'
+                        ),
+                        lease_owner = NULL,
+                        lease_expires_at = NULL
+                      WHERE id = :id AND lease_owner = :worker_id
+                    """,
+                    [
+                        # Round up: next_attempt_at has whole-second precision
+                        {"id": id, "delay": math.ceil(delay), "worker_id": worker_id}
+                        for id, delay in (deferred or {}).items()
+                    ],
                 )
 
         return await self.db.execute_write_fn(write)
@@ -349,7 +971,7 @@ class InternalDB:
                 for row in rows
             ]
 
-        return await self.db.execute_write_fn(read)
+        return await self.db.execute_fn(read)
 
     async def get_alert_detail(self, alert_id: str) -> AlertDetail | None:
         """Fetches full alert details including subscriptions and recent logs."""
@@ -435,7 +1057,7 @@ class InternalDB:
                 ],
             )
 
-        return await self.db.execute_write_fn(read)
+        return await self.db.execute_fn(read)
 
     async def new_alert(
         self, params: NewAlertRouteParameters, cursor: str | None = None
@@ -449,10 +1071,14 @@ class InternalDB:
                         """
                           INSERT INTO datasette_alerts_alerts(
                             id, alert_creator_id, database_name, table_name,
-                            id_columns, alert_type, filter_params
+                            id_columns, alert_type, filter_params, capture_payload,
+                            change_type, watch_columns, debounce_seconds, debounce_max,
+                            queue_mode
                           )
                           VALUES (:id, :alert_creator_id, :database_name, :table_name,
-                                  :id_columns, :alert_type, :filter_params)
+                                  :id_columns, :alert_type, :filter_params,
+                                  :capture_payload, :change_type, :watch_columns,
+                                  :debounce_seconds, :debounce_max, :queue_mode)
                           RETURNING id
                         """,
                         {
@@ -465,6 +1091,14 @@ class InternalDB:
                             "filter_params": json.dumps(params.filter_params)
                             if params.filter_params
                             else None,
+                            "capture_payload": params.capture_payload,
+                            "change_type": params.change_type,
+                            "watch_columns": json.dumps(params.watch_columns)
+                            if params.watch_columns
+                            else None,
+                            "debounce_seconds": params.debounce_seconds,
+                            "debounce_max": params.debounce_max,
+                            "queue_mode": params.queue_mode,
                         },
                     ).fetchone()[0]
                 elif params.alert_type.startswith("custom:"):
@@ -535,6 +1169,7 @@ class InternalDB:
                       """,
                         [ulid_new(), alert_id, cursor],
                     )
+                _bump_config_version(conn)
             return alert_id
 
         return await self.db.execute_write_fn(write)
@@ -545,7 +1180,7 @@ class InternalDB:
         def write(conn):
             with conn:
                 row = conn.execute(
-                    "SELECT alert_type, database_name, table_name FROM datasette_alerts_alerts WHERE id = ?",
+                    "SELECT alert_type, database_name, table_name, timestamp_column FROM datasette_alerts_alerts WHERE id = ?",
                     [alert_id],
                 ).fetchone()
                 if row is None:
@@ -554,6 +1189,7 @@ class InternalDB:
                     alert_type=row[0],
                     database_name=row[1],
                     table_name=row[2],
+                    timestamp_column=row[3] or "",
                 )
                 conn.execute(
                     "DELETE FROM datasette_alerts_alert_logs WHERE alert_id = ?",
@@ -563,9 +1199,14 @@ class InternalDB:
                     "DELETE FROM datasette_alerts_subscriptions WHERE alert_id = ?",
                     [alert_id],
                 )
+                conn.execute(
+                    "DELETE FROM datasette_alerts_queue_offsets WHERE alert_id = ?",
+                    [alert_id],
+                )
                 conn.execute(
                     "DELETE FROM datasette_alerts_alerts WHERE id = ?", [alert_id]
                 )
+                _bump_config_version(conn)
                 return info
 
         return await self.db.execute_write_fn(write)
@@ -585,6 +1226,7 @@ class InternalDB:
                     """,
                     [sub_id, alert_id, destination_id, json.dumps(meta)],
                 )
+                _bump_config_version(conn)
                 return sub_id
 
         return await self.db.execute_write_fn(write)
@@ -598,6 +1240,7 @@ class InternalDB:
                     "UPDATE datasette_alerts_subscriptions SET meta = json(?) WHERE id = ?",
                     [json.dumps(meta), subscription_id],
                 )
+                _bump_config_version(conn)
 
         return await self.db.execute_write_fn(write)
 
@@ -610,6 +1253,7 @@ class InternalDB:
                     "DELETE FROM datasette_alerts_subscriptions WHERE id = ?",
                     [subscription_id],
                 )
+                _bump_config_version(conn)
 
         return await self.db.execute_write_fn(write)
 
@@ -640,40 +1284,68 @@ class InternalDB:
                 for row in rows
             ]
 
-        return await self.db.execute_write_fn(read)
+        return await self.db.execute_fn(read)
 
     async def get_alert_for_check(self, alert_id: str) -> AlertForCheck | None:
         """Fetch a single alert with its last cursor value (for cursor/custom handler)."""
 
         def read(conn):
             row = conn.execute(
-                """
-                  SELECT a.id, a.database_name, a.table_name, a.id_columns,
-                         a.timestamp_column, a.frequency, a.alert_type,
-                         a.custom_config, a.last_check_at,
-                         (SELECT cursor FROM datasette_alerts_alert_logs
-                          WHERE alert_id = a.id ORDER BY logged_at DESC LIMIT 1) as cursor
-                  FROM datasette_alerts_alerts a
+                f"""
+                  {_ALERT_FOR_CHECK_SELECT}
                   WHERE a.id = ?
                 """,
                 [alert_id],
             ).fetchone()
             if row is None:
                 return None
-            return AlertForCheck(
-                id=row[0],
-                database_name=row[1],
-                table_name=row[2],
-                id_columns=json.loads(row[3]) if row[3] else [],
-                timestamp_column=row[4] or "",
-                frequency=row[5] or "",
-                alert_type=row[6] or "cursor",
-                custom_config=row[7] or "{}",
-                last_check_at=row[8],
-                cursor=row[9] or "",
-            )
+            return _alert_for_check(row)
+
+        return await self.db.execute_fn(read)
+
+    async def get_cursor_alerts_in_group(
+        self,
+        database_name: str,
+        table_name: str,
+        timestamp_column: str,
+        due_only: bool = False,
+    ) -> list[AlertForCheck]:
+        """Cursor alerts watching the same table and timestamp column.
+
+        With due_only, only alerts whose frequency has elapsed since their
+        last check (or that have never been checked) are returned, allowing
+        one second for the scheduler's tick resolution.
+        """
 
-        return await self.db.execute_write_fn(read)
+        def read(conn):
+            rows = conn.execute(
+                f"""
+                  {_ALERT_FOR_CHECK_SELECT}
+                  WHERE a.alert_type = 'cursor'
+                    AND a.database_name = :database_name
+                    AND a.table_name = :table_name
+                    AND a.timestamp_column = :timestamp_column
+                    AND (
+                      NOT :due_only
+                      OR a.last_check_at IS NULL
+                      -- last_check_at has one-second resolution; allow one
+                      -- second so a check stamped just after a tick is still
+                      -- due on the tick one interval later
+                      OR datetime(a.last_check_at, a.frequency, '-1 second')
+                        <= datetime('now')
+                    )
+                  ORDER BY a.id
+                """,
+                {
+                    "database_name": database_name,
+                    "table_name": table_name,
+                    "timestamp_column": timestamp_column,
+                    "due_only": due_only,
+                },
+            ).fetchall()
+            return [_alert_for_check(row) for row in rows]
+
+        return await self.db.execute_fn(read)
 
     async def update_last_check(self, alert_id: str):
         """Set last_check_at to now for a custom alert type."""
@@ -691,25 +1363,41 @@ class InternalDB:
 
         return await self.db.execute_write_fn(write)
 
+    async def update_last_checks(self, alert_ids: list[str]):
+        """Set last_check_at to now for several alerts at once."""
+        if not alert_ids:
+            return
+
+        def write(conn):
+            with conn:
+                conn.execute(
+                    """
+                      UPDATE datasette_alerts_alerts
+                      SET last_check_at = datetime('now')
+                      WHERE id IN (SELECT value FROM json_each(?))
+                    """,
+                    [json.dumps(alert_ids)],
+                )
+
+        return await self.db.execute_write_fn(write)
+
+    async def reset_last_check(self, alert_id: str):
+        """Clear last_check_at so a cursor alert is due on the next group scan."""
+
+        def write(conn):
+            with conn:
+                conn.execute(
+                    "UPDATE datasette_alerts_alerts SET last_check_at = NULL WHERE id = ?",
+                    [alert_id],
+                )
+
+        return await self.db.execute_write_fn(write)
+
     async def get_trigger_alerts(self) -> list[TriggerAlert]:
         """Return all trigger-type alerts."""
 
         def read(conn):
-            rows = conn.execute(
-                """
-                  SELECT id, database_name, table_name, id_columns
-                  FROM datasette_alerts_alerts
-                  WHERE alert_type = 'trigger'
-                """
-            ).fetchall()
-            return [
-                TriggerAlert(
-                    alert_id=row[0],
-                    database_name=row[1],
-                    table_name=row[2],
-                    id_columns=json.loads(row[3]) if row[3] else [],
-                )
-                for row in rows
-            ]
+            rows = conn.execute(_TRIGGER_ALERTS_SELECT).fetchall()
+            return [_trigger_alert(row) for row in rows]
 
-        return await self.db.execute_write_fn(read)
+        return await self.db.execute_fn(read)
@@ -78,3 +78,188 @@ def m004_custom_alerts(db: Database):
           ALTER TABLE datasette_alerts_alerts ADD COLUMN last_check_at TEXT;
         """
     )
+
+
+@internal_migrations()
+def m005_compound_cursor(db: Database):
+    # Tie-breaking id for the (timestamp, id) keyset cursor. Left untyped so
+    # integer and text primary keys keep their storage class.
+    db.executescript(
+        """
+          ALTER TABLE datasette_alerts_alert_logs ADD COLUMN cursor_id;
+        """
+    )
+
+
+@internal_migrations()
+def m006_outbox(db: Database):
+    # Rendered messages waiting to be delivered. Checks insert rows here and
+    # delivery workers lease, send and retry them.
+    db.executescript(
+        """
+          CREATE TABLE datasette_alerts_outbox (
+            id INTEGER PRIMARY KEY,
+            alert_id TEXT,
+            notifier TEXT NOT NULL,
+            destination_key TEXT NOT NULL,
+            config JSON NOT NULL DEFAULT '{}',
+            message_text TEXT NOT NULL,
+            message_subject TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL DEFAULT (datetime('now')),
+            lease_owner TEXT,
+            lease_expires_at TEXT,
+            last_error TEXT,
+            created_at TEXT DEFAULT (datetime('now'))
+          );
+
+          CREATE INDEX datasette_alerts_outbox_ready
+            ON datasette_alerts_outbox(status, next_attempt_at);
+        """
+    )
+
+
+@internal_migrations()
+def m007_indexes(db: Database):
+    # Every check, page and handler looks up logs and subscriptions by
+    # alert_id, and the latest log by logged_at; the alerts list filters by
+    # database and sorts by creation time.
+    db.executescript(
+        """
+          CREATE INDEX IF NOT EXISTS datasette_alerts_alert_logs_alert_logged
+            ON datasette_alerts_alert_logs(alert_id, logged_at);
+
+          CREATE INDEX IF NOT EXISTS datasette_alerts_subscriptions_alert
+            ON datasette_alerts_subscriptions(alert_id);
+
+          CREATE INDEX IF NOT EXISTS datasette_alerts_alerts_database_created
+            ON datasette_alerts_alerts(database_name, alert_created_at);
+        """
+    )
+
+
+@internal_migrations()
+def m008_config_version(db: Database):
+    # Incremented by every change to alerts, subscriptions or destinations,
+    # so cached copies of that configuration know when to reload.
+    db.executescript(
+        """
+          CREATE TABLE datasette_alerts_config_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+          );
+
+          INSERT INTO datasette_alerts_config_version(id, version) VALUES (1, 0);
+        """
+    )
+
+
+@internal_migrations()
+def m009_trigger_payload(db: Database):
+    # Trigger alerts that store the template's columns of each new row in
+    # the queue, instead of reading the row back when the queue is drained.
+    db.executescript(
+        """
+          ALTER TABLE datasette_alerts_alerts
+            ADD COLUMN capture_payload INTEGER NOT NULL DEFAULT 0;
+        """
+    )
+
+
+@internal_migrations()
+def m010_trigger_change_types(db: Database):
+    # Trigger alerts on UPDATE or DELETE as well as INSERT. UPDATE alerts
+    # can watch a subset of columns.
+    db.executescript(
+        """
+          ALTER TABLE datasette_alerts_alerts
+            ADD COLUMN change_type TEXT NOT NULL DEFAULT 'insert';
+          ALTER TABLE datasette_alerts_alerts
+            ADD COLUMN watch_columns TEXT;
+        """
+    )
+
+
+@internal_migrations()
+def m011_destination_rate_limits(db: Database):
+    # A token bucket per destination: rate_limit messages per minute, in
+    # bursts of up to rate_burst. NULL rate_limit means unlimited.
+    db.executescript(
+        """
+          ALTER TABLE datasette_alerts_destinations ADD COLUMN rate_limit REAL;
+          ALTER TABLE datasette_alerts_destinations ADD COLUMN rate_burst INTEGER;
+        """
+    )
+
+
+@internal_migrations()
+def m012_digests(db: Database):
+    # Destinations with a digest_window (seconds) get one combined message
+    # per window. Messages for them wait in datasette_alerts_digest_items
+    # until their window's send_after, then are merged into the outbox.
+    db.executescript(
+        """
+          ALTER TABLE datasette_alerts_destinations ADD COLUMN digest_window REAL;
+
+          CREATE TABLE datasette_alerts_digest_items (
+            id INTEGER PRIMARY KEY,
+            alert_id TEXT,
+            notifier TEXT NOT NULL,
+            destination_key TEXT NOT NULL,
+            config JSON NOT NULL DEFAULT '{}',
+            message_text TEXT NOT NULL,
+            message_subject TEXT,
+            send_after TEXT NOT NULL,
+            created_at TEXT DEFAULT (datetime('now'))
+          );
+
+          CREATE INDEX datasette_alerts_digest_items_destination
+            ON datasette_alerts_digest_items(destination_key, send_after);
+          CREATE INDEX datasette_alerts_digest_items_send_after
+            ON datasette_alerts_digest_items(send_after);
+        """
+    )
+
+
+@internal_migrations()
+def m013_trigger_debounce(db: Database):
+    # Trigger alerts that wait for a burst of rows to go quiet for
+    # debounce_seconds (or for debounce_max seconds at most) and then send
+    # one notification for the whole burst.
+    db.executescript(
+        """
+          ALTER TABLE datasette_alerts_alerts ADD COLUMN debounce_seconds REAL;
+          ALTER TABLE datasette_alerts_alerts ADD COLUMN debounce_max REAL;
+        """
+    )
+
+
+@internal_migrations()
+def m014_append_queue(db: Database):
+    # Trigger alerts in 'append' queue mode never update their queue rows.
+    # Each keeps the id of the last queue row it processed here, and rows
+    # up to that id are deleted in bulk by the maintenance task.
+    db.executescript(
+        """
+          ALTER TABLE datasette_alerts_alerts
+            ADD COLUMN queue_mode TEXT NOT NULL DEFAULT 'lease';
+
+          CREATE TABLE datasette_alerts_queue_offsets (
+            alert_id TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL
+          );
+        """
+    )
+
+
+@internal_migrations()
+def m015_outbox_destination_leases(db: Database):
+    # Delivery workers lease a destination's outbox rows together, and skip
+    # destinations with rows another worker has leased.
+    db.executescript(
+        """
+          CREATE INDEX datasette_alerts_outbox_destination_lease
+            ON datasette_alerts_outbox(destination_key, lease_expires_at);
+        """
+    )
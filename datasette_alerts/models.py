@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Optional
 
 
 @dataclass
@@ -31,6 +31,7 @@ class AlertForCheck:
     custom_config: str
     last_check_at: Optional[str]
     cursor: str
+    cursor_id: Any = None
 
 
 @dataclass
@@ -81,3 +82,18 @@ class AlertCleanupInfo:
     alert_type: str
     database_name: str
     table_name: str
+    timestamp_column: str = ""
+
+
+@dataclass
+class OutboxItem:
+    """Returned by claim_outbox_items()."""
+
+    id: int
+    alert_id: Optional[str]
+    notifier: str
+    destination_key: str
+    config: dict
+    message_text: str
+    message_subject: Optional[str]
+    attempts: int
@@ -1,6 +1,13 @@
+import functools
+import inspect
 from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
 from pydantic import BaseModel
 
+if TYPE_CHECKING:
+    import httpx
+
 
 class ConfigElement(BaseModel):
     """Declares a web component for rich notifier configuration UI.
@@ -28,6 +35,38 @@ class Message:
         self.subject = subject
 
 
+class SendContext:
+    """Shared resources for notifiers, passed to Notifier.send() as ``context``.
+
+    ``http_client`` is an ``httpx.AsyncClient`` owned by datasette-alerts,
+    with connection pooling and keep-alive. Notifiers should use it rather
+    than opening their own connections; they must not close it.
+    """
+
+    def __init__(self, datasette):
+        self.datasette = datasette
+
+    @property
+    def http_client(self) -> "httpx.AsyncClient":
+        from .http_client import get_http_client
+
+        return get_http_client(self.datasette)
+
+
+class RateLimited(Exception):
+    """Raised by a notifier when the destination asks it to slow down.
+
+    ``retry_after`` is the number of seconds the destination asked to wait,
+    e.g. from an HTTP 429 response's ``Retry-After`` header, or None if it
+    did not say. Sends to that destination pause for that long, and the
+    messages go out afterwards rather than counting as failed.
+    """
+
+    def __init__(self, retry_after: float | None = None, message: str = ""):
+        super().__init__(message or "Rate limited")
+        self.retry_after = retry_after
+
+
 class Notifier(ABC):
     @property
     @abstractmethod
@@ -39,6 +78,9 @@ class Notifier(ABC):
 
     description: str = ""
     icon: str = ""
+    # Most messages send_many() should be given at once, e.g. the number of
+    # embeds a webhook accepts per request.
+    max_batch_size: int = 1
 
     def get_config_form(self):
         """
@@ -62,11 +104,60 @@ class Notifier(ABC):
         """
         return None
 
-    async def send(self, config: dict, message: Message):
+    async def send(
+        self, config: dict, message: Message, context: SendContext | None = None
+    ):
         """
         Deliver a message to the destination described by config.
 
         :param config: Notifier-specific configuration (e.g. webhook_url, channel).
         :param message: The message to deliver.
+        :param context: Shared resources such as the HTTP client. Only passed
+            to notifiers whose send() accepts a ``context`` argument.
         """
         raise NotImplementedError("Subclasses must implement send method")
+
+    async def send_many(
+        self,
+        config: dict,
+        messages: list[Message],
+        context: SendContext | None = None,
+    ):
+        """
+        Deliver several messages to one destination, in order.
+
+        Called with at most max_batch_size messages. Override this (and
+        raise max_batch_size) when the destination accepts batched payloads.
+        The default sends each message with send().
+        """
+        for message in messages:
+            await call_send(self, config, message, context)
+
+
+@functools.cache
+def _accepts_context(notifier_class, method: str) -> bool:
+    parameters = inspect.signature(getattr(notifier_class, method)).parameters
+    return "context" in parameters or any(
+        p.kind is inspect.Parameter.VAR_KEYWORD for p in parameters.values()
+    )
+
+
+async def call_send(
+    notifier: Notifier, config: dict, message: Message, context: SendContext | None
+):
+    """Call notifier.send(), passing context if the notifier accepts it."""
+    if _accepts_context(type(notifier), "send"):
+        return await notifier.send(config, message, context=context)
+    return await notifier.send(config, message)
+
+
+async def call_send_many(
+    notifier: Notifier,
+    config: dict,
+    messages: list[Message],
+    context: SendContext | None,
+):
+    """Call notifier.send_many(), passing context if the notifier accepts it."""
+    if _accepts_context(type(notifier), "send_many"):
+        return await notifier.send_many(config, messages, context=context)
+    return await notifier.send_many(config, messages)
@@ -31,6 +31,9 @@ class DestinationInfo(BaseModel):
     label: str
     config: dict = {}
     created_at: str | None = None
+    rate_limit: float | None = None
+    rate_burst: int | None = None
+    digest_window: float | None = None
 
 
 # /-/{db_name}/datasette-alerts/destinations — manage destinations
@@ -50,6 +53,7 @@ class NewAlertPageData(BaseModel):
 
 class NewAlertResponseData(BaseModel):
     alert_id: str
+    warnings: list[str] = []
 
 
 class NewAlertResponse(BaseModel):
@@ -108,6 +112,7 @@ class AlertDetailPageData(BaseModel):
     logs: list[AlertLogEntry] = []
     notifiers: list[NotifierInfo] = []
     destinations: list[DestinationInfo] = []
+    warnings: list[str] = []
 
 
 __exports__ = [
@@ -0,0 +1,46 @@
+"""Cached registry of the notifiers and alert types that plugins provide.
+
+The plugin hooks run once and their results are kept on the Datasette
+instance, keyed by slug. The cache is rebuilt when the set of registered
+plugins changes.
+"""
+
+from datasette.plugins import pm
+from datasette.utils import await_me_maybe
+
+from .alert_type import AlertType
+from .notifier import Notifier
+
+
+def _plugins_key() -> frozenset:
+    return frozenset((name, id(plugin)) for name, plugin in pm.list_name_plugin())
+
+
+async def get_notifier_registry(datasette) -> dict[str, Notifier]:
+    """Registered notifiers by slug. The first plugin to claim a slug wins."""
+    key = _plugins_key()
+    cached = getattr(datasette, "_alerts_notifier_registry", None)
+    if cached is None or cached[0] != key:
+        notifiers: dict[str, Notifier] = {}
+        for result in pm.hook.datasette_alerts_register_notifiers(datasette=datasette):
+            for notifier in await await_me_maybe(result) or []:
+                notifiers.setdefault(notifier.slug, notifier)
+        cached = (key, notifiers)
+        datasette._alerts_notifier_registry = cached
+    return cached[1]
+
+
+def get_alert_type_registry(datasette) -> dict[str, AlertType]:
+    """Registered custom alert types by slug."""
+    key = _plugins_key()
+    cached = getattr(datasette, "_alerts_alert_type_registry", None)
+    if cached is None or cached[0] != key:
+        alert_types: dict[str, AlertType] = {}
+        for result in pm.hook.datasette_alerts_register_alert_types(
+            datasette=datasette
+        ):
+            for alert_type in result or []:
+                alert_types[alert_type.slug] = alert_type
+        cached = (key, alert_types)
+        datasette._alerts_alert_type_registry = cached
+    return cached[1]
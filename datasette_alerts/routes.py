@@ -1,12 +1,12 @@
 from dataclasses import asdict
 from typing import Annotated
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datasette import Response
 from datasette_plugin_router import Body
 
 from .internal_db import InternalDB, NewAlertRouteParameters, NewDestination
-from .notifier import Message
+from .notifier import Message, SendContext, call_send
 from .page_data import (
     AlertDetailPageData,
     AlertInfo,
@@ -20,8 +20,12 @@ from .page_data import (
     NotifierInfo,
 )
 from .router import router, check_permission
+from .cursor_db import create_cursor_index, cursor_index_warnings, cursor_key_columns
+from .settings import get_settings
 from .destinations import get_notifiers, send_to_destination
-from .trigger_db import create_queue_and_trigger, drop_queue_and_trigger
+from .registry import get_notifier_registry
+from .handlers import trigger_payload_columns
+from .trigger_db import create_queue_and_trigger, drop_queue_and_trigger, queue_depth
 
 
 async def render_page(
@@ -121,6 +125,9 @@ async def _build_destination_infos(internal_db: InternalDB) -> list[DestinationI
             label=d.label,
             config=d.config,
             created_at=d.created_at,
+            rate_limit=d.rate_limit,
+            rate_burst=d.rate_burst,
+            digest_window=d.digest_window,
         )
         for d in dests
     ]
@@ -178,13 +185,25 @@ async def ui_alert_detail(datasette, request, db_name: str, alert_id: str):
     notifier_infos = await _build_notifier_infos(datasette)
     destination_infos = await _build_destination_infos(internal_db)
 
+    warnings = []
+    if detail.alert_type == "cursor":
+        warnings = await cursor_index_warnings(
+            db,
+            detail.table_name,
+            detail.timestamp_column,
+            await cursor_key_columns(db, detail.table_name, detail.id_columns),
+        )
+
     return await render_page(
         datasette,
         request,
         page_title=f"Alert — {detail.table_name}",
         entrypoint="src/pages/alert_detail/index.ts",
         page_data=AlertDetailPageData(
-            **asdict(detail), notifiers=notifier_infos, destinations=destination_infos
+            **asdict(detail),
+            notifiers=notifier_infos,
+            destinations=destination_infos,
+            warnings=warnings,
         ),
         breadcrumbs=_alerts_crumbs(datasette, db_name)
         + [
@@ -240,6 +259,30 @@ async def ui_new_alert(datasette, request, db_name: str):
     )
 
 
+async def _refresh_trigger_payload(datasette, internal_db: InternalDB, alert_id: str):
+    """Recreate a payload-capturing trigger for the alert's current templates."""
+    snapshot = await internal_db.config_snapshot()
+    alert = next((a for a in snapshot.trigger_alerts if a.alert_id == alert_id), None)
+    if alert is None or not alert.capture_payload:
+        return
+    db = datasette.databases.get(alert.database_name)
+    if db is None:
+        return
+    await create_queue_and_trigger(
+        db,
+        alert_id,
+        alert.table_name,
+        alert.id_columns,
+        alert.filter_params,
+        trigger_payload_columns(
+            [sub.meta for sub in snapshot.subscriptions.get(alert_id, [])]
+        ),
+        alert.change_type,
+        alert.watch_columns,
+        alert.queue_mode,
+    )
+
+
 @router.POST(
     r"/-/(?P<db_name>[^/]+)/datasette-alerts/api/new$", output=NewAlertResponse
 )
@@ -256,6 +299,7 @@ async def api_new_alert(
 
     body.database_name = db_name
     internal_db = InternalDB(datasette.get_internal_database())
+    warnings: list[str] = []
 
     if body.alert_type == "trigger":
         # Auto-detect PK columns from table schema
@@ -267,9 +311,47 @@ async def api_new_alert(
             pk_columns = ["rowid"]
         body.id_columns = pk_columns
 
+        if body.watch_columns:
+            if body.change_type != "update":
+                return Response.json(
+                    {"ok": False, "error": "watch_columns requires change_type update"},
+                    status=400,
+                )
+            table_columns = set(await db.table_columns(body.table_name))
+            unknown = [c for c in body.watch_columns if c not in table_columns]
+            if unknown:
+                return Response.json(
+                    {"ok": False, "error": f"Unknown columns: {', '.join(unknown)}"},
+                    status=400,
+                )
+        if body.debounce_max is not None and body.debounce_seconds is None:
+            return Response.json(
+                {"ok": False, "error": "debounce_max requires debounce_seconds"},
+                status=400,
+            )
+        if body.debounce_seconds is not None and body.queue_mode == "append":
+            return Response.json(
+                {"ok": False, "error": "debounce_seconds requires queue_mode lease"},
+                status=400,
+            )
+        if body.change_type != "insert":
+            # Deleted rows cannot be read back, and old values are only
+            # known to the trigger
+            body.capture_payload = True
+
         alert_id = await internal_db.new_alert(body)
         await create_queue_and_trigger(
-            db, alert_id, body.table_name, pk_columns, body.filter_params
+            db,
+            alert_id,
+            body.table_name,
+            pk_columns,
+            body.filter_params,
+            trigger_payload_columns([sub.meta for sub in body.subscriptions])
+            if body.capture_payload
+            else None,
+            body.change_type,
+            body.watch_columns,
+            body.queue_mode,
         )
     elif body.alert_type.startswith("custom:"):
         alert_id = await internal_db.new_alert(body)
@@ -280,6 +362,23 @@ async def api_new_alert(
         initial_cursor = result.rows[0][0]
         alert_id = await internal_db.new_alert(body, initial_cursor)
 
+        key_columns = await cursor_key_columns(db, body.table_name, body.id_columns)
+        warnings = await cursor_index_warnings(
+            db, body.table_name, body.timestamp_column, key_columns
+        )
+        if warnings and get_settings(datasette).create_cursor_indexes:
+            try:
+                await create_cursor_index(
+                    db, body.table_name, body.timestamp_column, key_columns
+                )
+            except Exception as e:
+                # The alert is already saved, so still register its cron task
+                warnings.append(f"Could not create index on {body.table_name}: {e}")
+            else:
+                warnings = await cursor_index_warnings(
+                    db, body.table_name, body.timestamp_column, key_columns
+                )
+
     # Register cron task for the new alert
     from types import SimpleNamespace
     from datasette_alerts import _register_cron_task_for_alert
@@ -288,6 +387,9 @@ async def api_new_alert(
         id=alert_id,
         alert_type=body.alert_type,
         frequency=body.frequency,
+        database_name=db_name,
+        table_name=body.table_name,
+        timestamp_column=body.timestamp_column,
     )
     await _register_cron_task_for_alert(datasette, alert_obj)
 
@@ -305,7 +407,9 @@ async def api_new_alert(
         except Exception:
             pass
 
-    return Response.json({"ok": True, "data": {"alert_id": alert_id}})
+    return Response.json(
+        {"ok": True, "data": {"alert_id": alert_id, "warnings": warnings}}
+    )
 
 
 class AddSubscriptionBody(BaseModel):
@@ -335,6 +439,7 @@ async def api_add_subscription(
     sub_id = await internal_db.add_subscription(
         alert_id, body.destination_id, body.meta
     )
+    await _refresh_trigger_payload(datasette, internal_db, alert_id)
     return Response.json({"ok": True, "data": {"subscription_id": sub_id}})
 
 
@@ -352,6 +457,7 @@ async def api_update_subscription(
 ):
     internal_db = InternalDB(datasette.get_internal_database())
     await internal_db.update_subscription(sub_id, body.meta)
+    await _refresh_trigger_payload(datasette, internal_db, alert_id)
     return Response.json({"ok": True})
 
 
@@ -364,6 +470,7 @@ async def api_delete_subscription(
 ):
     internal_db = InternalDB(datasette.get_internal_database())
     await internal_db.delete_subscription(sub_id)
+    await _refresh_trigger_payload(datasette, internal_db, alert_id)
     return Response.json({"ok": True})
 
 
@@ -388,6 +495,12 @@ async def api_delete_alert(datasette, request, db_name: str, alert_id: str):
 
     # Remove cron task
     try:
+        if info.alert_type == "cursor":
+            from datasette_alerts import _sync_cursor_scan_task
+
+            await _sync_cursor_scan_task(
+                datasette, info.database_name, info.table_name, info.timestamp_column
+            )
         scheduler = datasette._cron_scheduler
         for prefix in ["alerts:cursor:", "alerts:custom:"]:
             try:
@@ -440,11 +553,18 @@ class NewDestinationBody(BaseModel):
     notifier: str
     label: str
     config: dict = {}
+    rate_limit: float | None = Field(default=None, gt=0)  # messages per minute
+    rate_burst: int | None = Field(default=None, ge=1)
+    digest_window: float | None = Field(default=None, gt=0)  # seconds
 
 
 class UpdateDestinationBody(BaseModel):
     label: str
     config: dict = {}
+    # Left unchanged when omitted, cleared when null
+    rate_limit: float | None = Field(default=None, gt=0)
+    rate_burst: int | None = Field(default=None, ge=1)
+    digest_window: float | None = Field(default=None, gt=0)
 
 
 @router.POST(r"/-/(?P<db_name>[^/]+)/datasette-alerts/api/destinations/new$")
@@ -455,7 +575,14 @@ async def api_new_destination(
     internal_db = InternalDB(datasette.get_internal_database())
     created_by = request.actor.get("id") if request.actor else None
     dest_id = await internal_db.create_destination(
-        NewDestination(notifier=body.notifier, label=body.label, config=body.config),
+        NewDestination(
+            notifier=body.notifier,
+            label=body.label,
+            config=body.config,
+            rate_limit=body.rate_limit,
+            rate_burst=body.rate_burst,
+            digest_window=body.digest_window,
+        ),
         created_by=created_by,
     )
     return Response.json({"ok": True, "data": {"destination_id": dest_id}})
@@ -478,7 +605,13 @@ async def api_update_destination(
         return Response.json(
             {"ok": False, "error": "Destination not found"}, status=404
         )
-    await internal_db.update_destination(dest_id, body.label, body.config)
+    # Delivery settings left out of the body are kept
+    delivery = {
+        name: getattr(body, name)
+        for name in ("rate_limit", "rate_burst", "digest_window")
+        if name in body.model_fields_set
+    }
+    await internal_db.update_destination(dest_id, body.label, body.config, **delivery)
     return Response.json({"ok": True})
 
 
@@ -515,15 +648,17 @@ async def api_test_destination_transient(
     datasette, request, db_name: str, body: Annotated[TestDestinationBody, Body()]
 ):
     """Test a destination config without saving it. Sends a real test message."""
-    notifiers = await get_notifiers(datasette)
-    notifier = next((n for n in notifiers if n.slug == body.notifier), None)
+    notifier = (await get_notifier_registry(datasette)).get(body.notifier)
     if notifier is None:
         return Response.json(
             {"ok": False, "error": f"Notifier {body.notifier!r} not found"}, status=404
         )
     try:
-        await notifier.send(
-            body.config, Message(body.text, subject=body.subject or None)
+        await call_send(
+            notifier,
+            body.config,
+            Message(body.text, subject=body.subject or None),
+            SendContext(datasette),
         )
         return Response.json({"ok": True})
     except Exception as e:
@@ -551,6 +686,35 @@ async def api_test_destination_saved(
         return Response.json({"ok": False, "error": str(e)}, status=400)
 
 
+@router.GET(r"/-/(?P<db_name>[^/]+)/datasette-alerts/api/queue-stats$")
+@check_permission()
+async def api_queue_stats(datasette, request, db_name: str):
+    """Queue depths for the database's alerts, and the last trigger drain."""
+    from .handlers import _trigger_drain_state
+
+    db = datasette.databases.get(db_name)
+    if db is None:
+        return Response.json(
+            {"ok": False, "error": f"Database {db_name} not found"}, status=404
+        )
+    internal_db = InternalDB(datasette.get_internal_database())
+    state = _trigger_drain_state(datasette, db_name)
+    return Response.json(
+        {
+            "ok": True,
+            "data": {
+                "trigger_queue": await queue_depth(db),
+                "outbox": await internal_db.outbox_depth(db_name),
+                "drain": {
+                    "batch_size": state["batch_size"]
+                    or get_settings(datasette).trigger_batch_size,
+                    "last_drain": state["last_drain"],
+                },
+            },
+        }
+    )
+
+
 @router.GET(r"/-/(?P<db_name>[^/]+)/datasette-alerts/api/alert-types$")
 @check_permission()
 async def api_list_alert_types(datasette, request, db_name: str):
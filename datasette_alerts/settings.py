@@ -0,0 +1,77 @@
+"""Plugin-level settings, read from the ``datasette-alerts`` plugin config.
+
+    plugins:
+      datasette-alerts:
+        cursor_page_size: 500
+        create_cursor_indexes: true
+"""
+
+from dataclasses import dataclass, fields
+
+
+@dataclass
+class AlertsSettings:
+    # Rows fetched per keyset page when scanning a cursor alert's table.
+    cursor_page_size: int = 1000
+    # Create an index on (timestamp_column, id column) in the watched
+    # database when a cursor alert is created and its query would scan.
+    create_cursor_indexes: bool = False
+    # Notifier sends in flight at once, across all alerts.
+    max_concurrent_sends: int = 10
+    # Notifier sends in flight at once to any one destination.
+    max_concurrent_sends_per_destination: int = 2
+    # Seconds before a single notifier send is abandoned as failed.
+    send_timeout: float = 30.0
+    # Workers draining the delivery outbox, and messages each leases at once.
+    delivery_workers: int = 4
+    delivery_batch_size: int = 20
+    # Attempts before an outbox message is marked failed.
+    delivery_max_attempts: int = 5
+    # Seconds before the first retry; doubles on each attempt, up to an hour.
+    delivery_backoff: float = 30.0
+    # Seconds a worker holds a leased batch before another may claim it.
+    delivery_lease: float = 300.0
+    # Seconds a delivery worker waits for a destination's rate limit before
+    # putting the message back in the outbox for later.
+    max_rate_limit_wait: float = 10.0
+    # Seconds each trigger drain may spend claiming batches before leaving
+    # the rest of the queue for the next run.
+    trigger_drain_budget: float = 5.0
+    # Rows claimed per trigger queue batch at first, and at most as the
+    # batch size adapts to how long batches take.
+    trigger_batch_size: int = 100
+    trigger_max_batch_size: int = 5000
+    # Minutes to keep completed trigger queue rows, and days to keep rows
+    # that failed every attempt, before the maintenance task deletes them.
+    queue_completed_retention: float = 10.0
+    queue_failed_retention: float = 7.0
+    # Days to keep alert log rows. An alert's latest log, which holds its
+    # cursor, is always kept.
+    log_retention: float = 30.0
+    # Rows deleted per write transaction by the maintenance task.
+    maintenance_batch_size: int = 500
+
+    def __post_init__(self):
+        for f in fields(self):
+            if f.type in (int, float):
+                setattr(self, f.name, _positive(f.name, getattr(self, f.name), f.type))
+
+
+def _positive(name: str, value, type_):
+    try:
+        value = type_(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number, got {value!r}")
+    if value <= 0:
+        raise ValueError(f"{name} must be positive, got {value}")
+    return value
+
+
+def get_settings(datasette) -> AlertsSettings:
+    """Build AlertsSettings from plugin config, ignoring unknown keys.
+
+    Raises ValueError for invalid values.
+    """
+    config = datasette.plugin_config("datasette-alerts") or {}
+    known = {f.name for f in fields(AlertsSettings)}
+    return AlertsSettings(**{k: v for k, v in config.items() if k in known})
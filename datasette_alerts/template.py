@@ -1,26 +1,72 @@
+import functools
+import json
+from collections.abc import Mapping
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """A ProseMirror template flattened to literal text and variable names.
+
+    parts alternates between the two: even indexes are literal text, odd
+    indexes are variable names.
+    """
+
+    parts: tuple[str, ...]
+    variables: frozenset[str]
+
+    def render(self, variables: Mapping) -> str:
+        """Substitute variables, converting only the values the template uses.
+
+        Unknown variables are left as {{name}}.
+        """
+        out = []
+        for i, part in enumerate(self.parts):
+            if i % 2 == 0:
+                out.append(part)
+            elif part in variables:
+                out.append(str(variables[part]))
+            else:
+                out.append(f"{{{{{part}}}}}")
+        return "".join(out)
+
+
+def compile_template(template_doc: dict) -> CompiledTemplate:
+    """Compile a ProseMirror JSON document, cached by its content."""
+    return _compile(json.dumps(template_doc or {}, sort_keys=True))
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(template_json: str) -> CompiledTemplate:
+    template_doc = json.loads(template_json)
+    parts = [""]
+    paragraphs = [
+        block
+        for block in template_doc.get("content", [])
+        if block.get("type") == "paragraph"
+    ]
+    for index, paragraph in enumerate(paragraphs):
+        if index:
+            parts[-1] += "\n"
+        for child in paragraph.get("content", []):
+            node_type = child.get("type")
+            if node_type == "text":
+                parts[-1] += child.get("text", "")
+            elif node_type == "templateVariable":
+                parts.append(child.get("attrs", {}).get("varName", ""))
+                parts.append("")
+    return CompiledTemplate(parts=tuple(parts), variables=frozenset(parts[1::2]))
+
+
 def resolve_template(template_doc: dict, variables: dict) -> str:
     """
     Walk a ProseMirror JSON document tree, substituting templateVariable
     nodes with values from `variables`. Returns plain text with paragraphs
     separated by newlines.
     """
-    if not template_doc or "content" not in template_doc:
-        return ""
-
-    paragraphs = []
-    for block in template_doc["content"]:
-        if block.get("type") == "paragraph":
-            paragraphs.append(_resolve_paragraph(block, variables))
-    return "\n".join(paragraphs)
-
-
-def _resolve_paragraph(node: dict, variables: dict) -> str:
-    parts = []
-    for child in node.get("content", []):
-        node_type = child.get("type")
-        if node_type == "text":
-            parts.append(child.get("text", ""))
-        elif node_type == "templateVariable":
-            var_name = child.get("attrs", {}).get("varName", "")
-            parts.append(variables.get(var_name, f"{{{{{var_name}}}}}"))
-    return "".join(parts)
+    return compile_template(template_doc).render(variables)
+
+
+def template_variables(template_doc: dict) -> set[str]:
+    """Names of the variables a ProseMirror JSON template substitutes."""
+    return set(compile_template(template_doc).variables)
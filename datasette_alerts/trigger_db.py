@@ -1,14 +1,30 @@
 """Queue table and trigger management for trigger-based alerts.
 
-Creates per-alert queue tables and INSERT triggers in the user's database.
+Each watched database gets one shared queue table. Every trigger alert adds
+an INSERT, UPDATE or DELETE trigger to its table that queues the row's id,
+tagged with the alert's id, and optionally a JSON payload of the row's
+columns. UPDATE triggers also store the old and new values of the watched
+columns that changed.
+
+Append-mode alerts' rows go to a separate append-only table instead, so
+they never pass through the lease-mode queue's status index.
 """
 
+import json
 import time
 from datasette.database import Database
 from datasette.filters import Filters
 
+QUEUE_TABLE = "_datasette_alerts_queue"
+APPEND_TABLE = "_datasette_alerts_queue_append"
 
-def _queue_table(alert_id: str) -> str:
+QUEUE_MODES = ("lease", "append")
+
+CHANGE_TYPES = ("insert", "update", "delete")
+
+
+def _legacy_queue_table(alert_id: str) -> str:
+    # Per-alert queue tables, replaced by QUEUE_TABLE
     return f"_datasette_alerts_queue_{alert_id}"
 
 
@@ -16,15 +32,39 @@ def _trigger_name(alert_id: str) -> str:
     return f"_datasette_alerts_trigger_{alert_id}"
 
 
-def _pk_expression(pk_columns: list[str]) -> str:
+def _pk_expression(pk_columns: list[str], row: str = "NEW") -> str:
     if len(pk_columns) == 1:
-        return f'NEW."{pk_columns[0]}"'
-    cols = ", ".join(f'NEW."{c}"' for c in pk_columns)
+        return f'{row}."{pk_columns[0]}"'
+    cols = ", ".join(f'{row}."{c}"' for c in pk_columns)
     return f"json_array({cols})"
 
 
-def _filters_to_trigger_when(filter_params: list[list[str]]) -> str:
-    """Convert Datasette filter params to a trigger WHEN clause."""
+def _json_value(row: str, column: str) -> str:
+    # JSON cannot hold BLOBs, and a failing trigger would fail the write
+    return (
+        f'CASE WHEN typeof({row}."{column}") = \'blob\' '
+        f'THEN hex({row}."{column}") ELSE {row}."{column}" END'
+    )
+
+
+def _has_queue_table(conn, table: str = QUEUE_TABLE) -> bool:
+    """Whether the queue table exists yet, as it is only created with the
+    database's first trigger alert."""
+    return (
+        conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            [table],
+        ).fetchone()
+        is not None
+    )
+
+
+def _table_columns(conn, table_name: str) -> list[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info([{table_name}])")]
+
+
+def _filters_to_trigger_when(filter_params: list[list[str]], row: str = "NEW") -> str:
+    """Convert Datasette filter params to a trigger WHEN clause on the NEW or OLD row."""
     if not filter_params:
         return ""
     filters = Filters(filter_params)
@@ -56,131 +96,490 @@ def _filters_to_trigger_when(filter_params: list[list[str]]) -> str:
         import re
 
         # Match "identifier" that is NOT preceded by NEW.
-        result = re.sub(r'(?<!NEW\.)"([^"]+)"', r'NEW."\1"', result)
-        parts.append(result)
+        result = re.sub(rf'(?<!{row}\.)"([^"]+)"', rf'{row}."\1"', result)
+        parts.append(f"({result})")
 
     return " AND ".join(parts)
 
 
+def _create_queue_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS [{QUEUE_TABLE}] (
+            id           INTEGER PRIMARY KEY AUTOINCREMENT,
+            alert_id     TEXT NOT NULL,
+            item_id      TEXT NOT NULL,
+            status       TEXT NOT NULL DEFAULT 'pending'
+                           CHECK(status IN ('pending', 'leased', 'failed', 'completed')),
+            attempts     INTEGER DEFAULT 0,
+            max_attempts INTEGER DEFAULT 5,
+            lease_until  INTEGER,
+            leased_by    TEXT,
+            created_at   INTEGER NOT NULL DEFAULT (unixepoch()),
+            completed_at INTEGER,
+            last_error   TEXT,
+            payload      TEXT,
+            changes      TEXT
+        )
+    """)
+    columns = set(_table_columns(conn, QUEUE_TABLE))
+    # Queue tables created before payloads and changes were captured
+    for column in ("payload", "changes"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE [{QUEUE_TABLE}] ADD COLUMN {column} TEXT")
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS [{QUEUE_TABLE}_fetch]
+          ON [{QUEUE_TABLE}](status, lease_until)
+    """)
+
+
+def _create_append_table(conn):
+    # Rows are only ever inserted, read in id order and truncated
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS [{APPEND_TABLE}] (
+            id           INTEGER PRIMARY KEY AUTOINCREMENT,
+            alert_id     TEXT NOT NULL,
+            item_id      TEXT NOT NULL,
+            created_at   INTEGER NOT NULL DEFAULT (unixepoch()),
+            payload      TEXT,
+            changes      TEXT
+        )
+    """)
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS [{APPEND_TABLE}_alert]
+          ON [{APPEND_TABLE}](alert_id, id)
+    """)
+
+
+def _payload_expression(
+    conn, table_name: str, payload_columns: list[str], row: str = "NEW"
+) -> str:
+    """json_object() of the row's payload columns that exist in the table."""
+    wanted = set(payload_columns)
+    pairs = ", ".join(
+        "'{}', {}".format(c.replace("'", "''"), _json_value(row, c))
+        for c in _table_columns(conn, table_name)
+        if c in wanted
+    )
+    return f"json_object({pairs})"
+
+
+def _changes_expression(columns: list[str]) -> str:
+    """JSON object of [old, new] values for the columns an UPDATE changed."""
+    selects = " UNION ALL ".join(
+        "SELECT '{}' AS name, {} AS old_value, {} AS new_value "
+        'WHERE OLD."{}" IS NOT NEW."{}"'.format(
+            c.replace("'", "''"), _json_value("OLD", c), _json_value("NEW", c), c, c
+        )
+        for c in columns
+    )
+    return (
+        "(SELECT json_group_object(name, json_array(old_value, new_value)) "
+        f"FROM ({selects}))"
+    )
+
+
+def _create_trigger(
+    conn,
+    alert_id: str,
+    table_name: str,
+    pk_columns: list[str],
+    filter_params: list[list[str]],
+    payload_columns: list[str] | None = None,
+    change_type: str = "insert",
+    watch_columns: list[str] | None = None,
+    queue_mode: str = "lease",
+):
+    if change_type not in CHANGE_TYPES:
+        raise ValueError(f"Unknown change type: {change_type}")
+    if queue_mode not in QUEUE_MODES:
+        raise ValueError(f"Unknown queue mode: {queue_mode}")
+    queue_table = APPEND_TABLE if queue_mode == "append" else QUEUE_TABLE
+    # Deleted rows are only available as OLD
+    row = "OLD" if change_type == "delete" else "NEW"
+    pk_expr = _pk_expression(pk_columns, row)
+    payload_expr = (
+        "NULL"
+        if payload_columns is None
+        else _payload_expression(conn, table_name, payload_columns, row)
+    )
+    conditions = []
+    when_clause = _filters_to_trigger_when(filter_params, row)
+    if when_clause:
+        conditions.append(when_clause)
+    event = change_type.upper()
+    changes_expr = "NULL"
+    if change_type == "update":
+        if watch_columns:
+            event += " OF " + ", ".join(f'"{c}"' for c in watch_columns)
+        columns = watch_columns or _table_columns(conn, table_name)
+        # UPDATE OF fires whenever the columns are assigned, even to the
+        # same value
+        conditions.append(
+            "(" + " OR ".join(f'OLD."{c}" IS NOT NEW."{c}"' for c in columns) + ")"
+        )
+        changes_expr = _changes_expression(columns)
+    when_sql = f"\n    WHEN {' AND '.join(conditions)}" if conditions else ""
+    alert_id_sql = "'" + alert_id.replace("'", "''") + "'"
+    conn.execute(f"DROP TRIGGER IF EXISTS [{_trigger_name(alert_id)}]")
+    conn.execute(f"""
+        CREATE TRIGGER [{_trigger_name(alert_id)}]
+        AFTER {event} ON [{table_name}]{when_sql}
+        BEGIN
+            INSERT INTO [{queue_table}] (alert_id, item_id, payload, changes, created_at)
+            VALUES (
+                {alert_id_sql}, CAST({pk_expr} AS TEXT), {payload_expr},
+                {changes_expr}, unixepoch()
+            );
+        END
+    """)
+
+
 async def create_queue_and_trigger(
     db: Database,
     alert_id: str,
     table_name: str,
     pk_columns: list[str],
     filter_params: list[list[str]] | None = None,
+    payload_columns: list[str] | None = None,
+    change_type: str = "insert",
+    watch_columns: list[str] | None = None,
+    queue_mode: str = "lease",
 ):
-    """Create a queue table and INSERT trigger in the user's database."""
-    queue_table = _queue_table(alert_id)
-    trigger_name = _trigger_name(alert_id)
-    pk_expr = _pk_expression(pk_columns)
-    when_clause = _filters_to_trigger_when(filter_params or [])
+    """Create the shared queue table if needed and the alert's trigger.
+
+    change_type is "insert", "update" or "delete". With payload_columns,
+    the trigger also stores a JSON object of those of the row's columns.
+    UPDATE triggers fire only when one of watch_columns (default: every
+    column) changes, and store the changed columns' old and new values.
+    Triggers for "append" queue_mode alerts insert into the append table.
+    Calling this again replaces the trigger.
+    """
 
     def write(conn):
         with conn:
-            conn.execute(f"""
-                CREATE TABLE IF NOT EXISTS [{queue_table}] (
-                    id           INTEGER PRIMARY KEY AUTOINCREMENT,
-                    item_id      TEXT NOT NULL,
-                    status       TEXT NOT NULL DEFAULT 'pending'
-                                   CHECK(status IN ('pending', 'leased', 'failed', 'completed')),
-                    attempts     INTEGER DEFAULT 0,
-                    max_attempts INTEGER DEFAULT 5,
-                    lease_until  INTEGER,
-                    leased_by    TEXT,
-                    created_at   INTEGER NOT NULL DEFAULT (unixepoch()),
-                    completed_at INTEGER,
-                    last_error   TEXT
-                )
-            """)
-            conn.execute(f"""
-                CREATE INDEX IF NOT EXISTS [idx_{alert_id}_fetch]
-                  ON [{queue_table}](status, lease_until)
-            """)
-
-            when_sql = f"\n    WHEN {when_clause}" if when_clause else ""
-            conn.execute(f"""
-                CREATE TRIGGER [{trigger_name}]
-                AFTER INSERT ON [{table_name}]{when_sql}
-                BEGIN
-                    INSERT INTO [{queue_table}] (item_id, created_at)
-                    VALUES (CAST({pk_expr} AS TEXT), unixepoch());
-                END
-            """)
+            _create_queue_table(conn)
+            if queue_mode == "append":
+                _create_append_table(conn)
+            _create_trigger(
+                conn,
+                alert_id,
+                table_name,
+                pk_columns,
+                filter_params or [],
+                payload_columns,
+                change_type,
+                watch_columns,
+                queue_mode,
+            )
 
     await db.execute_write_fn(write)
 
 
+async def upgrade_legacy_queue(
+    db: Database,
+    alert_id: str,
+    table_name: str,
+    pk_columns: list[str],
+    filter_params: list[list[str]] | None = None,
+) -> bool:
+    """Move an alert from its own queue table to the shared one.
+
+    Recreates the alert's trigger against the shared table, carries over
+    rows that were not completed and drops the old table. Returns False if
+    the alert had no legacy queue table.
+    """
+    legacy_table = _legacy_queue_table(alert_id)
+
+    def write(conn):
+        if not _has_queue_table(conn, legacy_table):
+            return False
+        with conn:
+            _create_queue_table(conn)
+            _create_trigger(conn, alert_id, table_name, pk_columns, filter_params or [])
+            conn.execute(
+                f"""
+                INSERT INTO [{QUEUE_TABLE}] (
+                    alert_id, item_id, status, attempts, max_attempts,
+                    lease_until, leased_by, created_at, last_error
+                )
+                SELECT ?, item_id, status, attempts, max_attempts,
+                    lease_until, leased_by, created_at, last_error
+                FROM [{legacy_table}]
+                WHERE status != 'completed'
+                ORDER BY id
+            """,
+                [alert_id],
+            )
+            conn.execute(f"DROP TABLE [{legacy_table}]")
+        return True
+
+    return await db.execute_write_fn(write)
+
+
 async def drop_queue_and_trigger(
     db: Database,
     alert_id: str,
     table_name: str,
 ):
-    """Remove queue table and trigger from the user's database."""
-    queue_table = _queue_table(alert_id)
-    trigger_name = _trigger_name(alert_id)
+    """Remove the alert's trigger and its rows in the shared queue tables."""
 
     def write(conn):
         with conn:
-            conn.execute(f"DROP TRIGGER IF EXISTS [{trigger_name}]")
-            conn.execute(f"DROP TABLE IF EXISTS [{queue_table}]")
+            conn.execute(f"DROP TRIGGER IF EXISTS [{_trigger_name(alert_id)}]")
+            conn.execute(f"DROP TABLE IF EXISTS [{_legacy_queue_table(alert_id)}]")
+            for table in (QUEUE_TABLE, APPEND_TABLE):
+                if _has_queue_table(conn, table):
+                    conn.execute(
+                        f"DELETE FROM [{table}] WHERE alert_id = ?", [alert_id]
+                    )
 
     await db.execute_write_fn(write)
 
 
+async def database_change_marker(db: Database) -> tuple | None:
+    """Identify the database's committed state as seen by a read connection.
+
+    Returns (connection id, PRAGMA data_version, file change counter), or
+    None for in-memory databases. A connection's data_version changes
+    whenever any other connection commits, so while the marker for a
+    connection repeats, nothing has been written to the database.
+    """
+    if db.is_memory or not db.path:
+        return None
+
+    def read(conn):
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        # Bytes 24-27 of the header count commits in rollback journal mode
+        with open(db.path, "rb") as fp:
+            fp.seek(24)
+            change_counter = int.from_bytes(fp.read(4), "big")
+        return id(conn), data_version, change_counter
+
+    return await db.execute_fn(read)
+
+
+async def next_queue_retry_at(db: Database) -> int | None:
+    """When the next leased or failed queue item becomes claimable again, if any."""
+
+    def read(conn):
+        if not _has_queue_table(conn):
+            return None
+        return conn.execute(f"""
+            SELECT min(lease_until) FROM [{QUEUE_TABLE}]
+            WHERE status = 'leased'
+               OR (status = 'failed' AND attempts < max_attempts)
+        """).fetchone()[0]
+
+    return await db.execute_fn(read)
+
+
+# Queue items that are waiting, or whose lease or retry delay has run out
+_CLAIMABLE = """
+    (status = 'pending'
+     OR (status = 'leased' AND lease_until < :now)
+     OR (status = 'failed' AND attempts < max_attempts AND lease_until < :now))
+"""
+
+
+async def queue_depth(db: Database) -> dict[str, dict[str, int]]:
+    """Queued rows that are not completed, counted by alert and status.
+
+    Append-mode alerts' rows that have not been truncated yet are counted
+    as "appended".
+    """
+
+    def read(conn):
+        depth: dict[str, dict[str, int]] = {}
+        if _has_queue_table(conn):
+            for alert_id, status, count in conn.execute(f"""
+                SELECT alert_id, status, count(*) FROM [{QUEUE_TABLE}]
+                WHERE status IN ('pending', 'leased', 'failed')
+                GROUP BY alert_id, status
+            """).fetchall():
+                depth.setdefault(alert_id, {})[status] = count
+        if _has_queue_table(conn, APPEND_TABLE):
+            for alert_id, count in conn.execute(f"""
+                SELECT alert_id, count(*) FROM [{APPEND_TABLE}] GROUP BY alert_id
+            """).fetchall():
+                depth.setdefault(alert_id, {})["appended"] = count
+        return depth
+
+    return await db.execute_fn(read)
+
+
+async def queue_bursts(db: Database, alert_ids: list[str]) -> dict[str, tuple]:
+    """(oldest, newest) created_at of each alert's claimable queue items."""
+
+    def read(conn):
+        if not _has_queue_table(conn):
+            return {}
+        rows = conn.execute(
+            f"""
+            SELECT alert_id, min(created_at), max(created_at)
+            FROM [{QUEUE_TABLE}]
+            WHERE {_CLAIMABLE}
+              AND alert_id IN (SELECT value FROM json_each(:alert_ids))
+            GROUP BY alert_id
+        """,
+            {"now": int(time.time()), "alert_ids": json.dumps(alert_ids)},
+        ).fetchall()
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    return await db.execute_fn(read)
+
+
 async def claim_queue_items(
     db: Database,
-    alert_id: str,
     worker_id: str,
-    limit: int = 100,
+    limit: int | None = 100,
+    alert_ids: list[str] | None = None,
+    exclude_alert_ids: list[str] | None = None,
 ) -> list[dict]:
-    """Claim pending queue items for processing."""
-    queue_table = _queue_table(alert_id)
+    """Claim pending queue items for processing, across all of the database's alerts.
+
+    alert_ids limits the claim to those alerts' items, and exclude_alert_ids
+    leaves those alerts' items in the queue. A limit of None claims every
+    claimable item.
+    """
     now = int(time.time())
     lease_until = now + 300  # 5 minute lease
 
     def write(conn):
+        if not _has_queue_table(conn):
+            return []
         with conn:
             rows = conn.execute(
                 f"""
-                UPDATE [{queue_table}]
+                UPDATE [{QUEUE_TABLE}]
                 SET status = 'leased',
-                    lease_until = ?,
-                    leased_by = ?,
+                    lease_until = :lease_until,
+                    leased_by = :worker_id,
                     attempts = attempts + 1
                 WHERE id IN (
-                    SELECT id FROM [{queue_table}]
-                    WHERE status = 'pending'
-                       OR (status = 'leased' AND lease_until < ?)
-                       OR (status = 'failed' AND attempts < max_attempts AND lease_until < ?)
+                    SELECT id FROM [{QUEUE_TABLE}]
+                    WHERE {_CLAIMABLE}
+                      AND (:alert_ids IS NULL
+                           OR alert_id IN (SELECT value FROM json_each(:alert_ids)))
+                      AND (:exclude IS NULL
+                           OR alert_id NOT IN (SELECT value FROM json_each(:exclude)))
                     ORDER BY id
-                    LIMIT ?
+                    LIMIT :limit
                 )
-                RETURNING id, item_id
+                RETURNING id, alert_id, item_id, payload, changes
             """,
-                [lease_until, worker_id, now, now, limit],
+                {
+                    "lease_until": lease_until,
+                    "worker_id": worker_id,
+                    "now": now,
+                    "alert_ids": None if alert_ids is None else json.dumps(alert_ids),
+                    "exclude": json.dumps(exclude_alert_ids)
+                    if exclude_alert_ids
+                    else None,
+                    "limit": -1 if limit is None else limit,
+                },
             ).fetchall()
-            return [{"id": r[0], "item_id": r[1]} for r in rows]
+            rows.sort(key=lambda r: r[0])
+            return [
+                {
+                    "id": r[0],
+                    "alert_id": r[1],
+                    "item_id": r[2],
+                    "payload": json.loads(r[3]) if r[3] else None,
+                    "changes": json.loads(r[4]) if r[4] else None,
+                }
+                for r in rows
+            ]
 
     return await db.execute_write_fn(write)
 
 
+async def read_queue_items(
+    db: Database, alert_id: str, after_id: int, limit: int
+) -> list[dict]:
+    """Queue items for an append-mode alert with ids after after_id, in order.
+
+    Reads only: the alert's offset in the internal database records what
+    has been processed.
+    """
+
+    def read(conn):
+        if not _has_queue_table(conn, APPEND_TABLE):
+            return []
+        rows = conn.execute(
+            f"""
+            SELECT id, alert_id, item_id, payload, changes FROM [{APPEND_TABLE}]
+            WHERE alert_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+        """,
+            [alert_id, after_id, limit],
+        ).fetchall()
+        return [
+            {
+                "id": r[0],
+                "alert_id": r[1],
+                "item_id": r[2],
+                "payload": json.loads(r[3]) if r[3] else None,
+                "changes": json.loads(r[4]) if r[4] else None,
+            }
+            for r in rows
+        ]
+
+    return await db.execute_fn(read)
+
+
+async def truncate_queue_items(
+    db: Database, offsets: dict[str, int], batch_size: int
+) -> int:
+    """Delete append-mode alerts' queue rows up to each alert's offset.
+
+    Deletes at most batch_size rows per write transaction. Returns the
+    number deleted.
+    """
+
+    def delete_batch(conn, alert_id: str, last_id: int):
+        with conn:
+            return conn.execute(
+                f"""
+                DELETE FROM [{APPEND_TABLE}]
+                WHERE id IN (
+                    SELECT id FROM [{APPEND_TABLE}]
+                    WHERE alert_id = ? AND id <= ?
+                    LIMIT ?
+                )
+            """,
+                [alert_id, last_id, batch_size],
+            ).rowcount
+
+    if not await db.execute_fn(lambda conn: _has_queue_table(conn, APPEND_TABLE)):
+        return 0
+    deleted = 0
+    for alert_id, last_id in offsets.items():
+        while True:
+            count = await db.execute_write_fn(
+                lambda conn: delete_batch(conn, alert_id, last_id)
+            )
+            deleted += count
+            if count < batch_size:
+                break
+    return deleted
+
+
 async def complete_queue_items(
     db: Database,
-    alert_id: str,
     item_ids: list[int],
     worker_id: str,
 ):
     """Mark queue items as completed."""
     if not item_ids:
         return
-    queue_table = _queue_table(alert_id)
 
     def write(conn):
         with conn:
             placeholders = ",".join("?" for _ in item_ids)
             conn.execute(
                 f"""
-                UPDATE [{queue_table}]
+                UPDATE [{QUEUE_TABLE}]
                 SET status = 'completed',
                     completed_at = unixepoch()
                 WHERE id IN ({placeholders})
@@ -192,30 +591,69 @@ async def complete_queue_items(
     await db.execute_write_fn(write)
 
 
-async def fail_queue_item(
+async def fail_queue_items(
     db: Database,
-    alert_id: str,
-    item_id: int,
+    item_ids: list[int],
     worker_id: str,
     error: str,
     retry_delay: int = 60,
 ):
-    """Mark a queue item as failed with backoff."""
-    queue_table = _queue_table(alert_id)
+    """Mark queue items as failed with backoff."""
+    if not item_ids:
+        return
     lease_until = int(time.time()) + retry_delay
 
     def write(conn):
         with conn:
+            placeholders = ",".join("?" for _ in item_ids)
             conn.execute(
                 f"""
-                UPDATE [{queue_table}]
+                UPDATE [{QUEUE_TABLE}]
                 SET status = 'failed',
                     last_error = ?,
                     lease_until = ?
-                WHERE id = ?
+                WHERE id IN ({placeholders})
                   AND leased_by = ?
             """,
-                [error, lease_until, item_id, worker_id],
+                [error, lease_until, *item_ids, worker_id],
             )
 
     await db.execute_write_fn(write)
+
+
+async def purge_queue_items(
+    db: Database,
+    completed_before: int,
+    failed_before: int,
+    batch_size: int,
+) -> int:
+    """Delete old completed and permanently failed queue items.
+
+    Deletes at most batch_size rows per write transaction, so other writers
+    to the database are never held up for long. Returns the number deleted.
+    """
+
+    def delete_batch(conn):
+        with conn:
+            return conn.execute(
+                f"""
+                DELETE FROM [{QUEUE_TABLE}]
+                WHERE id IN (
+                    SELECT id FROM [{QUEUE_TABLE}]
+                    WHERE (status = 'completed' AND completed_at < ?)
+                       OR (status = 'failed' AND attempts >= max_attempts
+                           AND lease_until < ?)
+                    LIMIT ?
+                )
+            """,
+                [completed_before, failed_before, batch_size],
+            ).rowcount
+
+    if not await db.execute_fn(_has_queue_table):
+        return 0
+    deleted = 0
+    while True:
+        count = await db.execute_write_fn(delete_batch)
+        deleted += count
+        if count < batch_size:
+            return deleted
@@ -2,9 +2,8 @@
 # Demonstrates the ConfigElement pattern for rich destination configuration.
 
 from datasette import hookimpl
-from datasette_alerts import Notifier, Message, ConfigElement
+from datasette_alerts import Notifier, Message, ConfigElement, RateLimited, SendContext
 from datasette import Response
-import httpx
 import json
 
 
@@ -90,6 +89,18 @@ async def config_js(datasette, request):
 DISCORD_ICON = '<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="currentColor" class="bi bi-discord" viewBox="0 0 16 16"><path d="M13.545 2.907a13.2 13.2 0 0 0-3.257-1.011.05.05 0 0 0-.052.025c-.141.25-.297.577-.406.833a12.2 12.2 0 0 0-3.658 0 8 8 0 0 0-.412-.833.05.05 0 0 0-.052-.025c-1.125.194-2.22.534-3.257 1.011a.04.04 0 0 0-.021.018C.356 6.024-.213 9.047.066 12.032q.003.022.021.037a13.3 13.3 0 0 0 3.995 2.02.05.05 0 0 0 .056-.019q.463-.63.818-1.329a.05.05 0 0 0-.01-.059l-.018-.011a9 9 0 0 1-1.248-.595.05.05 0 0 1-.02-.066l.015-.019q.127-.095.248-.195a.05.05 0 0 1 .051-.007c2.619 1.196 5.454 1.196 8.041 0a.05.05 0 0 1 .053.007q.121.1.248.195a.05.05 0 0 1-.004.085 8 8 0 0 1-1.249.594.05.05 0 0 0-.03.03.05.05 0 0 0 .003.041c.24.465.515.909.817 1.329a.05.05 0 0 0 .056.019 13.2 13.2 0 0 0 4.001-2.02.05.05 0 0 0 .021-.037c.334-3.451-.559-6.449-2.366-9.106a.03.03 0 0 0-.02-.019m-8.198 7.307c-.789 0-1.438-.724-1.438-1.612s.637-1.613 1.438-1.613c.807 0 1.45.73 1.438 1.613 0 .888-.637 1.612-1.438 1.612m5.316 0c-.788 0-1.438-.724-1.438-1.612s.637-1.613 1.438-1.613c.807 0 1.451.73 1.438 1.613 0 .888-.631 1.612-1.438 1.612"/></svg>'
 
 
+def _raise_for_status(response):
+    # Hand 429s to datasette-alerts, which pauses sends to the destination
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            # Missing, or an HTTP date: datasette-alerts picks the wait
+            retry_after = None
+        raise RateLimited(retry_after=retry_after)
+    response.raise_for_status()
+
+
 class DiscordNotifier(Notifier):
     slug = "discord"
     name = "Discord"
@@ -105,12 +116,27 @@ class DiscordNotifier(Notifier):
             scripts=["/-/datasette-alerts-discord/config.js"],
         )
 
-    async def send(self, config: dict, message: Message):
+    async def send(self, config: dict, message: Message, context: SendContext):
         url = config.get("webhook_url", "")
         if not url:
             return
         # https://discord.com/developers/docs/resources/webhook#execute-webhook
-        httpx.post(url, json={"content": message.text})
+        response = await context.http_client.post(url, json={"content": message.text})
+        _raise_for_status(response)
+
+    # A webhook message carries up to 10 embeds
+    max_batch_size = 10
+
+    async def send_many(self, config: dict, messages: list[Message], context: SendContext):
+        url = config.get("webhook_url", "")
+        if not url:
+            return
+        embeds = [
+            {"title": m.subject, "description": m.text} if m.subject else {"description": m.text}
+            for m in messages
+        ]
+        response = await context.http_client.post(url, json={"embeds": embeds})
+        _raise_for_status(response)
 
 
 CONFIG_JS = r"""
@@ -1,8 +1,7 @@
 # https://github.com/binwiederhier/ntfy/blob/main/web/src/img/ntfy-outline.svg
 
 from datasette import hookimpl
-from datasette_alerts import Notifier, Message
-import httpx
+from datasette_alerts import Notifier, Message, RateLimited, SendContext
 from wtforms import Form, StringField
 
 
@@ -11,6 +10,18 @@ def datasette_alerts_register_notifiers(datasette):
     return [Ntfy()]
 
 
+def _raise_for_status(response):
+    # Hand 429s to datasette-alerts, which pauses sends to the destination
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            # Missing, or an HTTP date: datasette-alerts picks the wait
+            retry_after = None
+        raise RateLimited(retry_after=retry_after)
+    response.raise_for_status()
+
+
 class Ntfy(Notifier):
     slug = "ntfy"
     name = "Ntfy"
@@ -34,7 +45,7 @@ class Ntfy(Notifier):
 
         return ConfigForm
 
-    async def send(self, config: dict, message: Message):
+    async def send(self, config: dict, message: Message, context: SendContext):
         base_url = config["base_url"]
         topic = config["topic"]
         # https://docs.ntfy.sh/publish/#publish-as-json
@@ -45,4 +56,5 @@ class Ntfy(Notifier):
         }
         if message.subject:
             payload["message"] = message.text
-        httpx.post(base_url, json=payload)
+        response = await context.http_client.post(base_url, json=payload)
+        _raise_for_status(response)
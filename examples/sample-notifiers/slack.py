@@ -1,8 +1,7 @@
 # https://icons.getbootstrap.com/icons/slack/
 
 from datasette import hookimpl
-from datasette_alerts import Notifier, Message
-import httpx
+from datasette_alerts import Notifier, Message, RateLimited, SendContext
 from wtforms import Form, StringField
 
 
@@ -12,6 +11,18 @@ def datasette_alerts_register_notifiers(datasette):
     return [SlackNotifier()]
 
 
+def _raise_for_status(response):
+    # Hand 429s to datasette-alerts, which pauses sends to the destination
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            # Missing, or an HTTP date: datasette-alerts picks the wait
+            retry_after = None
+        raise RateLimited(retry_after=retry_after)
+    response.raise_for_status()
+
+
 class SlackNotifier(Notifier):
     slug = "slack"
     name = "Slack"
@@ -31,7 +42,22 @@ class SlackNotifier(Notifier):
 
         return ConfigForm
 
-    async def send(self, config: dict, message: Message):
+    async def send(self, config: dict, message: Message, context: SendContext):
         url = config["webhook_url"]
         # https://api.slack.com/surfaces/messages#payloads
-        httpx.post(url, json={"text": message.text})
+        response = await context.http_client.post(url, json={"text": message.text})
+        _raise_for_status(response)
+
+    # A Slack message holds up to 50 blocks
+    max_batch_size = 50
+
+    async def send_many(self, config: dict, messages: list[Message], context: SendContext):
+        url = config["webhook_url"]
+        blocks = [
+            {"type": "section", "text": {"type": "mrkdwn", "text": m.text}}
+            for m in messages
+        ]
+        response = await context.http_client.post(
+            url, json={"text": messages[0].text, "blocks": blocks}
+        )
+        _raise_for_status(response)
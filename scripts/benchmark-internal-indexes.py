@@ -0,0 +1,148 @@
+"""Time the internal database's check, handler and page queries with and without
+the m007 indexes.
+
+    uv run scripts/benchmark-internal-indexes.py --logs 1000000
+
+Builds a throwaway internal database with --alerts cursor alerts spread
+over ten databases and --logs log rows spread over the alerts, then runs
+each query with the indexes dropped and again with them created.
+"""
+
+import argparse
+import asyncio
+import json
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from datasette.app import Datasette
+
+from datasette_alerts.internal_db import InternalDB
+
+INDEXES = {
+    "datasette_alerts_alert_logs_alert_logged": (
+        "datasette_alerts_alert_logs(alert_id, logged_at)"
+    ),
+    "datasette_alerts_subscriptions_alert": "datasette_alerts_subscriptions(alert_id)",
+    "datasette_alerts_alerts_database_created": (
+        "datasette_alerts_alerts(database_name, alert_created_at)"
+    ),
+}
+
+
+def populate(path: str, alerts: int, logs: int):
+    conn = sqlite3.connect(path)
+    alert_ids = [f"alert{i:07d}" for i in range(alerts)]
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO datasette_alerts_alerts(
+              id, database_name, table_name, id_columns, timestamp_column,
+              frequency, alert_type, alert_created_at
+            )
+            VALUES (?, ?, 'events', '["id"]', 'created_at', '+1 minute', 'cursor',
+              datetime('2024-01-01', printf('+%d minutes', ?)))
+            """,
+            [(alert_id, f"db{i % 10}", i) for i, alert_id in enumerate(alert_ids)],
+        )
+        conn.executemany(
+            """
+            INSERT INTO datasette_alerts_subscriptions(id, alert_id, notifier, meta)
+            VALUES (?, ?, 'bench', '{}')
+            """,
+            [
+                (f"{alert_id}-{n}", alert_id)
+                for alert_id in alert_ids
+                for n in range(2)
+            ],
+        )
+        conn.executemany(
+            """
+            INSERT INTO datasette_alerts_alert_logs(id, alert_id, logged_at, new_ids, cursor)
+            VALUES (?, ?, datetime('2024-01-01', printf('+%d seconds', ?)), ?, ?)
+            """,
+            (
+                (
+                    f"log{i:09d}",
+                    alert_ids[i % alerts],
+                    i,
+                    json.dumps([i]),
+                    f"2024-01-01 {i % 24:02d}:00:00",
+                )
+                for i in range(logs)
+            ),
+        )
+    conn.close()
+
+
+def set_indexes(path: str, enabled: bool):
+    conn = sqlite3.connect(path)
+    with conn:
+        for name, target in INDEXES.items():
+            if enabled:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+            else:
+                conn.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.execute("ANALYZE")
+    conn.close()
+
+
+def queries(internal_db: InternalDB, alert_id: str):
+    return {
+        "get_alert_for_check": lambda: internal_db.get_alert_for_check(alert_id),
+        "get_cursor_alerts_in_group": lambda: internal_db.get_cursor_alerts_in_group(
+            "db3", "events", "created_at", due_only=True
+        ),
+        "alert_subscriptions": lambda: internal_db.alert_subscriptions(alert_id),
+        "get_alert_detail": lambda: internal_db.get_alert_detail(alert_id),
+        "list_alerts_for_database": lambda: internal_db.list_alerts_for_database(
+            "db3"
+        ),
+        "get_trigger_alerts": lambda: internal_db.get_trigger_alerts(),
+    }
+
+
+async def time_queries(path: str, alert_id: str, repeat: int) -> dict[str, float]:
+    datasette = Datasette(internal=path)
+    internal_db = InternalDB(datasette.get_internal_database())
+    timings = {}
+    for name, query in queries(internal_db, alert_id).items():
+        await query()  # warm the page cache
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await query()
+            samples.append(time.perf_counter() - start)
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--alerts", type=int, default=1000)
+    parser.add_argument("--logs", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "internal.db")
+        # Startup applies the internal migrations
+        await Datasette(internal=path).invoke_startup()
+        print(f"Populating {args.alerts} alerts and {args.logs} logs...")
+        populate(path, args.alerts, args.logs)
+        alert_id = f"alert{args.alerts // 2:07d}"
+
+        set_indexes(path, False)
+        before = await time_queries(path, alert_id, args.repeat)
+        set_indexes(path, True)
+        after = await time_queries(path, alert_id, args.repeat)
+
+    print(f"{'query':<28} {'before (ms)':>12} {'after (ms)':>12}")
+    for name in before:
+        print(f"{name:<28} {before[name] * 1000:>12.2f} {after[name] * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
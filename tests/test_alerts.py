@@ -556,6 +556,61 @@ def test_build_messages_per_row_no_row_data_falls_back_to_aggregate():
     assert messages[0].text == "3 items"
 
 
+def test_compile_template_is_cached_and_lists_variables():
+    from datasette_alerts.template import compile_template
+
+    template_doc = {
+        "type": "doc",
+        "content": [
+            {
+                "type": "paragraph",
+                "content": [
+                    {"type": "text", "text": "id "},
+                    {"type": "templateVariable", "attrs": {"varName": "id"}},
+                ],
+            },
+            {
+                "type": "paragraph",
+                "content": [
+                    {"type": "templateVariable", "attrs": {"varName": "missing"}},
+                ],
+            },
+        ],
+    }
+    template = compile_template(template_doc)
+    assert template is compile_template(json.loads(json.dumps(template_doc)))
+    assert template.variables == {"id", "missing"}
+    assert template.render({"id": 7}) == "id 7\n{{missing}}"
+
+
+def test_build_messages_per_row_converts_only_used_values():
+    class Unprintable:
+        def __str__(self):
+            raise AssertionError("unused value converted")
+
+    template_doc = {
+        "type": "doc",
+        "content": [
+            {
+                "type": "paragraph",
+                "content": [
+                    {"type": "templateVariable", "attrs": {"varName": "title"}},
+                    {"type": "text", "text": " in "},
+                    {"type": "templateVariable", "attrs": {"varName": "database_name"}},
+                ],
+            }
+        ],
+    }
+    messages = _build_messages(
+        meta={"aggregate": False, "message_template": template_doc},
+        new_ids=["1"],
+        row_data=[{"title": "a", "blob": Unprintable()}],
+        table_name="events",
+        database_name="data",
+    )
+    assert [m.text for m in messages] == ["a in data"]
+
+
 # --- Stage 2: Destination CRUD tests ---
 
 
@@ -673,6 +728,46 @@ async def test_api_update_destination(datasette):
     assert dest.config == {"webhook_url": "https://new"}
 
 
+@pytest.mark.asyncio
+async def test_api_update_destination_delivery_settings(datasette):
+    """Rate limit and digest settings are kept when omitted, cleared by null."""
+    internal_db = InternalDB(datasette.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(notifier="slack", label="Paced", rate_limit=30, digest_window=60)
+    )
+    cookies = {"ds_actor": datasette.sign({"a": {"id": "root"}}, "actor")}
+
+    async def update(body):
+        response = await datasette.client.post(
+            f"/-/data/datasette-alerts/api/destinations/{dest_id}/update",
+            json={"label": "Paced", **body},
+            cookies=cookies,
+        )
+        assert response.status_code == 200
+        return await internal_db.get_destination(dest_id)
+
+    dest = await update({"rate_burst": 5})
+    assert (dest.rate_limit, dest.rate_burst, dest.digest_window) == (30, 5, 60)
+    dest = await update({"digest_window": None})
+    assert (dest.rate_limit, dest.rate_burst, dest.digest_window) == (30, 5, None)
+
+
+@pytest.mark.asyncio
+async def test_update_destination_keeps_delivery_settings_not_passed(datasette):
+    internal_db = InternalDB(datasette.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(notifier="slack", label="Paced", rate_limit=30, digest_window=60)
+    )
+
+    await internal_db.update_destination(dest_id, "Renamed", {})
+    dest = await internal_db.get_destination(dest_id)
+    assert (dest.label, dest.rate_limit, dest.digest_window) == ("Renamed", 30, 60)
+
+    await internal_db.update_destination(dest_id, "Renamed", {}, rate_limit=None)
+    dest = await internal_db.get_destination(dest_id)
+    assert (dest.rate_limit, dest.digest_window) == (None, 60)
+
+
 @pytest.mark.asyncio
 async def test_api_delete_destination(datasette):
     """Test deleting a destination via API."""
@@ -760,6 +855,109 @@ async def test_send_to_destination_notifier_not_found(datasette):
         await send_to_destination(datasette, dest_id, Message("test"))
 
 
+@pytest.mark.asyncio
+async def test_notifier_registry_is_cached_until_plugins_change(datasette):
+    """The notifier hook runs once, and again only after a plugin is registered."""
+    from datasette_alerts.registry import get_notifier_registry
+
+    registry = await get_notifier_registry(datasette)
+    assert registry["mock-notifier"] is _mock_notifier_instance
+    assert await get_notifier_registry(datasette) is registry
+
+    class ExtraNotifier(Notifier):
+        slug = "extra-notifier"
+        name = "Extra"
+
+    class ExtraPlugin:
+        @staticmethod
+        @hookimpl
+        def datasette_alerts_register_notifiers(datasette):
+            return [ExtraNotifier()]
+
+    _pm.register(ExtraPlugin(), name="test-extra-notifier-plugin")
+    try:
+        assert "extra-notifier" in await get_notifier_registry(datasette)
+    finally:
+        _pm.unregister(name="test-extra-notifier-plugin")
+    assert "extra-notifier" not in await get_notifier_registry(datasette)
+
+
+@pytest.mark.asyncio
+async def test_internal_db_reads_do_not_use_write_thread(datasette, monkeypatch):
+    """Pure reads go through the read connections, not the write queue."""
+    internal_db = InternalDB(datasette.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(notifier="mock-notifier", label="Mock", config={})
+    )
+    alert_id = await internal_db.new_alert(
+        NewAlertRouteParameters(
+            database_name="data",
+            table_name="events",
+            id_columns=["id"],
+            timestamp_column="created_at",
+            frequency="+1 hour",
+            subscriptions=[NewSubscription(destination_id=dest_id, meta={})],
+        ),
+        "2024-01-01 11:00:00",
+    )
+
+    async def no_writes(fn, *args, **kwargs):
+        raise AssertionError("read used execute_write_fn")
+
+    monkeypatch.setattr(internal_db.db, "execute_write_fn", no_writes)
+
+    assert len(await internal_db.list_destinations()) == 1
+    assert (await internal_db.get_destination(dest_id)).label == "Mock"
+    assert len(await internal_db.alert_subscriptions(alert_id)) == 1
+    assert len(await internal_db.list_alerts_for_database("data")) == 1
+    assert (await internal_db.get_alert_detail(alert_id)).id == alert_id
+    assert len(await internal_db.get_all_alerts()) == 1
+    assert (await internal_db.get_alert_for_check(alert_id)).id == alert_id
+    assert len(
+        await internal_db.get_cursor_alerts_in_group("data", "events", "created_at")
+    ) == 1
+    assert await internal_db.get_trigger_alerts() == []
+
+
+@pytest.mark.asyncio
+async def test_config_snapshot_reloads_after_mutations(datasette):
+    internal_db = InternalDB(datasette.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(notifier="mock-notifier", label="Mock", config={"a": 1})
+    )
+    alert_id = await internal_db.new_alert(
+        NewAlertRouteParameters(
+            database_name="data",
+            table_name="events",
+            alert_type="trigger",
+            id_columns=["id"],
+            subscriptions=[NewSubscription(destination_id=dest_id, meta={})],
+        )
+    )
+
+    snapshot = await internal_db.config_snapshot()
+    assert [a.alert_id for a in snapshot.trigger_alerts] == [alert_id]
+    assert snapshot.subscriptions[alert_id][0].destination_config == {"a": 1}
+    # Unchanged config is served from memory
+    assert await internal_db.config_snapshot() is snapshot
+    # Writes that are not configuration leave it cached
+    await internal_db.add_log(alert_id, ["1"], "")
+    assert await internal_db.config_snapshot() is snapshot
+
+    await internal_db.update_destination(dest_id, "Mock", {"a": 2})
+    snapshot = await internal_db.config_snapshot()
+    assert snapshot.subscriptions[alert_id][0].destination_config == {"a": 2}
+
+    await internal_db.add_subscription(alert_id, dest_id, {"aggregate": True})
+    snapshot = await internal_db.config_snapshot()
+    assert len(snapshot.subscriptions[alert_id]) == 2
+
+    await internal_db.delete_alert(alert_id)
+    snapshot = await internal_db.config_snapshot()
+    assert snapshot.trigger_alerts == []
+    assert snapshot.subscriptions == {}
+
+
 # --- Stage 6: ConfigElement tests ---
 
 
@@ -799,3 +997,21 @@ def test_notifier_with_config_element():
     assert ce is not None
     assert ce.tag == "my-wc-form"
     assert ce.scripts == ["/-/static/test/config.js"]
+
+
+@pytest.mark.asyncio
+async def test_http_client_closed_on_shutdown():
+    class FakeClient:
+        closed = False
+
+        async def aclose(self):
+            self.closed = True
+
+    ds = Datasette(memory=True)
+    await ds.invoke_startup()
+    client = ds._alerts_http_client = FakeClient()
+
+    await ds.invoke_shutdown()
+
+    assert client.closed
+    assert ds._alerts_http_client is None
@@ -0,0 +1,595 @@
+"""Tests for cursor alert scanning: keyset pages and shared group scans."""
+
+import json
+
+import pytest
+import pytest_asyncio
+import sqlite3
+
+from datasette import hookimpl
+from datasette.app import Datasette
+from datasette.plugins import pm as _pm
+
+from datasette_alerts import (
+    InternalDB,
+    NewAlertRouteParameters,
+    NewSubscription,
+    Notifier,
+)
+from datasette_alerts.handlers import cursor_scan_handler, delivery_handler
+from datasette_alerts.internal_db import NewDestination
+
+
+class _CursorTestNotifier(Notifier):
+    slug = "cursor-test-notifier"
+    name = "Cursor Test Notifier"
+
+    def __init__(self):
+        self.sent_messages = []
+
+    async def send(self, config, message):
+        self.sent_messages.append({"config": config, "message": message})
+
+
+_cursor_notifier = _CursorTestNotifier()
+
+
+class _CursorNotifierPlugin:
+    @staticmethod
+    @hookimpl
+    def datasette_alerts_register_notifiers(datasette):
+        return [_cursor_notifier]
+
+
+try:
+    _pm.register(_CursorNotifierPlugin(), name="test-cursor-notifier-plugin")
+except ValueError:
+    pass
+
+
+@pytest_asyncio.fixture
+async def datasette(tmp_path):
+    data = str(tmp_path / "data.db")
+    db = sqlite3.connect(data)
+    with db:
+        db.execute(
+            "CREATE TABLE events (id INTEGER PRIMARY KEY, title TEXT, created_at TEXT)"
+        )
+        db.execute(
+            "INSERT INTO events (title, created_at) VALUES ('Event 1', '2024-01-01 10:00:00')"
+        )
+
+    ds = Datasette(
+        [data],
+        config={
+            "permissions": {"datasette-alerts-access": {"id": "*"}},
+            "plugins": {"datasette-alerts": {"cursor_page_size": 2}},
+        },
+    )
+    ds._test_db_path = data
+    await ds.invoke_startup()
+    _cursor_notifier.sent_messages.clear()
+    yield ds
+    # The cron loop starts on the first request; stop it so the event loop
+    # can close.
+    await ds._cron_scheduler.shutdown()
+
+
+async def _create_cursor_alert(datasette, meta=None) -> str:
+    internal_db = InternalDB(datasette.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(notifier="cursor-test-notifier", label="Cursor", config={})
+    )
+    params = NewAlertRouteParameters(
+        database_name="data",
+        table_name="events",
+        id_columns=["id"],
+        timestamp_column="created_at",
+        frequency="+1 hour",
+        subscriptions=[
+            NewSubscription(destination_id=dest_id, meta=meta or {"aggregate": True})
+        ],
+    )
+    return await internal_db.new_alert(params, "2024-01-01 10:00:00")
+
+
+def _insert_events(datasette, rows):
+    db = sqlite3.connect(datasette._test_db_path)
+    with db:
+        db.executemany(
+            "INSERT INTO events (title, created_at) VALUES (?, ?)", rows
+        )
+    db.close()
+
+
+async def _check(datasette, alert_id):
+    """Make the alert due and run its group's scan, as trigger_alert_check does."""
+    await InternalDB(datasette.get_internal_database()).reset_last_check(alert_id)
+    await cursor_scan_handler(datasette, _EVENTS_GROUP)
+
+
+_EVENTS_GROUP = {
+    "database_name": "data",
+    "table_name": "events",
+    "timestamp_column": "created_at",
+}
+
+
+async def _logged_ids(datasette, alert_id) -> list[list]:
+    result = await datasette.get_internal_database().execute(
+        """
+        SELECT new_ids FROM datasette_alerts_alert_logs
+        WHERE alert_id = ? ORDER BY rowid
+        """,
+        [alert_id],
+    )
+    return [json.loads(row[0]) for row in result.rows]
+
+
+@pytest.mark.asyncio
+async def test_cursor_scan_pages_through_new_rows(datasette):
+    """New rows are scanned page by page, one log entry and send per page."""
+    alert_id = await _create_cursor_alert(datasette)
+    _insert_events(
+        datasette,
+        [
+            ("a", "2024-01-01 11:00:00"),
+            ("b", "2024-01-01 12:00:00"),
+            ("c", "2024-01-01 13:00:00"),
+        ],
+    )
+
+    await _check(datasette, alert_id)
+    await delivery_handler(datasette, {})
+
+    logs = await _logged_ids(datasette, alert_id)
+    # initial log, then pages of 2 and 1
+    assert logs == [[], [2, 3], [4]]
+    assert [m["message"].text for m in _cursor_notifier.sent_messages] == [
+        "2 new rows in events",
+        "1 new rows in events",
+    ]
+
+    internal_db = InternalDB(datasette.get_internal_database())
+    alert = await internal_db.get_alert_for_check(alert_id)
+    assert alert.cursor == "2024-01-01 13:00:00"
+    assert alert.cursor_id == 4
+
+
+@pytest.mark.asyncio
+async def test_cursor_scan_does_not_drop_rows_sharing_a_timestamp(datasette):
+    """Rows with the same timestamp split across pages are all delivered."""
+    alert_id = await _create_cursor_alert(datasette)
+    _insert_events(datasette, [(f"e{i}", "2024-01-01 11:00:00") for i in range(5)])
+
+    await _check(datasette, alert_id)
+    assert await _logged_ids(datasette, alert_id) == [[], [2, 3], [4, 5], [6]]
+
+    # A later row at the same timestamp is still picked up on the next tick
+    _insert_events(datasette, [("late", "2024-01-01 11:00:00")])
+    await _check(datasette, alert_id)
+    assert (await _logged_ids(datasette, alert_id))[-1] == [7]
+
+
+@pytest.mark.asyncio
+async def test_cursor_scan_with_no_new_rows(datasette):
+    alert_id = await _create_cursor_alert(datasette)
+
+    await _check(datasette, alert_id)
+
+    assert _cursor_notifier.sent_messages == []
+    internal_db = InternalDB(datasette.get_internal_database())
+    alert = await internal_db.get_alert_for_check(alert_id)
+    assert alert.cursor == "2024-01-01 10:00:00"
+    assert alert.cursor_id is None
+    # The check is recorded on the alert, not as another log row
+    assert alert.last_check_at is not None
+    assert await _logged_ids(datasette, alert_id) == [[]]
+
+
+@pytest.mark.asyncio
+async def test_purge_logs_keeps_latest_log(datasette):
+    from datasette_alerts.handlers import maintenance_handler
+
+    alert_id = await _create_cursor_alert(datasette)
+    internal_db = InternalDB(datasette.get_internal_database())
+    await internal_db.add_log(alert_id, [1], "2024-01-01 11:00:00", 1)
+    await internal_db.add_log(alert_id, [2], "2024-01-01 12:00:00", 2)
+    await datasette.get_internal_database().execute_write(
+        """
+        UPDATE datasette_alerts_alert_logs SET logged_at = datetime('now', '-60 days')
+        WHERE alert_id = ?
+        """,
+        [alert_id],
+    )
+    await internal_db.add_log(alert_id, [3], "2024-01-01 13:00:00", 3)
+    other = await _create_cursor_alert(datasette)
+    await datasette.get_internal_database().execute_write(
+        """
+        UPDATE datasette_alerts_alert_logs SET logged_at = datetime('now', '-60 days')
+        WHERE alert_id = ?
+        """,
+        [other],
+    )
+
+    await maintenance_handler(datasette, {})
+
+    # Old and empty logs are gone; each alert keeps its latest
+    assert await _logged_ids(datasette, alert_id) == [[3]]
+    assert await _logged_ids(datasette, other) == [[]]
+    alert = await internal_db.get_alert_for_check(other)
+    assert alert.cursor == "2024-01-01 10:00:00"
+
+
+@pytest.mark.asyncio
+async def test_group_scan_splits_rows_by_each_alert_cursor(datasette):
+    """One scan from the lowest cursor serves every alert in the group."""
+    behind = await _create_cursor_alert(datasette)
+    ahead = await _create_cursor_alert(datasette)
+    _insert_events(
+        datasette,
+        [("a", "2024-01-01 11:00:00"), ("b", "2024-01-01 12:00:00")],
+    )
+    internal_db = InternalDB(datasette.get_internal_database())
+    await internal_db.add_log(ahead, [2], "2024-01-01 11:00:00", 2)
+
+    await cursor_scan_handler(datasette, _EVENTS_GROUP)
+
+    assert (await _logged_ids(datasette, behind))[-1] == [2, 3]
+    assert (await _logged_ids(datasette, ahead))[-1] == [3]
+
+    # Both alerts were just checked, so neither is due on an immediate re-run
+    due = await internal_db.get_cursor_alerts_in_group(
+        "data", "events", "created_at", due_only=True
+    )
+    assert due == []
+
+
+@pytest.mark.asyncio
+async def test_group_scan_task_uses_shortest_frequency(datasette):
+    from datasette_alerts import _sync_cursor_scan_task
+
+    internal_db = InternalDB(datasette.get_internal_database())
+    for frequency in ["+1 hour", "+5 minutes"]:
+        await internal_db.new_alert(
+            NewAlertRouteParameters(
+                database_name="data",
+                table_name="events",
+                id_columns=["id"],
+                timestamp_column="created_at",
+                frequency=frequency,
+            ),
+            "2024-01-01 10:00:00",
+        )
+    await _sync_cursor_scan_task(datasette, "data", "events", "created_at")
+
+    task = await datasette._cron_scheduler.internal_db.get_task(
+        "alerts:cursor-scan:data/events/created_at"
+    )
+    assert json.loads(task.schedule_config) == {"seconds": 300}
+
+
+@pytest.mark.asyncio
+async def test_group_scan_task_not_rescheduled_when_unchanged(datasette):
+    """Syncing an unchanged group keeps the task's next run time."""
+    from datasette_alerts import _sync_cursor_scan_task
+
+    await _create_cursor_alert(datasette)
+    await _sync_cursor_scan_task(datasette, "data", "events", "created_at")
+    name = "alerts:cursor-scan:data/events/created_at"
+    scheduler = datasette._cron_scheduler
+    before = (await scheduler.internal_db.get_task(name)).next_run_at
+
+    await _create_cursor_alert(datasette)
+    await _sync_cursor_scan_task(datasette, "data", "events", "created_at")
+
+    assert (await scheduler.internal_db.get_task(name)).next_run_at == before
+
+
+@pytest.mark.asyncio
+async def test_group_scan_compares_cursors_with_column_collation(tmp_path):
+    """Cursors are compared by SQLite using the column's collation."""
+    data = str(tmp_path / "data.db")
+    db = sqlite3.connect(data)
+    with db:
+        db.execute(
+            "CREATE TABLE tags (id INTEGER PRIMARY KEY, name TEXT COLLATE NOCASE)"
+        )
+        db.executemany(
+            "INSERT INTO tags (name) VALUES (?)", [("b",), ("C",), ("d",)]
+        )
+    ds = Datasette([data])
+    await ds.invoke_startup()
+    internal_db = InternalDB(ds.get_internal_database())
+    alert_ids = []
+    for cursor in ["a", "B"]:
+        alert_ids.append(
+            await internal_db.new_alert(
+                NewAlertRouteParameters(
+                    database_name="data",
+                    table_name="tags",
+                    id_columns=["id"],
+                    timestamp_column="name",
+                    frequency="+1 hour",
+                ),
+                cursor,
+            )
+        )
+
+    await cursor_scan_handler(
+        ds, {"database_name": "data", "table_name": "tags", "timestamp_column": "name"}
+    )
+
+    # In Python "B" < "b"; under NOCASE the second alert has seen "b"
+    assert (await _logged_ids(ds, alert_ids[0]))[-1] == [1, 2, 3]
+    assert (await _logged_ids(ds, alert_ids[1]))[-1] == [2, 3]
+
+
+_NEW_CURSOR_ALERT = {
+    "database_name": "data",
+    "table_name": "events",
+    "alert_type": "cursor",
+    "id_columns": ["id"],
+    "timestamp_column": "created_at",
+    "frequency": "+1 hour",
+    "subscriptions": [],
+}
+
+
+@pytest.mark.asyncio
+async def test_new_cursor_alert_warns_about_table_scan(datasette):
+    cookies = {"ds_actor": datasette.sign({"a": {"id": "root"}}, "actor")}
+    response = await datasette.client.post(
+        "/-/data/datasette-alerts/api/new", json=_NEW_CURSOR_ALERT, cookies=cookies
+    )
+    assert response.status_code == 200
+    warnings = response.json()["data"]["warnings"]
+    assert len(warnings) == 1
+    assert "scans the whole table" in warnings[0]
+
+
+@pytest.mark.asyncio
+async def test_new_cursor_alert_creates_index_when_enabled(tmp_path):
+    data = str(tmp_path / "data.db")
+    db = sqlite3.connect(data)
+    with db:
+        db.execute(
+            "CREATE TABLE events (id INTEGER PRIMARY KEY, title TEXT, created_at TEXT)"
+        )
+    ds = Datasette(
+        [data],
+        config={
+            "permissions": {"datasette-alerts-access": {"id": "*"}},
+            "plugins": {"datasette-alerts": {"create_cursor_indexes": True}},
+        },
+    )
+    await ds.invoke_startup()
+
+    cookies = {"ds_actor": ds.sign({"a": {"id": "root"}}, "actor")}
+    try:
+        response = await ds.client.post(
+            "/-/data/datasette-alerts/api/new", json=_NEW_CURSOR_ALERT, cookies=cookies
+        )
+    finally:
+        await ds._cron_scheduler.shutdown()
+    assert response.json()["data"]["warnings"] == []
+
+    indexes = await ds.get_database("data").execute(
+        "SELECT name FROM pragma_index_list('events')"
+    )
+    assert [row[0] for row in indexes.rows] == [
+        "_datasette_alerts_cursor_events_created_at_id"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_cursor_scan_composite_key_uses_rowid(tmp_path):
+    """Composite keys break ties on rowid and report ids as JSON arrays."""
+    data = str(tmp_path / "data.db")
+    db = sqlite3.connect(data)
+    with db:
+        db.execute(
+            "CREATE TABLE pairs (a TEXT, b INTEGER, created_at TEXT, PRIMARY KEY (a, b))"
+        )
+        db.executemany(
+            "INSERT INTO pairs VALUES (?, ?, ?)",
+            [("x", 2, "2024-01-01 11:00:00"), ("x", 1, "2024-01-01 11:00:00")],
+        )
+    ds = Datasette(
+        [data], config={"plugins": {"datasette-alerts": {"cursor_page_size": 1}}}
+    )
+    await ds.invoke_startup()
+    internal_db = InternalDB(ds.get_internal_database())
+    alert_id = await internal_db.new_alert(
+        NewAlertRouteParameters(
+            database_name="data",
+            table_name="pairs",
+            id_columns=["a", "b"],
+            timestamp_column="created_at",
+            frequency="+1 hour",
+        ),
+        "2024-01-01 10:00:00",
+    )
+
+    await cursor_scan_handler(
+        ds,
+        {"database_name": "data", "table_name": "pairs", "timestamp_column": "created_at"},
+    )
+
+    assert await _logged_ids(ds, alert_id) == [[], ['["x",2]'], ['["x",1]']]
+    alert = await internal_db.get_alert_for_check(alert_id)
+    assert alert.cursor_id == 2
+
+
+@pytest.mark.asyncio
+async def test_cursor_scan_composite_key_without_rowid(tmp_path):
+    """WITHOUT ROWID tables are keyed on the full primary key."""
+    data = str(tmp_path / "data.db")
+    db = sqlite3.connect(data)
+    with db:
+        db.execute(
+            """
+            CREATE TABLE pairs (a TEXT, b INTEGER, created_at TEXT,
+            PRIMARY KEY (a, b)) WITHOUT ROWID
+            """
+        )
+        db.executemany(
+            "INSERT INTO pairs VALUES (?, ?, ?)",
+            [
+                ("y", 1, "2024-01-01 11:00:00"),
+                ("x", 2, "2024-01-01 11:00:00"),
+                ("x", 10, "2024-01-01 11:00:00"),
+            ],
+        )
+    ds = Datasette(
+        [data], config={"plugins": {"datasette-alerts": {"cursor_page_size": 1}}}
+    )
+    await ds.invoke_startup()
+    internal_db = InternalDB(ds.get_internal_database())
+    alert_ids = []
+    for cursor in ["2024-01-01 10:00:00", "2024-01-01 10:30:00"]:
+        alert_ids.append(
+            await internal_db.new_alert(
+                NewAlertRouteParameters(
+                    database_name="data",
+                    table_name="pairs",
+                    id_columns=["a", "b"],
+                    timestamp_column="created_at",
+                    frequency="+1 hour",
+                ),
+                cursor,
+            )
+        )
+    group = {
+        "database_name": "data",
+        "table_name": "pairs",
+        "timestamp_column": "created_at",
+    }
+
+    await cursor_scan_handler(ds, group)
+
+    # Ordered by (a, b) with b compared as an integer, one row per page
+    expected = [[], ['["x",2]'], ['["x",10]'], ['["y",1]']]
+    for alert_id in alert_ids:
+        assert await _logged_ids(ds, alert_id) == expected
+        alert = await internal_db.get_alert_for_check(alert_id)
+        assert alert.cursor_id == '["y",1]'
+
+    db = sqlite3.connect(data)
+    with db:
+        db.execute("INSERT INTO pairs VALUES ('x', 5, '2024-01-01 11:00:00')")
+        db.execute("INSERT INTO pairs VALUES ('z', 1, '2024-01-01 11:00:00')")
+    db.close()
+    for alert_id in alert_ids:
+        await internal_db.reset_last_check(alert_id)
+    await cursor_scan_handler(ds, group)
+
+    # ("x", 5) sorts before the saved cursor, so only ("z", 1) is new
+    assert (await _logged_ids(ds, alert_ids[0]))[-1] == ['["z",1]']
+
+
+@pytest.mark.asyncio
+async def test_row_data_for_composite_keys_in_chunks(tmp_path):
+    from datasette_alerts.handlers import _iter_row_data
+
+    data = str(tmp_path / "data.db")
+    db = sqlite3.connect(data)
+    with db:
+        db.execute("CREATE TABLE pairs (a TEXT, b INTEGER, v TEXT, PRIMARY KEY (a, b))")
+        db.executemany(
+            "INSERT INTO pairs VALUES (?, ?, ?)",
+            [("x", 1, "x1"), ("x", 2, "x2"), ("y", 1, "y1")],
+        )
+    ds = Datasette([data])
+    queries = []
+    database = ds.get_database("data")
+    execute = database.execute
+
+    async def counting_execute(sql, params=None):
+        queries.append(params)
+        return await execute(sql, params)
+
+    database.execute = counting_execute
+
+    # Ids as cursor and trigger alerts report them; ("x", 3) does not exist
+    ids = ['["y",1]', '["x",3]', '["x",2]']
+    rows = [row async for row in _iter_row_data(database, "pairs", ["a", "b"], ids, 2)]
+
+    assert [row["v"] for row in rows] == ["y1", "x2"]
+    assert len(queries) == 2
+
+    # Single keys compare with the column's affinity, as trigger ids are text
+    rows = [
+        row
+        async for row in _iter_row_data(
+            database, "pairs", ["rowid"], ["3", "1"], chunk_size=10
+        )
+    ]
+    assert [row["v"] for row in rows] == ["y1", "x1"]
+
+
+@pytest.mark.asyncio
+async def test_fetch_row_data_accepts_single_column_name(datasette):
+    from datasette_alerts.bg_task import _fetch_row_data
+
+    rows = await _fetch_row_data(datasette.get_database("data"), "events", "id", ["1"])
+    assert [row["title"] for row in rows] == ["Event 1"]
+
+
+@pytest.mark.parametrize("value", [0, -5, "lots"])
+def test_cursor_page_size_rejects_invalid_values(value):
+    from datasette_alerts.settings import AlertsSettings
+
+    with pytest.raises(ValueError):
+        AlertsSettings(cursor_page_size=value)
+
+
+def test_cursor_page_size_is_coerced_to_int():
+    from datasette_alerts.settings import AlertsSettings
+
+    assert AlertsSettings(cursor_page_size="50").cursor_page_size == 50
+
+
+@pytest.mark.asyncio
+async def test_row_data_fetched_once_per_firing(datasette, monkeypatch):
+    """Non-aggregate subscriptions on one alert share a single row fetch."""
+    from datasette_alerts import handlers
+
+    calls = []
+    original = handlers._fetch_row_data
+
+    async def counting_fetch(*args):
+        calls.append(args)
+        return await original(*args)
+
+    monkeypatch.setattr(handlers, "_fetch_row_data", counting_fetch)
+
+    internal_db = InternalDB(datasette.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(notifier="cursor-test-notifier", label="Cursor", config={})
+    )
+    template = {"type": "doc", "content": [{"type": "text", "text": "row"}]}
+    alert_id = await internal_db.new_alert(
+        NewAlertRouteParameters(
+            database_name="data",
+            table_name="events",
+            id_columns=["id"],
+            timestamp_column="created_at",
+            frequency="+1 hour",
+            subscriptions=[
+                NewSubscription(
+                    destination_id=dest_id,
+                    meta={"aggregate": False, "message_template": template},
+                )
+                for _ in range(3)
+            ],
+        ),
+        "2024-01-01 10:00:00",
+    )
+    _insert_events(datasette, [("a", "2024-01-01 11:00:00")])
+
+    await _check(datasette, alert_id)
+    await delivery_handler(datasette, {})
+
+    assert len(calls) == 1
+    assert len(_cursor_notifier.sent_messages) == 3
@@ -20,7 +20,11 @@ from datasette_alerts import (
     NewSubscription,
     _frequency_to_interval,
 )
-from datasette_alerts.handlers import _get_alert_types, custom_alert_handler
+from datasette_alerts.handlers import (
+    _get_alert_types,
+    custom_alert_handler,
+    delivery_handler,
+)
 from datasette_alerts.internal_db import NewDestination
 
 
@@ -279,6 +283,9 @@ async def test_custom_alert_handler_calls_check_and_sends(
     # Invoke handler
     config = {"alert_id": alert_id, "type_slug": "test-type"}
     await custom_alert_handler(datasette_instance, config)
+    # Checks only queue messages; delivery workers send them
+    assert _test_notifier_instance.sent_messages == []
+    await delivery_handler(datasette_instance, {})
 
     # AlertType.check was called once
     assert len(_mock_alert_type_instance.check_calls) == 1
@@ -681,7 +688,7 @@ async def test_cron_task_registered_on_custom_alert_create(
 async def test_cron_task_registered_for_cursor_alert(
     datasette_instance, internal_db
 ):
-    """Creating a cursor alert via API registers a cron task."""
+    """Creating a cursor alert via API registers its table's shared scan task."""
     scheduler = datasette_instance._cron_scheduler
 
     cookies = {
@@ -703,12 +710,18 @@ async def test_cron_task_registered_for_cursor_alert(
     assert response.status_code == 200
     alert_id = response.json()["data"]["alert_id"]
 
-    task_name = f"alerts:cursor:{alert_id}"
+    group = await internal_db.get_cursor_alerts_in_group("data", "events", "created_at")
+    assert [alert.id for alert in group] == [alert_id]
+    task_name = "alerts:cursor-scan:data/events/created_at"
     task = await scheduler.internal_db.get_task(task_name)
     assert task is not None
-    assert task.handler == "alerts:cursor-check"
+    assert task.handler == "alerts:cursor-scan"
     task_config = json.loads(task.config) if isinstance(task.config, str) else task.config
-    assert task_config == {"alert_id": alert_id}
+    assert task_config == {
+        "database_name": "data",
+        "table_name": "events",
+        "timestamp_column": "created_at",
+    }
 
 
 # ---------------------------------------------------------------------------
@@ -0,0 +1,273 @@
+"""Tests for concurrent notifier delivery."""
+
+import asyncio
+import importlib.util
+import pathlib
+import time
+import types
+
+import pytest
+
+from datasette_alerts import Message, Notifier, RateLimited
+from datasette_alerts.dispatch import Dispatcher, fan_out
+
+
+class _SlowNotifier(Notifier):
+    slug = "slow"
+    name = "Slow"
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send(self, config, message):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.mark.asyncio
+async def test_sends_to_different_destinations_run_concurrently():
+    notifier = _SlowNotifier()
+    dispatcher = Dispatcher(10, 1, timeout=5)
+
+    await fan_out(
+        dispatcher.send(f"dest-{i}", notifier, {}, Message("hi")) for i in range(5)
+    )
+
+    assert notifier.max_in_flight == 5
+
+
+@pytest.mark.asyncio
+async def test_per_destination_and_global_limits():
+    notifier = _SlowNotifier()
+    dispatcher = Dispatcher(10, 2, timeout=5)
+    await fan_out(dispatcher.send("one", notifier, {}, Message("hi")) for _ in range(5))
+    assert notifier.max_in_flight == 2
+
+    notifier = _SlowNotifier()
+    dispatcher = Dispatcher(3, 10, timeout=5)
+    await fan_out(
+        dispatcher.send(f"dest-{i}", notifier, {}, Message("hi")) for i in range(6)
+    )
+    assert notifier.max_in_flight == 3
+
+
+@pytest.mark.asyncio
+async def test_slow_send_times_out_without_blocking_others():
+    slow = _SlowNotifier(delay=5)
+    fast = _SlowNotifier(delay=0)
+    dispatcher = Dispatcher(10, 2, timeout=0.05)
+
+    errors = await fan_out(
+        [
+            dispatcher.send("slow", slow, {}, Message("hi")),
+            dispatcher.send("fast", fast, {}, Message("hi")),
+        ]
+    )
+
+    assert isinstance(errors[0], asyncio.TimeoutError)
+    assert errors[1] is None
+
+
+@pytest.mark.asyncio
+async def test_context_passed_only_to_notifiers_that_accept_it():
+    from datasette_alerts import SendContext
+
+    class ContextNotifier(Notifier):
+        slug = "with-context"
+        name = "With context"
+
+        async def send(self, config, message, context=None):
+            self.context = context
+
+    context_notifier = ContextNotifier()
+    plain_notifier = _SlowNotifier(delay=0)
+    context = SendContext(datasette=None)
+    dispatcher = Dispatcher(10, 2, timeout=5, context=context)
+
+    errors = await fan_out(
+        [
+            dispatcher.send("a", context_notifier, {}, Message("hi")),
+            dispatcher.send("b", plain_notifier, {}, Message("hi")),
+        ]
+    )
+
+    assert errors == [None, None]
+    assert context_notifier.context is context
+
+
+class _BatchNotifier(Notifier):
+    slug = "batch"
+    name = "Batch"
+    max_batch_size = 3
+
+    def __init__(self):
+        self.batches = []
+
+    async def send_many(self, config, messages):
+        self.batches.append([m.text for m in messages])
+
+
+@pytest.mark.asyncio
+async def test_send_many_chunks_by_max_batch_size():
+    notifier = _BatchNotifier()
+    dispatcher = Dispatcher(10, 2, timeout=5)
+
+    outcomes = await dispatcher.send_many(
+        "dest", notifier, {}, [Message(str(i)) for i in range(7)]
+    )
+
+    assert notifier.batches == [["0", "1", "2"], ["3", "4", "5"], ["6"]]
+    assert outcomes == [None] * 7
+
+
+@pytest.mark.asyncio
+async def test_default_send_many_sends_each_message():
+    class Recording(Notifier):
+        slug = "recording"
+        name = "Recording"
+
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, config, message):
+            self.sent.append(message.text)
+
+    notifier = Recording()
+    await Dispatcher(10, 2, timeout=5).send_many(
+        "dest", notifier, {}, [Message("a"), Message("b")]
+    )
+    assert notifier.sent == ["a", "b"]
+
+
+class _RateLimitedNotifier(Notifier):
+    slug = "rate-limited"
+    name = "Rate limited"
+
+    def __init__(self, retry_after, times=1):
+        self.retry_after = retry_after
+        self.times = times
+        self.calls = 0
+        self.sent = []
+
+    async def send(self, config, message):
+        self.calls += 1
+        if self.times:
+            self.times -= 1
+            raise RateLimited(retry_after=self.retry_after)
+        self.sent.append((time.monotonic(), message.text))
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_paces_sends_to_a_destination():
+    notifier = _RateLimitedNotifier(retry_after=None, times=0)
+    dispatcher = Dispatcher(10, 2, timeout=5)
+    dispatcher.set_rate_limit("dest", 600, burst=2)  # one every 0.1s
+
+    start = time.monotonic()
+    outcomes = await dispatcher.send_many(
+        "dest", notifier, {}, [Message(str(i)) for i in range(4)]
+    )
+
+    assert outcomes == [None] * 4
+    # The burst goes out at once, then one message per 0.1s
+    offsets = [sent_at - start for sent_at, _ in notifier.sent]
+    assert offsets[1] < 0.05
+    assert 0.05 < offsets[2] < offsets[3]
+    assert offsets[3] >= 0.19
+
+
+@pytest.mark.asyncio
+async def test_short_retry_after_is_waited_out():
+    notifier = _RateLimitedNotifier(retry_after=0.1)
+    dispatcher = Dispatcher(10, 2, timeout=5)
+
+    start = time.monotonic()
+    outcomes = await dispatcher.send_many("dest", notifier, {}, [Message("hi")])
+
+    assert outcomes == [None]
+    assert notifier.sent[0][0] - start >= 0.1
+
+
+@pytest.mark.asyncio
+async def test_long_retry_after_holds_back_the_rest():
+    notifier = _RateLimitedNotifier(retry_after=30)
+    other = _RateLimitedNotifier(retry_after=None, times=0)
+    dispatcher = Dispatcher(10, 2, timeout=5, max_rate_limit_wait=1)
+
+    outcomes = await dispatcher.send_many(
+        "dest", notifier, {}, [Message(str(i)) for i in range(3)]
+    )
+
+    # Nothing else is sent to the destination until the pause is over
+    assert notifier.calls == 1
+    assert all(isinstance(e, RateLimited) for e in outcomes)
+    assert all(29 < e.retry_after <= 30 for e in outcomes)
+    # Other destinations are unaffected
+    assert await dispatcher.send_many("other", other, {}, [Message("hi")]) == [None]
+
+
+def _load_sample_notifier(name):
+    path = (
+        pathlib.Path(__file__).parent.parent
+        / "examples"
+        / "sample-notifiers"
+        / f"{name}.py"
+    )
+    spec = importlib.util.spec_from_file_location(f"sample_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class _TooManyRequests:
+    status_code = 429
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def raise_for_status(self):
+        raise AssertionError("429s should raise RateLimited")
+
+
+class _FakeHttpClient:
+    def __init__(self, headers):
+        self.headers = headers
+        self.posts = 0
+
+    async def post(self, url, json):
+        self.posts += 1
+        return _TooManyRequests(self.headers)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "name,notifier_class,config",
+    [
+        ("slack", "SlackNotifier", {"webhook_url": "https://slack.test/hook"}),
+        ("discord", "DiscordNotifier", {"webhook_url": "https://discord.test/hook"}),
+        ("ntfy", "Ntfy", {"base_url": "https://ntfy.test", "topic": "alerts"}),
+    ],
+)
+@pytest.mark.parametrize("headers,retry_after", [({"Retry-After": "30"}, 30), ({}, 60)])
+async def test_sample_notifiers_raise_rate_limited_on_429(
+    name, notifier_class, config, headers, retry_after
+):
+    notifier = getattr(_load_sample_notifier(name), notifier_class)()
+    client = _FakeHttpClient(headers)
+    context = types.SimpleNamespace(http_client=client)
+    dispatcher = Dispatcher(10, 2, timeout=5, context=context, max_rate_limit_wait=1)
+
+    outcomes = await dispatcher.send_many(
+        "dest", notifier, config, [Message("a"), Message("b")]
+    )
+
+    # The destination is paused for as long as it asked, not failed
+    assert client.posts == 1
+    assert all(isinstance(e, RateLimited) for e in outcomes)
+    assert all(retry_after - 1 < e.retry_after <= retry_after for e in outcomes)
@@ -0,0 +1,370 @@
+"""Tests for the delivery outbox: leasing, retries and backoff."""
+
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from datasette import hookimpl
+from datasette.app import Datasette
+from datasette.plugins import pm as _pm
+
+from datasette_alerts import InternalDB, Notifier, RateLimited
+from datasette_alerts.handlers import delivery_handler
+from datasette_alerts.internal_db import NewDestination, NewOutboxMessage
+
+
+class _FlakyNotifier(Notifier):
+    slug = "outbox-flaky"
+    name = "Flaky"
+
+    def __init__(self):
+        self.failures_left = 0
+        self.retry_after = None
+        self.sent = []
+
+    async def send(self, config, message):
+        if self.retry_after is not None:
+            raise RateLimited(retry_after=self.retry_after)
+        if self.failures_left:
+            self.failures_left -= 1
+            raise RuntimeError("webhook down")
+        self.sent.append(message.text)
+
+
+class _BatchingNotifier(Notifier):
+    slug = "outbox-batching"
+    name = "Batching"
+    max_batch_size = 10
+
+    def __init__(self):
+        self.batches = []
+
+    async def send_many(self, config, messages):
+        self.batches.append((config, [m.text for m in messages]))
+
+
+class _SlowNotifier(Notifier):
+    slug = "outbox-slow"
+    name = "Slow"
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, config, message):
+        await asyncio.sleep(0.001)
+        self.sent.append((config.get("channel"), int(message.text)))
+
+
+_flaky = _FlakyNotifier()
+_batching = _BatchingNotifier()
+_slow = _SlowNotifier()
+
+
+class _FlakyPlugin:
+    @staticmethod
+    @hookimpl
+    def datasette_alerts_register_notifiers(datasette):
+        return [_flaky, _batching, _slow]
+
+
+try:
+    _pm.register(_FlakyPlugin(), name="test-outbox-flaky-plugin")
+except ValueError:
+    pass
+
+
+@pytest_asyncio.fixture
+async def datasette():
+    ds = Datasette(
+        memory=True,
+        config={
+            "plugins": {
+                "datasette-alerts": {"delivery_max_attempts": 2, "delivery_backoff": 60}
+            }
+        },
+    )
+    await ds.invoke_startup()
+    _flaky.failures_left = 0
+    _flaky.retry_after = None
+    _flaky.sent.clear()
+    return ds
+
+
+async def _enqueue(datasette, *texts, destination_key="d"):
+    internal_db = InternalDB(datasette.get_internal_database())
+    await internal_db.add_log(
+        "alert-1",
+        [],
+        "",
+        outbox=[
+            NewOutboxMessage(
+                notifier="outbox-flaky", destination_key=destination_key, text=text
+            )
+            for text in texts
+        ],
+    )
+
+
+async def _outbox(datasette) -> list[tuple]:
+    result = await datasette.get_internal_database().execute(
+        """
+        SELECT message_text, status, attempts,
+          next_attempt_at > datetime('now') AS backing_off
+        FROM datasette_alerts_outbox ORDER BY id
+        """
+    )
+    return [tuple(row) for row in result.rows]
+
+
+async def _make_due(datasette):
+    await datasette.get_internal_database().execute_write(
+        "UPDATE datasette_alerts_outbox SET next_attempt_at = datetime('now')"
+    )
+
+
+@pytest.mark.asyncio
+async def test_delivered_messages_leave_the_outbox_in_order(datasette):
+    await _enqueue(datasette, "one", "two", "three")
+
+    await delivery_handler(datasette, {})
+
+    assert _flaky.sent == ["one", "two", "three"]
+    assert await _outbox(datasette) == []
+
+
+@pytest.mark.asyncio
+async def test_failed_send_backs_off_then_gives_up(datasette):
+    await _enqueue(datasette, "hello")
+    _flaky.failures_left = 2
+
+    await delivery_handler(datasette, {})
+    assert await _outbox(datasette) == [("hello", "pending", 1, 1)]
+
+    # Not retried until the backoff has passed
+    await delivery_handler(datasette, {})
+    assert await _outbox(datasette) == [("hello", "pending", 1, 1)]
+
+    await _make_due(datasette)
+    await delivery_handler(datasette, {})
+    assert await _outbox(datasette) == [("hello", "failed", 2, 1)]
+    assert _flaky.sent == []
+
+
+@pytest.mark.asyncio
+async def test_retry_succeeds_after_failure(datasette):
+    await _enqueue(datasette, "hello")
+    _flaky.failures_left = 1
+
+    await delivery_handler(datasette, {})
+    await _make_due(datasette)
+    await delivery_handler(datasette, {})
+
+    assert _flaky.sent == ["hello"]
+    assert await _outbox(datasette) == []
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_reclaimed(datasette):
+    await _enqueue(datasette, "hello")
+    internal_db = InternalDB(datasette.get_internal_database())
+
+    # A worker that leased the message and died before finishing
+    assert len(await internal_db.claim_outbox_items("dead-worker", 10, 300)) == 1
+    await delivery_handler(datasette, {})
+    assert _flaky.sent == []
+
+    await datasette.get_internal_database().execute_write(
+        "UPDATE datasette_alerts_outbox SET lease_expires_at = datetime('now', '-1 second')"
+    )
+    await delivery_handler(datasette, {})
+    assert _flaky.sent == ["hello"]
+
+
+@pytest.mark.asyncio
+async def test_messages_for_one_destination_are_sent_as_a_batch(datasette):
+    internal_db = InternalDB(datasette.get_internal_database())
+    await internal_db.add_log(
+        "alert-1",
+        [],
+        "",
+        outbox=[
+            NewOutboxMessage(
+                notifier="outbox-batching",
+                destination_key=key,
+                config={"channel": key},
+                text=f"{key}-{i}",
+            )
+            for key in ("a", "b")
+            for i in range(3)
+        ],
+    )
+    _batching.batches.clear()
+
+    await delivery_handler(datasette, {})
+
+    assert sorted(_batching.batches, key=lambda b: b[0]["channel"]) == [
+        ({"channel": "a"}, ["a-0", "a-1", "a-2"]),
+        ({"channel": "b"}, ["b-0", "b-1", "b-2"]),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_send_is_deferred_without_using_an_attempt(datasette):
+    await _enqueue(datasette, "one", "two")
+    _flaky.retry_after = 120
+
+    await delivery_handler(datasette, {})
+
+    assert await _outbox(datasette) == [
+        ("one", "pending", 0, 1),
+        ("two", "pending", 0, 1),
+    ]
+    next_attempts = (
+        await datasette.get_internal_database().execute(
+            """
+            SELECT (julianday(next_attempt_at) - julianday('now')) * 86400
+            FROM datasette_alerts_outbox
+            """
+        )
+    ).rows
+    assert all(110 < row[0] <= 120 for row in next_attempts)
+
+
+@pytest.mark.asyncio
+async def test_destination_rate_limit_is_shared_across_alerts():
+    ds = Datasette(
+        memory=True,
+        config={"plugins": {"datasette-alerts": {"max_rate_limit_wait": 0.1}}},
+    )
+    await ds.invoke_startup()
+    _flaky.sent.clear()
+    _flaky.retry_after = None
+    internal_db = InternalDB(ds.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(
+            notifier="outbox-flaky", label="Paced", rate_limit=60, rate_burst=2
+        )
+    )
+    for alert_id in ("alert-1", "alert-2"):
+        await internal_db.add_log(
+            alert_id,
+            [],
+            "",
+            outbox=[
+                NewOutboxMessage(
+                    alert_id=alert_id,
+                    notifier="outbox-flaky",
+                    destination_key=dest_id,
+                    text=f"{alert_id}-{i}",
+                )
+                for i in range(2)
+            ],
+        )
+
+    await delivery_handler(ds, {})
+
+    # A burst of two, then one a second: the rest wait in the outbox
+    assert _flaky.sent == ["alert-1-0", "alert-1-1"]
+    assert await _outbox(ds) == [
+        ("alert-2-0", "pending", 0, 1),
+        ("alert-2-1", "pending", 0, 1),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_digest_destination_gets_one_message_per_window(datasette):
+    internal_db = InternalDB(datasette.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(notifier="outbox-flaky", label="Digest", digest_window=60)
+    )
+    await datasette.get_internal_database().execute_write(
+        """
+        INSERT INTO datasette_alerts_alerts(id, database_name, table_name)
+        VALUES ('alert-1', 'data', 'events'), ('alert-2', 'data', 'orders')
+        """
+    )
+    for alert_id, count in (("alert-1", 3), ("alert-2", 1), ("alert-1", 2)):
+        await internal_db.add_log(
+            alert_id,
+            [],
+            "",
+            outbox=[
+                NewOutboxMessage(
+                    alert_id=alert_id,
+                    notifier="outbox-flaky",
+                    destination_key=dest_id,
+                    text=f"{alert_id} fired",
+                )
+                for _ in range(count)
+            ],
+        )
+    # Other destinations are not held back
+    await _enqueue(datasette, "direct")
+
+    await delivery_handler(datasette, {})
+    assert _flaky.sent == ["direct"]
+
+    # Once the window has ended, one message covers all of them
+    await datasette.get_internal_database().execute_write(
+        "UPDATE datasette_alerts_digest_items SET send_after = datetime('now')"
+    )
+    await delivery_handler(datasette, {})
+    assert _flaky.sent == [
+        "direct",
+        "6 alert messages:\n- data/events: 5\n- data/orders: 1",
+    ]
+
+    # The next message opens a new window
+    await internal_db.add_log(
+        "alert-2",
+        [],
+        "",
+        outbox=[
+            NewOutboxMessage(
+                alert_id="alert-2",
+                notifier="outbox-flaky",
+                destination_key=dest_id,
+                text="again",
+            )
+        ],
+    )
+    await delivery_handler(datasette, {})
+    assert len(_flaky.sent) == 2
+
+
+@pytest.mark.asyncio
+async def test_workers_send_to_each_destination_in_order():
+    ds = Datasette(
+        memory=True,
+        config={
+            "plugins": {
+                "datasette-alerts": {"delivery_workers": 4, "delivery_batch_size": 5}
+            }
+        },
+    )
+    await ds.invoke_startup()
+    _slow.sent.clear()
+    internal_db = InternalDB(ds.get_internal_database())
+    await internal_db.add_log(
+        "alert-1",
+        [],
+        "",
+        outbox=[
+            NewOutboxMessage(
+                notifier="outbox-slow",
+                destination_key=channel,
+                config={"channel": channel},
+                text=str(i),
+            )
+            for i in range(40)
+            for channel in ("a", "b")
+        ],
+    )
+
+    await delivery_handler(ds, {})
+
+    for channel in ("a", "b"):
+        sent = [n for c, n in _slow.sent if c == channel]
+        assert sent == list(range(40))
+    assert await _outbox(ds) == []
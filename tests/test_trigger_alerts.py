@@ -0,0 +1,751 @@
+"""Tests for trigger alerts and the shared per-database queue table."""
+
+import asyncio
+import json
+import sqlite3
+import time
+import types
+
+import pytest
+import pytest_asyncio
+
+from datasette import hookimpl
+from datasette.app import Datasette
+from datasette.plugins import pm as _pm
+
+from datasette_alerts import InternalDB, NewAlertRouteParameters, Notifier
+from datasette_alerts.handlers import trigger_queue_handler
+from datasette_alerts.trigger_db import (
+    APPEND_TABLE,
+    QUEUE_TABLE,
+    create_queue_and_trigger,
+    drop_queue_and_trigger,
+    queue_depth,
+)
+
+
+class _TriggerTestNotifier(Notifier):
+    slug = "trigger-test-notifier"
+    name = "Trigger Test Notifier"
+
+    async def send(self, config, message):
+        pass
+
+
+class _TriggerNotifierPlugin:
+    @staticmethod
+    @hookimpl
+    def datasette_alerts_register_notifiers(datasette):
+        return [_TriggerTestNotifier()]
+
+
+try:
+    _pm.register(_TriggerNotifierPlugin(), name="test-trigger-notifier-plugin")
+except ValueError:
+    pass
+
+
+async def _make_datasette(tmp_path, config=None, **settings):
+    data = str(tmp_path / "data.db")
+    db = sqlite3.connect(data)
+    with db:
+        db.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, kind TEXT)")
+    ds = Datasette([data], config=config, settings=settings)
+    ds._test_db_path = data
+    await ds.invoke_startup()
+    return ds
+
+
+@pytest_asyncio.fixture
+async def datasette(tmp_path):
+    return await _make_datasette(tmp_path)
+
+
+async def _create_trigger_alert(
+    datasette, filter_params=None, queue_mode="lease"
+) -> str:
+    internal_db = InternalDB(datasette.get_internal_database())
+    alert_id = await internal_db.new_alert(
+        NewAlertRouteParameters(
+            database_name="data",
+            table_name="events",
+            alert_type="trigger",
+            id_columns=["id"],
+            filter_params=filter_params or [],
+            queue_mode=queue_mode,
+        )
+    )
+    await create_queue_and_trigger(
+        datasette.get_database("data"),
+        alert_id,
+        "events",
+        ["id"],
+        filter_params,
+        queue_mode=queue_mode,
+    )
+    return alert_id
+
+
+def _insert(datasette, *kinds):
+    db = sqlite3.connect(datasette._test_db_path)
+    with db:
+        db.executemany("INSERT INTO events (kind) VALUES (?)", [(k,) for k in kinds])
+    db.close()
+
+
+async def _logged_ids(datasette, alert_id) -> list[list]:
+    result = await datasette.get_internal_database().execute(
+        "SELECT new_ids FROM datasette_alerts_alert_logs WHERE alert_id = ? ORDER BY rowid",
+        [alert_id],
+    )
+    return [json.loads(row[0]) for row in result.rows]
+
+
+async def _tables(datasette) -> list[str]:
+    result = await datasette.get_database("data").execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"
+    )
+    return [row[0] for row in result.rows]
+
+
+@pytest.mark.asyncio
+async def test_trigger_alerts_share_one_queue_table(datasette):
+    every = await _create_trigger_alert(datasette)
+    errors = await _create_trigger_alert(datasette, [["kind__exact", "error"]])
+    _insert(datasette, "info", "error")
+
+    await trigger_queue_handler(datasette, {})
+
+    assert await _tables(datasette) == [QUEUE_TABLE, "events", "sqlite_sequence"]
+    assert await _logged_ids(datasette, every) == [["1", "2"]]
+    assert await _logged_ids(datasette, errors) == [["2"]]
+
+    # Nothing left to claim
+    await trigger_queue_handler(datasette, {})
+    assert await _logged_ids(datasette, every) == [["1", "2"]]
+
+
+@pytest.mark.asyncio
+async def test_drop_removes_only_that_alerts_rows(datasette):
+    keep = await _create_trigger_alert(datasette)
+    drop = await _create_trigger_alert(datasette)
+    _insert(datasette, "info")
+
+    await drop_queue_and_trigger(datasette.get_database("data"), drop, "events")
+
+    result = await datasette.get_database("data").execute(
+        f"SELECT alert_id FROM [{QUEUE_TABLE}]"
+    )
+    assert [row[0] for row in result.rows] == [keep]
+
+
+@pytest.mark.asyncio
+async def test_legacy_queue_table_is_upgraded_at_startup(tmp_path):
+    data = str(tmp_path / "data.db")
+    conn = sqlite3.connect(data)
+    with conn:
+        conn.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, kind TEXT)")
+    ds = Datasette([data])
+    await ds.invoke_startup()
+    internal_db = InternalDB(ds.get_internal_database())
+    alert_id = await internal_db.new_alert(
+        NewAlertRouteParameters(
+            database_name="data",
+            table_name="events",
+            alert_type="trigger",
+            id_columns=["id"],
+        )
+    )
+    # The per-alert queue table and trigger that older versions created
+    legacy = f"_datasette_alerts_queue_{alert_id}"
+    with conn:
+        conn.execute(
+            f"""CREATE TABLE [{legacy}] (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, item_id TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER DEFAULT 5, lease_until INTEGER, leased_by TEXT,
+                created_at INTEGER NOT NULL DEFAULT (unixepoch()),
+                completed_at INTEGER, last_error TEXT)"""
+        )
+        conn.execute(
+            f"""CREATE TRIGGER [_datasette_alerts_trigger_{alert_id}]
+            AFTER INSERT ON events BEGIN
+              INSERT INTO [{legacy}] (item_id) VALUES (CAST(NEW.id AS TEXT));
+            END"""
+        )
+        conn.execute("INSERT INTO events (kind) VALUES ('before')")
+
+    # Restart: the legacy queue is folded into the shared table
+    from datasette_alerts import _sync_alerts_to_cron
+
+    await _sync_alerts_to_cron(ds)
+    with conn:
+        conn.execute("INSERT INTO events (kind) VALUES ('after')")
+    conn.close()
+    await trigger_queue_handler(ds, {})
+
+    assert legacy not in await _tables(ds)
+    assert await _logged_ids(ds, alert_id) == [["1", "2"]]
+
+
+@pytest.mark.asyncio
+async def test_drain_skips_unchanged_database(tmp_path, monkeypatch):
+    from datasette_alerts import handlers
+
+    # Change markers are per read connection; with one, the drain settles
+    # after a single extra pass
+    datasette = await _make_datasette(tmp_path, num_sql_threads=1)
+
+    alert_id = await _create_trigger_alert(datasette)
+    claims = []
+    claim = handlers.claim_queue_items
+
+    async def counting_claim(db, worker_id, **kwargs):
+        claims.append(db.name)
+        return await claim(db, worker_id, **kwargs)
+
+    monkeypatch.setattr(handlers, "claim_queue_items", counting_claim)
+
+    _insert(datasette, "info")
+    await trigger_queue_handler(datasette, {})
+    assert await _logged_ids(datasette, alert_id) == [["1"]]
+
+    # Settles once the drain's own writes have been seen
+    await trigger_queue_handler(datasette, {})
+    settled = len(claims)
+    for _ in range(5):
+        await trigger_queue_handler(datasette, {})
+    assert len(claims) == settled
+
+    _insert(datasette, "error")
+    await trigger_queue_handler(datasette, {})
+    assert len(claims) > settled
+    assert await _logged_ids(datasette, alert_id) == [["1"], ["2"]]
+
+
+@pytest.mark.asyncio
+async def test_drain_retries_failed_items_when_due(datasette, monkeypatch):
+    from datasette_alerts import handlers
+
+    alert_id = await _create_trigger_alert(datasette)
+    _insert(datasette, "info")
+
+    async def broken(*args, **kwargs):
+        raise RuntimeError("render failed")
+
+    monkeypatch.setattr(handlers, "_render_for_subscriptions", broken)
+    await trigger_queue_handler(datasette, {})
+    monkeypatch.undo()
+    assert await _logged_ids(datasette, alert_id) == []
+
+    for _ in range(5):
+        await trigger_queue_handler(datasette, {})
+    assert await _logged_ids(datasette, alert_id) == []
+
+    # The database is unchanged, but the retry has come due
+    later = time.time() + 120
+    monkeypatch.setattr(handlers.time, "time", lambda: later)
+    await trigger_queue_handler(datasette, {})
+    assert await _logged_ids(datasette, alert_id) == [["1"]]
+
+
+@pytest.mark.asyncio
+async def test_maintenance_purges_old_queue_rows(datasette):
+    from datasette_alerts.handlers import maintenance_handler
+
+    alert_id = await _create_trigger_alert(datasette)
+    _insert(datasette, "a", "b", "c", "d")
+    await trigger_queue_handler(datasette, {})
+    db = datasette.get_database("data")
+    now = int(time.time())
+    await db.execute_write_many(
+        f"UPDATE [{QUEUE_TABLE}] SET status = ?, completed_at = ?, lease_until = ?, attempts = ? WHERE id = ?",
+        [
+            # Completed an hour ago: purged
+            ("completed", now - 3600, None, 1, 1),
+            # Completed just now: kept
+            ("completed", now, None, 1, 2),
+            # Failed every attempt eight days ago: purged
+            ("failed", None, now - 8 * 86400, 5, 3),
+            # Failed eight days ago but still has attempts left: kept
+            ("failed", None, now - 8 * 86400, 2, 4),
+        ],
+    )
+
+    await maintenance_handler(datasette, {})
+
+    result = await db.execute(f"SELECT id FROM [{QUEUE_TABLE}] ORDER BY id")
+    assert [row[0] for row in result.rows] == [2, 4]
+    assert await _logged_ids(datasette, alert_id) == [["1", "2", "3", "4"]]
+
+
+@pytest.mark.asyncio
+async def test_purge_deletes_in_batches(datasette, monkeypatch):
+    from datasette_alerts.trigger_db import purge_queue_items
+
+    await _create_trigger_alert(datasette)
+    _insert(datasette, *["x"] * 7)
+    db = datasette.get_database("data")
+    await db.execute_write(
+        f"UPDATE [{QUEUE_TABLE}] SET status = 'completed', completed_at = 0"
+    )
+    writes = []
+    execute_write_fn = db.execute_write_fn
+
+    async def counting_write_fn(fn, *args, **kwargs):
+        writes.append(fn)
+        return await execute_write_fn(fn, *args, **kwargs)
+
+    monkeypatch.setattr(db, "execute_write_fn", counting_write_fn)
+    assert await purge_queue_items(db, 1, 1, batch_size=3) == 7
+    assert len(writes) == 3
+
+
+def _template(*parts) -> dict:
+    """A message template document; ("var",) tuples are template variables."""
+    content = [
+        {"type": "templateVariable", "attrs": {"varName": part[0]}}
+        if isinstance(part, tuple)
+        else {"type": "text", "text": part}
+        for part in parts
+    ]
+    return {"type": "doc", "content": [{"type": "paragraph", "content": content}]}
+
+
+@pytest_asyncio.fixture
+async def api_datasette(tmp_path):
+    ds = await _make_datasette(
+        tmp_path, config={"permissions": {"datasette-alerts-access": {"id": "*"}}}
+    )
+    yield ds
+    await ds._cron_scheduler.shutdown()
+
+
+async def _post(datasette, path, body):
+    cookies = {"ds_actor": datasette.sign({"a": {"id": "root"}}, "actor")}
+    response = await datasette.client.post(
+        f"/-/data/datasette-alerts/api/{path}", json=body, cookies=cookies
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def _queued_payloads(datasette) -> list:
+    result = await datasette.get_database("data").execute(
+        f"SELECT payload FROM [{QUEUE_TABLE}] ORDER BY id"
+    )
+    return [json.loads(row[0]) if row[0] else None for row in result.rows]
+
+
+@pytest.mark.asyncio
+async def test_trigger_payload_renders_deleted_rows(api_datasette, monkeypatch):
+    from datasette_alerts import handlers
+    from datasette_alerts.internal_db import NewDestination
+
+    datasette = api_datasette
+    internal_db = InternalDB(datasette.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(notifier="trigger-test-notifier", label="Test", config={})
+    )
+    alert_id = (
+        await _post(
+            datasette,
+            "new",
+            {
+                "database_name": "data",
+                "table_name": "events",
+                "alert_type": "trigger",
+                "capture_payload": True,
+                "subscriptions": [
+                    {
+                        "destination_id": dest_id,
+                        "meta": {
+                            "aggregate": False,
+                            "message_template": _template("kind: ", ("kind",)),
+                        },
+                    }
+                ],
+            },
+        )
+    )["data"]["alert_id"]
+
+    _insert(datasette, "info", "error")
+    # Only the column the template uses is captured
+    assert await _queued_payloads(datasette) == [{"kind": "info"}, {"kind": "error"}]
+    conn = sqlite3.connect(datasette._test_db_path)
+    with conn:
+        conn.execute("DELETE FROM events")
+    conn.close()
+
+    async def no_fetch(*args, **kwargs):
+        raise AssertionError("row data read from the table")
+
+    monkeypatch.setattr(handlers, "_fetch_row_data", no_fetch)
+    await trigger_queue_handler(datasette, {})
+
+    result = await datasette.get_internal_database().execute(
+        "SELECT message_text FROM datasette_alerts_outbox WHERE alert_id = ? ORDER BY id",
+        [alert_id],
+    )
+    assert [row[0] for row in result.rows] == ["kind: info", "kind: error"]
+
+
+@pytest.mark.asyncio
+async def test_trigger_payload_follows_subscription_templates(api_datasette):
+    from datasette_alerts.internal_db import NewDestination
+
+    datasette = api_datasette
+    internal_db = InternalDB(datasette.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(notifier="trigger-test-notifier", label="Test", config={})
+    )
+    alert_id = (
+        await _post(
+            datasette,
+            "new",
+            {
+                "database_name": "data",
+                "table_name": "events",
+                "alert_type": "trigger",
+                "capture_payload": True,
+            },
+        )
+    )["data"]["alert_id"]
+    _insert(datasette, "a")
+
+    await _post(
+        datasette,
+        f"alerts/{alert_id}/subscriptions",
+        {
+            "destination_id": dest_id,
+            "meta": {
+                "aggregate": False,
+                "message_template": _template(("id",), " ", ("kind",), ("missing",)),
+            },
+        },
+    )
+    _insert(datasette, "b")
+
+    assert await _queued_payloads(datasette) == [{}, {"id": 2, "kind": "b"}]
+
+
+async def _create_via_api(datasette, dest_id, meta, **options) -> str:
+    body = {
+        "database_name": "data",
+        "table_name": "events",
+        "alert_type": "trigger",
+        "subscriptions": [{"destination_id": dest_id, "meta": meta}],
+        **options,
+    }
+    return (await _post(datasette, "new", body))["data"]["alert_id"]
+
+
+async def _outbox_texts(datasette, alert_id) -> list[str]:
+    result = await datasette.get_internal_database().execute(
+        "SELECT message_text FROM datasette_alerts_outbox WHERE alert_id = ? ORDER BY id",
+        [alert_id],
+    )
+    return [row[0] for row in result.rows]
+
+
+def _execute(datasette, sql, params=()):
+    conn = sqlite3.connect(datasette._test_db_path)
+    with conn:
+        conn.execute(sql, params)
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_update_alert_records_watched_column_diffs(api_datasette):
+    from datasette_alerts.internal_db import NewDestination
+
+    datasette = api_datasette
+    internal_db = InternalDB(datasette.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(notifier="trigger-test-notifier", label="Test", config={})
+    )
+    alert_id = await _create_via_api(
+        datasette,
+        dest_id,
+        {
+            "aggregate": False,
+            "message_template": _template(
+                ("id",),
+                ": ",
+                ("old.kind",),
+                " -> ",
+                ("new.kind",),
+                " (",
+                ("changed_columns",),
+                ")",
+            ),
+        },
+        change_type="update",
+        watch_columns=["kind"],
+    )
+    _insert(datasette, "open", "open")
+    _execute(datasette, "UPDATE events SET kind = 'closed' WHERE id = 2")
+    # Assigning the same value is not a change
+    _execute(datasette, "UPDATE events SET kind = 'open' WHERE id = 1")
+
+    result = await datasette.get_database("data").execute(
+        f"SELECT item_id, changes FROM [{QUEUE_TABLE}]"
+    )
+    assert [(row[0], json.loads(row[1])) for row in result.rows] == [
+        ("2", {"kind": ["open", "closed"]})
+    ]
+
+    await trigger_queue_handler(datasette, {})
+    assert await _outbox_texts(datasette, alert_id) == ["2: open -> closed (kind)"]
+
+
+@pytest.mark.asyncio
+async def test_delete_alert_reports_deleted_rows(api_datasette):
+    from datasette_alerts.internal_db import NewDestination
+
+    datasette = api_datasette
+    internal_db = InternalDB(datasette.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(notifier="trigger-test-notifier", label="Test", config={})
+    )
+    counts = await _create_via_api(datasette, dest_id, {}, change_type="delete")
+    rows = await _create_via_api(
+        datasette,
+        dest_id,
+        {"aggregate": False, "message_template": _template("gone: ", ("kind",))},
+        change_type="delete",
+        filter_params=[["kind__exact", "error"]],
+    )
+    _insert(datasette, "info", "error")
+    _execute(datasette, "DELETE FROM events")
+
+    await trigger_queue_handler(datasette, {})
+    assert await _outbox_texts(datasette, counts) == ["2 rows deleted from events"]
+    assert await _outbox_texts(datasette, rows) == ["gone: error"]
+
+
+@pytest.mark.asyncio
+async def test_watch_columns_validated(api_datasette):
+    cookies = {"ds_actor": api_datasette.sign({"a": {"id": "root"}}, "actor")}
+    for options, error in [
+        ({"watch_columns": ["kind"]}, "watch_columns requires change_type update"),
+        (
+            {"change_type": "update", "watch_columns": ["nope"]},
+            "Unknown columns: nope",
+        ),
+        ({"debounce_max": 60}, "debounce_max requires debounce_seconds"),
+        (
+            {"debounce_seconds": 5, "queue_mode": "append"},
+            "debounce_seconds requires queue_mode lease",
+        ),
+    ]:
+        response = await api_datasette.client.post(
+            "/-/data/datasette-alerts/api/new",
+            json={
+                "database_name": "data",
+                "table_name": "events",
+                "alert_type": "trigger",
+                **options,
+            },
+            cookies=cookies,
+        )
+        assert response.status_code == 400
+        assert response.json()["error"] == error
+
+
+@pytest.mark.asyncio
+async def test_debounced_alert_sends_one_message_per_burst(api_datasette, monkeypatch):
+    from datasette_alerts import handlers
+    from datasette_alerts.internal_db import NewDestination
+
+    datasette = api_datasette
+    internal_db = InternalDB(datasette.get_internal_database())
+    dest_id = await internal_db.create_destination(
+        NewDestination(notifier="trigger-test-notifier", label="Test", config={})
+    )
+    alert_id = await _create_via_api(
+        datasette, dest_id, {}, debounce_seconds=30, debounce_max=300
+    )
+    # More rows than one claim takes
+    _insert(datasette, *["info"] * 150)
+
+    await trigger_queue_handler(datasette, {})
+    await trigger_queue_handler(datasette, {})
+    assert await _outbox_texts(datasette, alert_id) == []
+
+    # Quiet for longer than debounce_seconds: the unchanged database is
+    # checked again, and the whole burst goes out at once
+    later = time.time() + 31
+    monkeypatch.setattr(handlers.time, "time", lambda: later)
+    await trigger_queue_handler(datasette, {})
+    monkeypatch.undo()
+    assert await _outbox_texts(datasette, alert_id) == ["150 new rows in events"]
+    assert len((await _logged_ids(datasette, alert_id))[0]) == 150
+
+    # Rows that keep arriving are sent once the oldest has waited debounce_max
+    _insert(datasette, "a", "b")
+    await trigger_queue_handler(datasette, {})
+    assert len(await _outbox_texts(datasette, alert_id)) == 1
+    _execute(
+        datasette,
+        f"UPDATE [{QUEUE_TABLE}] SET created_at = unixepoch() - 301"
+        f" WHERE id = (SELECT min(id) FROM [{QUEUE_TABLE}] WHERE status = 'pending')",
+    )
+    await trigger_queue_handler(datasette, {})
+    assert (await _outbox_texts(datasette, alert_id))[1:] == ["2 new rows in events"]
+
+
+async def _drain_datasette(tmp_path, **plugin_config):
+    return await _make_datasette(
+        tmp_path, config={"plugins": {"datasette-alerts": plugin_config}}
+    )
+
+
+@pytest.mark.asyncio
+async def test_drain_empties_queue_in_adaptive_batches(tmp_path, monkeypatch):
+    from datasette_alerts import handlers
+    from datasette_alerts.handlers import _trigger_drain_state
+
+    datasette = await _drain_datasette(tmp_path, trigger_batch_size=50)
+    alert_id = await _create_trigger_alert(datasette)
+    _insert(datasette, *["info"] * 500)
+
+    # A clock that never moves makes every batch quick, so batch sizes do
+    # not depend on how fast this machine is
+    monkeypatch.setattr(
+        handlers, "time", types.SimpleNamespace(monotonic=lambda: 0.0, time=time.time)
+    )
+    await trigger_queue_handler(datasette, {})
+
+    batches = [len(ids) for ids in await _logged_ids(datasette, alert_id)]
+    # Quick full batches double in size until the queue is empty
+    assert batches == [50, 100, 200, 150]
+    state = _trigger_drain_state(datasette, "data")
+    assert state["batch_size"] == 400
+    assert state["last_drain"]["items"] == 500
+    assert state["last_drain"]["backlog"] is False
+
+
+@pytest.mark.asyncio
+async def test_drain_stops_at_time_budget_and_shrinks_slow_batches(
+    tmp_path, monkeypatch
+):
+    from datasette_alerts import handlers
+    from datasette_alerts.handlers import _trigger_drain_state
+
+    datasette = await _drain_datasette(
+        tmp_path, trigger_batch_size=100, trigger_drain_budget=0.5
+    )
+    alert_id = await _create_trigger_alert(datasette)
+    _insert(datasette, *["info"] * 250)
+
+    process = handlers._process_trigger_items
+
+    async def slow_process(*args):
+        await asyncio.sleep(0.3)
+        return await process(*args)
+
+    monkeypatch.setattr(handlers, "_process_trigger_items", slow_process)
+    await trigger_queue_handler(datasette, {})
+
+    state = _trigger_drain_state(datasette, "data")
+    # Over budget after two batches; each took longer than the target
+    assert [len(ids) for ids in await _logged_ids(datasette, alert_id)] == [100, 50]
+    assert state["batch_size"] == 25
+    assert state["last_drain"]["backlog"] is True
+
+    # The rest is picked up on the next run
+    monkeypatch.undo()
+    await trigger_queue_handler(datasette, {})
+    assert sum(len(ids) for ids in await _logged_ids(datasette, alert_id)) == 250
+
+
+@pytest.mark.asyncio
+async def test_queue_stats_reports_depths(api_datasette):
+    datasette = api_datasette
+    alert_id = await _create_trigger_alert(datasette)
+    _insert(datasette, "a", "b", "c")
+
+    cookies = {"ds_actor": datasette.sign({"a": {"id": "root"}}, "actor")}
+    response = await datasette.client.get(
+        "/-/data/datasette-alerts/api/queue-stats", cookies=cookies
+    )
+    data = response.json()["data"]
+    assert data["trigger_queue"] == {alert_id: {"pending": 3}}
+    assert data["drain"] == {"batch_size": 100, "last_drain": None}
+
+    await trigger_queue_handler(datasette, {})
+    response = await datasette.client.get(
+        "/-/data/datasette-alerts/api/queue-stats", cookies=cookies
+    )
+    data = response.json()["data"]
+    assert data["trigger_queue"] == {}
+    assert data["drain"]["last_drain"]["items"] == 3
+
+
+@pytest.mark.asyncio
+async def test_append_mode_tracks_an_offset_instead_of_updating_rows(
+    datasette, monkeypatch
+):
+    from datasette_alerts import handlers
+    from datasette_alerts.handlers import maintenance_handler
+
+    append_id = await _create_trigger_alert(datasette, queue_mode="append")
+    lease_id = await _create_trigger_alert(datasette)
+    internal_db = InternalDB(datasette.get_internal_database())
+    db = datasette.get_database("data")
+
+    async def queue_rows(alert_id):
+        result = await db.execute(
+            f"SELECT item_id, status, attempts FROM [{QUEUE_TABLE}]"
+            " WHERE alert_id = ? ORDER BY id",
+            [alert_id],
+        )
+        return [tuple(row) for row in result.rows]
+
+    async def appended_rows(alert_id):
+        result = await db.execute(
+            f"SELECT item_id FROM [{APPEND_TABLE}] WHERE alert_id = ? ORDER BY id",
+            [alert_id],
+        )
+        return [row[0] for row in result.rows]
+
+    _insert(datasette, "a", "b", "c")
+    # Append-mode rows never reach the lease queue, so they are not pending
+    assert await queue_rows(append_id) == []
+    assert await queue_depth(db) == {
+        append_id: {"appended": 3},
+        lease_id: {"pending": 3},
+    }
+    await trigger_queue_handler(datasette, {})
+
+    assert await _logged_ids(datasette, append_id) == [["1", "2", "3"]]
+    assert await _logged_ids(datasette, lease_id) == [["1", "2", "3"]]
+    # Append-mode rows are left as inserted; lease-mode rows are completed
+    assert await appended_rows(append_id) == ["1", "2", "3"]
+    assert {row[1] for row in await queue_rows(lease_id)} == {"completed"}
+    offset = (await internal_db.queue_offsets([append_id]))[append_id]
+    assert offset > 0
+
+    # A failed batch leaves the offset alone and is retried after a backoff
+    async def broken(*args, **kwargs):
+        raise RuntimeError("render failed")
+
+    _insert(datasette, "d")
+    monkeypatch.setattr(handlers, "_render_for_subscriptions", broken)
+    await trigger_queue_handler(datasette, {})
+    monkeypatch.undo()
+    assert (await internal_db.queue_offsets([append_id]))[append_id] == offset
+    assert await _logged_ids(datasette, append_id) == [["1", "2", "3"]]
+
+    later = time.time() + 120
+    monkeypatch.setattr(handlers.time, "time", lambda: later)
+    await trigger_queue_handler(datasette, {})
+    monkeypatch.undo()
+    assert await _logged_ids(datasette, append_id) == [["1", "2", "3"], ["4"]]
+
+    # Processed rows are truncated in bulk
+    await maintenance_handler(datasette, {})
+    assert await appended_rows(append_id) == []
+    # Recently completed lease-mode rows are kept for queue_completed_retention
+    assert len(await queue_rows(lease_id)) == 4